@@ -0,0 +1,323 @@
+"""
+Admission Control Module for TCLD Dashboard
+Keeps one busy session from starving the others: a global cap on concurrent warehouse
+queries with a fair (round-robin per session) queue, a per-callback in-flight limit in each
+session that collapses repeated calls to the latest one, and load shedding
+
+Under overload (queue deeper than ADMISSION_SHED_DEPTH, a full queue or a queue timeout)
+cached queries serve their last, possibly expired, result instead of queueing (see cache.py).
+Streamed exports hold their connection for the whole download, so they go through a
+separate gate (EXPORT_MAX_CONCURRENCY) instead of taking warehouse slots from callbacks.
+Counters and gauges are exported in Prometheus text format at /metrics.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Blueprint, Response
+
+logger = logging.getLogger(__name__)
+
+# Admission configuration
+WAREHOUSE_MAX_CONCURRENCY = int(os.getenv("WAREHOUSE_MAX_CONCURRENCY", "4"))
+WAREHOUSE_QUEUE_MAX = int(os.getenv("WAREHOUSE_QUEUE_MAX", "32"))
+WAREHOUSE_QUEUE_TIMEOUT_SECONDS = float(os.getenv("WAREHOUSE_QUEUE_TIMEOUT_SECONDS", "20"))
+ADMISSION_SHED_DEPTH = int(os.getenv("ADMISSION_SHED_DEPTH", "8"))
+SESSION_MAX_INFLIGHT = int(os.getenv("SESSION_MAX_INFLIGHT", "2"))
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "1"))
+EXPORT_QUEUE_MAX = int(os.getenv("EXPORT_QUEUE_MAX", "8"))
+SESSION_COOKIE = os.getenv("SESSION_COOKIE", "tcld_session")
+SESSION_TRACKED_MAX = 10000
+
+# Work outside a request (pre-warm, live polling, area index) queues as one session
+BACKGROUND_SESSION = "background"
+
+COUNTERS = (
+    "warehouse_admitted_total",
+    "warehouse_queued_total",
+    "warehouse_rejected_total",
+    "warehouse_timeouts_total",
+    "export_admitted_total",
+    "export_queued_total",
+    "export_rejected_total",
+    "export_timeouts_total",
+    "session_collapsed_total",
+    "session_degraded_total",
+)
+
+_counters = Counter({name: 0 for name in COUNTERS})  # metric name -> count
+_counters_lock = threading.Lock()
+_local = threading.local()  # per-thread count of shed queries and degraded flag
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+class Rejected(Exception):
+    """A call was not admitted (superseded by a newer call)"""
+
+
+def count(name, amount=1):
+    """Increment a metrics counter"""
+    with _counters_lock:
+        _counters[name] += amount
+
+
+def current_session():
+    """Session of the current request (cookie, else client address); background otherwise"""
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return BACKGROUND_SESSION
+    return request.cookies.get(SESSION_COOKIE) or request.remote_addr or "anonymous"
+
+
+def assign_session(response):
+    """after_request hook: give browsers without one a session cookie"""
+    from flask import request
+
+    if SESSION_COOKIE not in request.cookies:
+        response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly=True, samesite="Lax")
+    return response
+
+
+class FairGate:
+    """Concurrency cap whose waiters are admitted round-robin across sessions
+
+    A session with twenty queued queries gets one slot per turn, like every other session.
+    Counters are named after the gate (warehouse_admitted_total, export_admitted_total, ...).
+    """
+
+    def __init__(self, limit, queue_max, timeout, name="warehouse"):
+        self.name = name
+        self.limit = limit
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self.active = 0
+        self._queues = OrderedDict()  # session -> deque of waiting tickets, in turn order
+        self._cond = threading.Condition()
+
+    def depth(self):
+        """Number of queued waiters"""
+        with self._cond:
+            return sum(len(tickets) for tickets in self._queues.values())
+
+    def acquire(self, session):
+        """Take a slot, waiting for this session's turn; False if the queue is full or the wait times out"""
+        with self._cond:
+            if self.active < self.limit and not self._queues:
+                self.active += 1
+                count(f"{self.name}_admitted_total")
+                return True
+            if sum(len(tickets) for tickets in self._queues.values()) >= self.queue_max:
+                count(f"{self.name}_rejected_total")
+                return False
+
+            ticket = {"granted": False}
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._cond.wait_for(lambda: ticket["granted"], self.timeout)
+            if ticket["granted"]:
+                count(f"{self.name}_admitted_total")
+                count(f"{self.name}_queued_total")
+                return True
+
+            self._queues[session].remove(ticket)
+            if not self._queues[session]:
+                del self._queues[session]
+            count(f"{self.name}_timeouts_total")
+            return False
+
+    def release(self):
+        """Free a slot and hand it to the next session in turn"""
+        with self._cond:
+            self.active -= 1
+            if self._queues and self.active < self.limit:
+                session, tickets = next(iter(self._queues.items()))
+                tickets.popleft()["granted"] = True
+                self.active += 1
+                # The session goes to the back of the line (or leaves it)
+                del self._queues[session]
+                if tickets:
+                    self._queues[session] = tickets
+                self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, session=None):
+        """with gate.slot() as admitted: ... (admitted is False when the query should be shed)"""
+        admitted = not getattr(_local, "degraded", False) and self.acquire(session or current_session())
+        if not admitted:
+            _local.sheds = sheds() + 1
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+
+warehouse_gate = FairGate(WAREHOUSE_MAX_CONCURRENCY, WAREHOUSE_QUEUE_MAX, WAREHOUSE_QUEUE_TIMEOUT_SECONDS)
+export_gate = FairGate(EXPORT_MAX_CONCURRENCY, EXPORT_QUEUE_MAX, WAREHOUSE_QUEUE_TIMEOUT_SECONDS, name="export")
+
+
+def sheds():
+    """Number of queries shed on this thread so far (compare before and after a call)"""
+    return getattr(_local, "sheds", 0)
+
+
+def shedding():
+    """True when the warehouse queue is deep enough that cached results should be served as is"""
+    return getattr(_local, "degraded", False) or warehouse_gate.depth() >= ADMISSION_SHED_DEPTH
+
+
+@contextmanager
+def degraded():
+    """Within the block, warehouse queries are shed and cached queries serve expired results"""
+    previous = getattr(_local, "degraded", False)
+    _local.degraded = True
+    try:
+        yield
+    finally:
+        _local.degraded = previous
+
+
+class _SessionState:
+    """In-flight count and latest call generation per callback, for one session"""
+
+    def __init__(self):
+        self.inflight = Counter()
+        self.generations = {}
+        self.cond = threading.Condition()
+
+
+_sessions = OrderedDict()  # session -> _SessionState, least recently active first
+_sessions_lock = threading.Lock()
+
+
+def _session_state(session):
+    """State of a session, forgetting the least recently active ones beyond SESSION_TRACKED_MAX"""
+    with _sessions_lock:
+        state = _sessions.get(session)
+        if state is None:
+            state = _sessions[session] = _SessionState()
+            while len(_sessions) > SESSION_TRACKED_MAX:
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(session)
+        return state
+
+
+@contextmanager
+def session_slot(name, session=None):
+    """Run at most SESSION_MAX_INFLIGHT calls of one callback per session, collapsing waiters to the latest
+
+    A newer call to the same callback supersedes older waiting ones, which raise Rejected.
+    A call still waiting after WAREHOUSE_QUEUE_TIMEOUT_SECONDS runs degraded (cached results only).
+    """
+    state = _session_state(session or current_session())
+    with state.cond:
+        generation = state.generations.get(name, 0) + 1
+        state.generations[name] = generation
+        state.cond.notify_all()  # older waiters of this callback see they are superseded
+        admitted = state.cond.wait_for(
+            lambda: state.generations[name] != generation or state.inflight[name] < SESSION_MAX_INFLIGHT,
+            WAREHOUSE_QUEUE_TIMEOUT_SECONDS,
+        )
+        if state.generations[name] != generation:
+            count("session_collapsed_total")
+            raise Rejected(f"{name} superseded by a newer call")
+        if admitted:
+            state.inflight[name] += 1
+
+    if not admitted:
+        count("session_degraded_total")
+        logger.info(f"{name} timed out waiting for its in-flight limit; running from cached results")
+        with degraded():
+            yield
+        return
+
+    try:
+        yield
+    finally:
+        with state.cond:
+            state.inflight[name] -= 1
+            state.cond.notify_all()
+
+
+def latest_only(name):
+    """Callback decorator: per-session in-flight limit with collapse to the latest call
+
+    A superseded call leaves its outputs unchanged (PreventUpdate); the newer call updates them.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            from dash.exceptions import PreventUpdate
+
+            try:
+                with session_slot(name):
+                    return func(*args, **kwargs)
+            except Rejected as e:
+                logger.debug(f"Callback not admitted: {e}")
+                raise PreventUpdate
+
+        return wrapper
+
+    return decorator
+
+
+def metrics():
+    """Current admission gauges and counters"""
+    with warehouse_gate._cond:
+        active = warehouse_gate.active
+        queued = sum(len(tickets) for tickets in warehouse_gate._queues.values())
+        queued_sessions = len(warehouse_gate._queues)
+    with export_gate._cond:
+        export_active = export_gate.active
+        export_queued = sum(len(tickets) for tickets in export_gate._queues.values())
+    with _sessions_lock:
+        states = list(_sessions.values())
+    inflight = 0
+    for state in states:
+        with state.cond:
+            inflight += sum(state.inflight.values())
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        "warehouse_active": active,
+        "warehouse_limit": warehouse_gate.limit,
+        "warehouse_queue_depth": queued,
+        "warehouse_queued_sessions": queued_sessions,
+        "export_active": export_active,
+        "export_limit": export_gate.limit,
+        "export_queue_depth": export_queued,
+        "session_inflight": inflight,
+        **counters,
+    }
+
+
+def metrics_text(extra=None):
+    """Prometheus text exposition of metrics() plus extra {name: value} gauges"""
+    lines = []
+    for name, value in sorted(dict(metrics(), **(extra or {})).items()):
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE tcld_{name} {kind}")
+        lines.append(f"tcld_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+@metrics_bp.route("/metrics")
+def metrics_endpoint():
+    """Admission and cache metrics for scraping"""
+    import cache
+
+    stats = cache.stats()
+    extra = {
+        "cache_entries": stats["entries"],
+        "cache_bytes": stats["bytes"],
+        "cache_stale_served_total": stats["stale_served"],
+    }
+    return Response(metrics_text(extra), mimetype="text/plain; version=0.0.4")
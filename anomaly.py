@@ -0,0 +1,261 @@
+"""
+Anomaly Detection Module for TCLD Dashboard
+Vectorized spike detection over EA Ptag readings per metercode (ptagId):
+rolling z-score, rolling robust (median/MAD) score and an hour-of-week seasonal baseline
+
+All statistics are computed with pandas/NumPy column operations (no per-row Python loops).
+Baselines only use earlier readings, so a spike does not hide itself. Detection can run
+incrementally: pass the state returned by the previous call together with new readings only.
+
+The rolling median and MAD are a remedian: each meter's readings are cut into blocks of
+ANOMALY_MEDIAN_BLOCK, and a reading's median is the median of the block medians of the
+previous window. An exact rolling median (ANOMALY_MEDIAN_BLOCK=1) dominated the run time.
+"""
+
+import os
+
+# Detection configuration
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "96"))  # readings (one day of 15-min data)
+ANOMALY_MIN_PERIODS = int(os.getenv("ANOMALY_MIN_PERIODS", "12"))
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "4.0"))
+ANOMALY_SEASONAL_MIN_COUNT = int(os.getenv("ANOMALY_SEASONAL_MIN_COUNT", "3"))
+ANOMALY_MEDIAN_BLOCK = int(os.getenv("ANOMALY_MEDIAN_BLOCK", "8"))  # readings; 1 = exact median
+
+MAD_SCALE = 1.4826  # MAD to standard deviation for normally distributed data
+HOURS_PER_WEEK = 168
+
+
+def _epoch_ms(series):
+    """Accept epoch-ms integers, datetimes or ISO strings"""
+    import numpy as np
+    import pandas as pd
+
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype(np.int64)
+    return pd.to_datetime(series).astype("datetime64[ms]").astype(np.int64)
+
+
+def hour_of_week(timestamps_ms):
+    """Hour of week (0 = Monday 00:00) for epoch-ms timestamps"""
+    import numpy as np
+
+    hours = np.asarray(timestamps_ms, dtype=np.int64) // 3_600_000
+    # 1970-01-01 was a Thursday, i.e. hour 72 of its week
+    return ((hours + 72) % HOURS_PER_WEEK).astype(np.int16)
+
+
+def _positions(group_codes):
+    """Position of each row within its meter's run (rows sorted by meter)"""
+    import numpy as np
+
+    if not len(group_codes):
+        return np.zeros(0, dtype=np.int64)
+    starts = np.r_[True, group_codes[1:] != group_codes[:-1]]
+    run_start = np.maximum.accumulate(np.where(starts, np.arange(len(group_codes)), 0))
+    return np.arange(len(group_codes)) - run_start
+
+
+def _grouped_rolling(values, group_codes, window, min_periods, func):
+    """Rolling statistic over the previous `window` readings of each meter
+
+    Rows are sorted by meter then time. One rolling pass runs over the whole column, and
+    results whose window reaches back into the previous meter are discarded, which is
+    equivalent to a per-meter rolling but far faster than groupby().rolling().
+    """
+    import numpy as np
+    import pandas as pd
+
+    starts = np.r_[True, group_codes[1:] != group_codes[:-1]]
+    position = _positions(group_codes)
+
+    # Shift by one so the window holds only earlier readings of the same meter
+    previous = pd.Series(values).shift(1)
+    previous[starts] = np.nan
+    rolled = getattr(previous.rolling(window, min_periods=min_periods), func)().to_numpy(copy=True)
+
+    # Windows starting before this meter's first reading mixed in another meter: recompute
+    # them with an expanding statistic restricted to the meter's own earlier readings
+    mixed = position < window
+    if mixed.any():
+        head = previous[mixed]
+        expanding = getattr(head.groupby(group_codes[mixed]).expanding(min_periods=min_periods), func)()
+        rolled[mixed] = expanding.reset_index(level=0, drop=True).reindex(head.index).to_numpy()
+    return rolled
+
+
+def _grouped_rolling_median(values, group_codes, window, min_periods, block=ANOMALY_MEDIAN_BLOCK):
+    """Remedian of the previous `window` readings of each meter, in whole blocks of `block`
+
+    Each meter's run is cut into blocks of block readings (by position in the run); a
+    reading's median is the median of the block medians of the window // block blocks
+    before its own block. block=1 is the exact rolling median.
+    """
+    import numpy as np
+
+    if block <= 1 or not len(values):
+        return _grouped_rolling(values, group_codes, window, min_periods, "median")
+
+    position = _positions(group_codes)
+    first_block = np.r_[True, (group_codes[1:] != group_codes[:-1]) | (position[1:] % block == 0)]
+    block_of = np.cumsum(first_block) - 1
+    # Blocks as rows of a grid (NaN where a block is short or a reading missing), sorted
+    # row by row so the NaNs go last and the middle of the valid ones is the median
+    grid = np.full((block_of[-1] + 1, block), np.nan)
+    grid[block_of, position % block] = values
+    grid.sort(axis=1)
+    valid = block - np.isnan(grid).sum(axis=1)
+    rows = np.arange(len(grid))
+    with np.errstate(invalid="ignore"):
+        medians = (grid[rows, np.maximum(valid - 1, 0) // 2] + grid[rows, valid // 2]) / 2
+    rolled = _grouped_rolling(
+        medians, group_codes[first_block], max(1, window // block), max(1, -(-min_periods // block)), "median"
+    )
+    return rolled[block_of]
+
+
+def rolling_scores(df, codes, window=ANOMALY_WINDOW, min_periods=ANOMALY_MIN_PERIODS):
+    """Add zscore and robust_score columns; df must be sorted by meter (codes) then timestamp"""
+    import numpy as np
+
+    values = df["value"].to_numpy(dtype=np.float64)
+    mean = _grouped_rolling(values, codes, window, min_periods, "mean")
+    std = _grouped_rolling(values, codes, window, min_periods, "std")
+    median = _grouped_rolling_median(values, codes, window, min_periods)
+    # MAD from earlier absolute deviations against their own running median
+    deviation = np.abs(values - median)
+    mad = _grouped_rolling_median(deviation, codes, window, min_periods)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["zscore"] = np.where(std > 0, (values - mean) / std, 0.0)
+        df["robust_score"] = np.where(mad > 0, (values - median) / (MAD_SCALE * mad), 0.0)
+    return df
+
+
+def seasonal_profile(meters, codes, hours, values):
+    """Mergeable hour-of-week profile per meter: count, sum and sum of squares
+
+    meters are the ptagIds behind codes 0..n-1; returns a frame indexed by (ptagId, hour_of_week).
+    """
+    import numpy as np
+    import pandas as pd
+
+    finite = np.isfinite(values)
+    slots = codes.astype(np.int64) * HOURS_PER_WEEK + hours
+    size = len(meters) * HOURS_PER_WEEK
+    clean = np.where(finite, values, 0.0)
+    sums = {
+        "count": np.bincount(slots, weights=finite, minlength=size),
+        "sum": np.bincount(slots, weights=clean, minlength=size),
+        "sumsq": np.bincount(slots, weights=clean**2, minlength=size),
+    }
+    index = pd.MultiIndex.from_product(
+        [pd.Index(meters, name="ptagId"), pd.RangeIndex(HOURS_PER_WEEK, name="hour_of_week")]
+    )
+    profile = pd.DataFrame(sums, index=index)
+    return profile[profile["count"] > 0]
+
+
+def merge_profiles(left, right):
+    """Combine two seasonal profiles (e.g. history plus a newly ingested day)"""
+    if left is None:
+        return right
+    return left.add(right, fill_value=0)
+
+
+def seasonal_scores(df, meters, codes, hours, profile, min_count=ANOMALY_SEASONAL_MIN_COUNT):
+    """Add seasonal_baseline and seasonal_score columns from an hour-of-week profile"""
+    import numpy as np
+    import pandas as pd
+
+    # Dense (meter, hour-of-week) tables aligned with codes, then one fancy-index lookup
+    index = pd.MultiIndex.from_product(
+        [pd.Index(meters, name="ptagId"), pd.RangeIndex(HOURS_PER_WEEK, name="hour_of_week")]
+    )
+    dense = profile.reindex(index, fill_value=0).to_numpy().reshape(len(meters), HOURS_PER_WEEK, 3)
+    count, total, squares = (dense[codes, hours, i] for i in range(3))
+
+    values = df["value"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        std = np.sqrt(np.clip(squares / count - mean**2, 0, None))
+        enough = count >= min_count
+        df["seasonal_baseline"] = np.where(enough, mean, np.nan)
+        df["seasonal_score"] = np.where(enough & (std > 0), (values - mean) / std, 0.0)
+    return df
+
+
+def detect_anomalies(df, state=None, threshold=ANOMALY_THRESHOLD, window=ANOMALY_WINDOW):
+    """Score readings and flag anomalies; returns (scored new readings, state for the next call)
+
+    df needs ptagId, timestamp and value columns (duplicate ptagId/timestamp rows are scored
+    once). state carries each meter's recent readings and its seasonal profile, so a later
+    call with only newly ingested readings gets the same rolling scores as a full recompute,
+    and seasonal scores against everything seen before that batch.
+    """
+    import numpy as np
+    import pandas as pd
+
+    readings = df[["ptagId", "timestamp", "value"]].copy()
+    readings["ptagId"] = readings["ptagId"].astype(str)
+    readings["timestamp"] = _epoch_ms(readings["timestamp"])
+    readings = readings.drop_duplicates(["ptagId", "timestamp"])
+    readings["is_new"] = True
+
+    tail = None if state is None else state.get("tail")
+    profile = None if state is None else state.get("profile")
+    if tail is not None and len(tail):
+        readings = pd.concat([tail.assign(is_new=False), readings], ignore_index=True)
+        readings = readings.drop_duplicates(["ptagId", "timestamp"], keep="last")
+
+    readings = readings.sort_values(["ptagId", "timestamp"], kind="stable").reset_index(drop=True)
+    all_codes, meters = pd.factorize(readings["ptagId"], sort=True)
+    rolling_scores(readings, all_codes, window=window)
+
+    is_new = readings["is_new"].to_numpy()
+    new = readings[is_new].drop(columns="is_new").reset_index(drop=True)
+    codes = all_codes[is_new]
+    hours = hour_of_week(new["timestamp"].to_numpy())
+    batch_profile = seasonal_profile(meters, codes, hours, new["value"].to_numpy(dtype=np.float64))
+    # Seasonal baseline from the profile before this batch when incremental,
+    # otherwise from the batch itself (a history backfill)
+    seasonal_scores(new, meters, codes, hours, batch_profile if profile is None else profile)
+
+    scores = new[["zscore", "robust_score", "seasonal_score"]].abs().to_numpy()
+    new["anomaly_score"] = np.nanmax(scores, axis=1)
+    new["is_anomaly"] = new["anomaly_score"] > threshold
+
+    # Two windows of context: the MAD of the last window needs deviations from the one before.
+    # The tail starts on a median block boundary, so the next call cuts the same blocks
+    length = np.bincount(all_codes)[all_codes]
+    block = max(1, ANOMALY_MEDIAN_BLOCK)
+    keep = _positions(all_codes) >= np.maximum(length - 2 * window, 0) // block * block
+    next_state = {
+        "tail": readings.loc[keep, ["ptagId", "timestamp", "value"]].reset_index(drop=True),
+        "profile": merge_profiles(profile, batch_profile),
+    }
+    return new, next_state
+
+
+def _flags_for(df, scored):
+    """Map per-reading is_anomaly back onto the rows of df (any order, duplicates allowed)"""
+    import pandas as pd
+
+    flagged = scored.loc[scored["is_anomaly"], ["ptagId", "timestamp"]]
+    keys = pd.MultiIndex.from_arrays([df["ptagId"].astype(str), _epoch_ms(df["timestamp"])])
+    return keys.isin(pd.MultiIndex.from_frame(flagged)).astype(bool)
+
+
+def flag_rows(df, threshold=ANOMALY_THRESHOLD):
+    """Boolean array marking which rows of df are anomalous (full recompute)"""
+    import numpy as np
+
+    if len(df) == 0:
+        return np.zeros(0, dtype=bool)
+    scored, _ = detect_anomalies(df, threshold=threshold)
+    return _flags_for(df, scored)
+
+
+def flag_new_rows(df, state, threshold=ANOMALY_THRESHOLD):
+    """Incremental flag_rows for newly ingested readings; returns (flags, next state)"""
+    scored, state = detect_anomalies(df, state, threshold=threshold)
+    return _flags_for(df, scored), state
@@ -0,0 +1,171 @@
+"""
+Area Index Module for TCLD Dashboard
+Building -> areas dimension index, extracted in bulk for all buildings with one grouped
+query and stored locally (AREA_INDEX_PATH), so the area dropdown is a dictionary lookup
+
+The index is loaded from disk at startup and refreshed in the background once older than
+AREA_INDEX_REFRESH_SECONDS. With IAQ_TIME_COLUMN set, refreshes are incremental: only IAQ
+rows newer than the last extraction's watermark are read and merged. A building missing
+from the index falls back to the per-building get_areas query and is added to it.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from database import IAQ_TIME_COLUMN, get_all_areas, get_areas
+
+logger = logging.getLogger(__name__)
+
+# Index configuration
+AREA_INDEX_PATH = os.getenv("AREA_INDEX_PATH", "area_index.json")
+AREA_INDEX_REFRESH_SECONDS = int(os.getenv("AREA_INDEX_REFRESH_SECONDS", "21600"))
+AREA_PREFETCH = os.getenv("AREA_PREFETCH", "True") == "True"
+
+AREA_FIELDS = ("areaName", "areaCode", "buildingCode")
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_index = None  # {"extracted_at": epoch s, "watermark": str|None, "areas": {building: [area, ...]}}
+
+
+def _empty_index():
+    """An index with no buildings"""
+    return {"extracted_at": 0, "watermark": None, "areas": {}}
+
+
+def load_index(path=AREA_INDEX_PATH):
+    """Read the stored index; an empty one when the file is missing or unreadable"""
+    if not os.path.exists(path):
+        return _empty_index()
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read area index {path}: {e}")
+        return _empty_index()
+
+
+def save_index(index, path=AREA_INDEX_PATH):
+    """Write the index atomically (readers never see a partial file)"""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(index, f, default=str)
+    os.replace(temporary, path)
+
+
+def merge_rows(areas, rows):
+    """Add area rows to a {building: [area, ...]} mapping, keeping each list unique and sorted"""
+    touched = set()
+    for row in rows:
+        building = str(row["buildingCode"])
+        entries = areas.setdefault(building, [])
+        area = {field: row.get(field) for field in AREA_FIELDS}
+        area["buildingCode"] = building
+        if area not in entries:
+            entries.append(area)
+            touched.add(building)
+    for building in touched:
+        areas[building].sort(key=lambda a: (str(a["areaName"]), str(a["areaCode"])))
+    return areas
+
+
+def _watermark(rows, previous=None):
+    """Newest lastSeen among rows (ISO string), or previous when rows carry none"""
+    seen = [str(row["lastSeen"]) for row in rows if row.get("lastSeen") is not None]
+    return max(seen + ([previous] if previous else [])) if seen else previous
+
+
+def _index_now():
+    """The in-memory index, loaded from disk on first use"""
+    global _index
+    with _lock:
+        if _index is None:
+            _index = load_index()
+        return _index
+
+
+def refresh_index(force=False):
+    """Extract areas for all buildings (incrementally when possible) and store the index
+
+    Returns the number of buildings in the index, or None when the query failed.
+    """
+    with _refresh_lock:
+        index = _index_now()
+        if not force and time.time() - index["extracted_at"] < AREA_INDEX_REFRESH_SECONDS:
+            return len(index["areas"])
+
+        incremental = bool(IAQ_TIME_COLUMN and index["watermark"] and index["areas"] and not force)
+        started = time.perf_counter()
+        rows = get_all_areas(since=index["watermark"] if incremental else None)
+        if rows is None:
+            return None
+
+        areas = {b: list(entries) for b, entries in index["areas"].items()} if incremental else {}
+        refreshed = {
+            "extracted_at": time.time(),
+            "watermark": _watermark(rows, index["watermark"] if incremental else None),
+            "areas": merge_rows(areas, rows),
+        }
+        try:
+            save_index(refreshed)
+        except OSError as e:
+            logger.warning(f"Could not store area index: {e}")
+
+        global _index
+        with _lock:
+            _index = refreshed
+        logger.info(
+            f"Area index {'updated' if incremental else 'rebuilt'}: {len(rows)} rows, "
+            f"{len(refreshed['areas'])} buildings in {time.perf_counter() - started:.1f}s"
+        )
+        return len(refreshed["areas"])
+
+
+def refresh_in_background(force=False):
+    """Refresh the index on a daemon thread unless a refresh is already running"""
+    if _refresh_lock.locked():
+        return None
+    thread = threading.Thread(target=refresh_index, args=(force,), name="area-index", daemon=True)
+    thread.start()
+    return thread
+
+
+def areas_for(building_id):
+    """Areas of a building from the index (list of areaName/areaCode/buildingCode), or None
+
+    Stale indexes are served as is while a background refresh runs.
+    """
+    if not building_id:
+        return None
+    index = _index_now()
+    if time.time() - index["extracted_at"] >= AREA_INDEX_REFRESH_SECONDS:
+        refresh_in_background()
+
+    areas = index["areas"].get(str(building_id))
+    if areas is None and index["extracted_at"]:
+        # Not in the last extraction (e.g. a new building): ask for it alone and remember it
+        rows = get_areas(building_id)
+        if rows:
+            with _lock:
+                merge_rows(index["areas"], rows)
+            areas = index["areas"].get(str(building_id))
+    elif areas is None:
+        return get_areas(building_id)
+    return areas or None
+
+
+def index_info():
+    """Buildings, areas and age of the loaded index"""
+    index = _index_now()
+    return {
+        "buildings": len(index["areas"]),
+        "areas": sum(len(entries) for entries in index["areas"].values()),
+        "extracted_at": datetime.fromtimestamp(index["extracted_at"]).isoformat(timespec="seconds")
+        if index["extracted_at"]
+        else None,
+        "watermark": index["watermark"],
+    }
@@ -0,0 +1,381 @@
+/* TCLD Dash Dashboard - Clientside Callbacks
+ * Re-filters and re-renders the EA Ptag window held in eaptag-store,
+ * so area and sub-range changes never leave the browser. The IAQ panel
+ * joins IAQ buckets (iaq-store) with the building's energy by bucket here.
+ */
+
+window.dash_clientside = window.dash_clientside || {};
+
+(function () {
+    var TABLE_ROWS = 100;
+    var ANOMALY_TRACE = "Anomalies";  // figures.ANOMALY_TRACE
+
+    function isoHour(ms) {
+        return new Date(ms).toISOString().slice(0, 19);
+    }
+
+    function normalizeRange(startDate, endDate) {
+        // Half-open [start, end) bounds, matching segments.normalize_range: start floored
+        // to the hour, end snapped up to the next hour (a date-only end to the next midnight)
+        var hour = 3600000;
+        var start = null;
+        if (startDate) {
+            start = isoHour(Math.floor(Date.parse(String(startDate).slice(0, 19) + (String(startDate).length > 10 ? "Z" : "T00:00:00Z")) / hour) * hour);
+        }
+        var endMs;
+        if (!endDate) {
+            endMs = Math.ceil(Date.now() / hour) * hour;
+        } else if (String(endDate).length === 10) {
+            endMs = Date.parse(endDate + "T00:00:00Z") + 24 * hour;
+        } else {
+            endMs = Math.ceil(Date.parse(String(endDate).slice(0, 19) + "Z") / hour) * hour;
+        }
+        return {start: start, end: isoHour(endMs)};
+    }
+
+    function covers(store, buildingId, startDate, endDate) {
+        if (!store || (store.building_id || null) !== (buildingId || null)) {
+            return false;
+        }
+        var range = normalizeRange(startDate, endDate);
+        // A truncated window may hold only some readings at its oldest timestamp
+        var startOk = store.start_date === null ? true : range.start !== null && range.start >= store.start_date;
+        if (store.truncated && store.oldest) {
+            startOk = range.start !== null && range.start > store.oldest;
+        }
+        return startOk && range.end <= store.end_date;
+    }
+
+    function filterRows(store, areaId, startDate, endDate) {
+        var columns = store.columns;
+        var range = normalizeRange(startDate, endDate);
+        var rows = [];
+        for (var i = 0; i < columns.timestamp.length; i++) {
+            var ts = columns.timestamp[i];
+            if (areaId && columns.LocationName[i] !== areaId) continue;
+            if (range.start && ts < range.start) continue;
+            if (ts >= range.end) continue;
+            rows.push(i);
+        }
+        return rows;
+    }
+
+    function emptyFigure() {
+        return {data: [], layout: {title: {text: "No data available"}}};
+    }
+
+    function groupByBuilding(columns, rows) {
+        var groups = {};
+        var order = [];
+        rows.forEach(function (i) {
+            var name = columns.BuildingName[i];
+            if (!(name in groups)) {
+                groups[name] = [];
+                order.push(name);
+            }
+            groups[name].push(i);
+        });
+        return order.map(function (name) {
+            return {name: name, rows: groups[name]};
+        });
+    }
+
+    function traceType(pointCount, threshold) {
+        // WebGL above the server-configured threshold, matching figures.trace_type
+        return threshold !== undefined && pointCount > threshold ? "scattergl" : "scatter";
+    }
+
+    function anomalyRows(columns, rows) {
+        // Readings flagged server-side when the window was loaded (anomaly.py)
+        if (!columns.anomaly) {
+            return [];
+        }
+        return rows.filter(function (i) { return columns.anomaly[i]; });
+    }
+
+    function gapShapes(gaps) {
+        // Shaded [start, end, missing share] intervals, matching figures.gap_shapes
+        return (gaps || []).map(function (gap) {
+            return {
+                type: "rect",
+                xref: "x",
+                yref: "paper",
+                x0: gap[0],
+                x1: gap[1],
+                y0: 0,
+                y1: 1,
+                fillcolor: "#6c757d",
+                opacity: Math.round((0.08 + 0.22 * gap[2]) * 1000) / 1000,
+                line: {width: 0},
+                layer: "below",
+            };
+        });
+    }
+
+    function baselineNames(baseline) {
+        // Same order as figures.baseline_names: band, then expected, per building
+        var names = [];
+        (baseline || []).forEach(function (series) {
+            names.push(series.name + " normal range", series.name + " baseline");
+        });
+        return names;
+    }
+
+    function baselineTraces(baseline) {
+        // Normal range band and expected line per building, matching figures.baseline_traces
+        var traces = [];
+        (baseline || []).forEach(function (series) {
+            traces.push({
+                type: "scatter",
+                x: series.x.concat(series.x.slice().reverse()),
+                y: series.upper.concat(series.lower.slice().reverse()),
+                fill: "toself",
+                fillcolor: "rgba(108, 117, 125, 0.15)",
+                line: {width: 0},
+                hoverinfo: "skip",
+                showlegend: false,
+                name: series.name + " normal range",
+            });
+            traces.push({
+                type: "scatter",
+                mode: "lines",
+                x: series.x,
+                y: series.expected,
+                line: {color: "#495057", width: 1, dash: "dot"},
+                name: series.name + " baseline",
+            });
+        });
+        return traces;
+    }
+
+    function consumptionFigure(columns, rows, threshold, gaps, baseline) {
+        var ascending = rows.slice().sort(function (a, b) {
+            return columns.timestamp[a] < columns.timestamp[b] ? -1 : 1;
+        });
+        var type = traceType(rows.length, threshold);
+        var traces = baselineTraces(baseline).concat(groupByBuilding(columns, ascending).map(function (group) {
+            return {
+                type: type,
+                mode: "lines",
+                name: String(group.name),
+                x: group.rows.map(function (i) { return columns.timestamp[i]; }),
+                y: group.rows.map(function (i) { return columns.value[i]; }),
+            };
+        }));
+        var flagged = anomalyRows(columns, ascending);
+        if (flagged.length) {
+            // Same marker overlay as figures.anomaly_trace
+            traces.push({
+                type: "scatter",
+                mode: "markers",
+                name: ANOMALY_TRACE,
+                marker: {color: "#d62728", size: 9, symbol: "x"},
+                hovertemplate: "%{text}: %{y}<extra>Anomaly</extra>",
+                x: flagged.map(function (i) { return columns.timestamp[i]; }),
+                y: flagged.map(function (i) { return columns.value[i]; }),
+                text: flagged.map(function (i) { return columns.ptagId[i]; }),
+            });
+        }
+        var layout = {
+            title: {text: "Energy Consumption Over Time"},
+            xaxis: {title: {text: "Date"}},
+            yaxis: {title: {text: "Consumption (kWh)"}},
+            legend: {title: {text: "BuildingName"}},
+            hovermode: "x unified",
+            plot_bgcolor: "#f8f9fa",
+            height: 400,
+        };
+        var shapes = gapShapes(gaps);
+        if (shapes.length) {
+            layout.shapes = shapes;
+        }
+        return {data: traces, layout: layout};
+    }
+
+    function distributionFigure(columns, rows) {
+        var traces = groupByBuilding(columns, rows).map(function (group) {
+            return {
+                type: "box",
+                name: String(group.name),
+                x: group.rows.map(function (i) { return columns.BuildingName[i]; }),
+                y: group.rows.map(function (i) { return columns.value[i]; }),
+                showlegend: false,
+            };
+        });
+        return {
+            data: traces,
+            layout: {
+                title: {text: "Consumption Distribution by Building"},
+                xaxis: {title: {text: "BuildingName"}},
+                yaxis: {title: {text: "Consumption (kWh)"}},
+                plot_bgcolor: "#f8f9fa",
+                height: 400,
+            },
+        };
+    }
+
+    function liveCursor(columns, rows, threshold, baseline) {
+        var ascending = rows.slice().sort(function (a, b) {
+            return columns.timestamp[a] < columns.timestamp[b] ? -1 : 1;
+        });
+        var traces = baselineNames(baseline).concat(groupByBuilding(columns, ascending).map(function (group) {
+            return group.name;
+        }).filter(function (name) {
+            return name !== null;
+        }));
+        if (anomalyRows(columns, rows).length) {
+            traces.push(ANOMALY_TRACE);
+        }
+        return {
+            last_timestamp: ascending.length ? columns.timestamp[ascending[ascending.length - 1]] : null,
+            traces: traces,
+            trace_type: traceType(rows.length, threshold),
+        };
+    }
+
+    function iaqFigure(store, areaId, metric) {
+        var columns = store.columns;
+        var label = store.metrics[metric] || metric;
+        // Join: building energy per bucket, looked up by each IAQ point's bucket start
+        var energy = {};
+        store.energy.timestamp.forEach(function (ts, i) {
+            energy[ts] = store.energy.total[i];
+        });
+        var groups = {};
+        var order = [];
+        for (var i = 0; i < columns.timestamp.length; i++) {
+            if (areaId && columns.areaCode[i] !== areaId) continue;
+            var name = columns.areaName[i] || columns.areaCode[i];
+            if (!(name in groups)) {
+                groups[name] = [];
+                order.push(name);
+            }
+            groups[name].push(i);
+        }
+        var traces = order.map(function (name) {
+            var rows = groups[name];
+            return {
+                type: "scatter",
+                mode: "lines",
+                name: String(name),
+                x: rows.map(function (i) { return columns.timestamp[i]; }),
+                y: rows.map(function (i) { return columns[metric] ? columns[metric][i] : null; }),
+                customdata: rows.map(function (i) {
+                    var total = energy[columns.timestamp[i]];
+                    return total === undefined ? null : total;
+                }),
+                hovertemplate: "%{y:.1f} " + label + " | building %{customdata:.1f} kWh<extra>%{fullData.name}</extra>",
+            };
+        });
+        if (store.energy.timestamp.length) {
+            traces.push({
+                type: "bar",
+                name: "Building energy (kWh)",
+                x: store.energy.timestamp,
+                y: store.energy.total,
+                yaxis: "y2",
+                marker: {color: "#ced4da"},
+                opacity: 0.5,
+                hoverinfo: "skip",
+            });
+        }
+        return {
+            data: traces,
+            layout: {
+                title: {text: label + " by Area (" + (store.bucket === "day" ? "daily" : "hourly") + ")"},
+                xaxis: {title: {text: "Date"}},
+                yaxis: {title: {text: label}},
+                yaxis2: {title: {text: "Energy (kWh)"}, overlaying: "y", side: "right", showgrid: false},
+                legend: {title: {text: "Area"}},
+                hovermode: "x unified",
+                plot_bgcolor: "#f8f9fa",
+                height: 400,
+            },
+        };
+    }
+
+    function element(type, children, className) {
+        var props = {children: children};
+        if (className) {
+            props.className = className;
+        }
+        return {type: type, namespace: "dash_html_components", props: props};
+    }
+
+    function dataTable(columns, rows) {
+        var header = ["Building", "Area", "Ptag", "Value", "Unit", "Timestamp"].map(function (label) {
+            return element("Th", label);
+        });
+        var body = rows.slice(0, TABLE_ROWS).map(function (i) {
+            var value = columns.value[i] || 0;
+            return element("Tr", [
+                element("Td", columns.BuildingName[i] || ""),
+                element("Td", columns.LocationName[i] || ""),
+                element("Td", columns.ptagId[i] || ""),
+                element("Td", value.toFixed(2)),
+                element("Td", columns.unit[i] || ""),
+                element("Td", (columns.timestamp[i] || "").replace("T", " ")),
+            ]);
+        });
+        return element("Table", [element("Thead", element("Tr", header)), element("Tbody", body)], "data-table");
+    }
+
+    window.dash_clientside.eaptag = {
+        request_window: function (nClicks, buildingId, startDate, endDate, store) {
+            var triggered = (window.dash_clientside.callback_context || {}).triggered || [];
+            var refreshed = triggered.some(function (t) {
+                return t.prop_id === "refresh-button.n_clicks";
+            });
+            if (!refreshed && covers(store, buildingId, startDate, endDate)) {
+                return window.dash_clientside.no_update;
+            }
+            return {
+                building_id: buildingId || null,
+                start_date: startDate || null,
+                end_date: endDate || null,
+                known_version: store ? store.version : null,
+                n_clicks: nClicks,
+            };
+        },
+
+        render_views: function (areaId, startDate, endDate, buildingId, store) {
+            if (!covers(store, buildingId, startDate, endDate)) {
+                // Outside the loaded window: the server renders once the new window arrives
+                return window.dash_clientside.no_update;
+            }
+            var rows = filterRows(store, areaId, startDate, endDate);
+            if (rows.length === 0) {
+                return [emptyFigure(), emptyFigure(), element("Div", "No data available"), liveCursor(store.columns, rows, store.webgl_threshold)];
+            }
+            return [
+                consumptionFigure(store.columns, rows, store.webgl_threshold, store.gaps, store.baseline),
+                distributionFigure(store.columns, rows),
+                dataTable(store.columns, rows),
+                liveCursor(store.columns, rows, store.webgl_threshold, store.baseline),
+            ];
+        },
+
+        export_links: function (buildingId, areaId, startDate, endDate) {
+            var params = [];
+            [["building_id", buildingId], ["area_id", areaId], ["start_date", startDate], ["end_date", endDate]]
+                .forEach(function (pair) {
+                    if (pair[1]) {
+                        params.push(pair[0] + "=" + encodeURIComponent(pair[1]));
+                    }
+                });
+            var query = params.length ? "?" + params.join("&") : "";
+            return ["/export/eaptag.csv" + query, "/export/eaptag.parquet" + query];
+        },
+
+        render_iaq: function (store, areaId, metric) {
+            if (!store || store.message) {
+                return {data: [], layout: {title: {text: (store && store.message) || "No data available"}}};
+            }
+            return iaqFigure(store, areaId, metric);
+        },
+
+        toggle_live: function (value) {
+            return !(value && value.indexOf("live") !== -1);
+        },
+    };
+})();
@@ -0,0 +1,322 @@
+"""
+Baseline Module for TCLD Dashboard
+Per-building seasonal baselines fitted in batch, so "is this above normal?" is a lookup
+
+For each building and hour of the week the model keeps an exponentially smoothed mean and
+variance of the average reading in that hour (total / readings of the hourly rollup, the
+same grouped query as the building comparison), plus how many weeks it has seen. The
+expected value of a reading is the mean, and the normal range is the mean +/- BASELINE_BAND_SIGMA
+standard deviations once BASELINE_MIN_WEEKS weeks are in.
+
+Fitting is vectorized over buildings and hours (one NumPy update per week of data) and
+incremental: a refit only reads the complete days since the last one. The model is stored
+locally (BASELINE_PATH); the app reloads it when a standalone run (python baselines.py)
+has written a newer one.
+"""
+
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from anomaly import HOURS_PER_WEEK, hour_of_week
+from database import COMPARE_MAX_BUILDINGS, get_building_comparison, get_buildings
+from segments import SEGMENT_SETTLE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+# Baseline configuration
+BASELINE_PATH = os.getenv("BASELINE_PATH", "baselines.npz")
+BASELINE_HISTORY_DAYS = int(os.getenv("BASELINE_HISTORY_DAYS", "56"))  # first fit
+BASELINE_ALPHA = float(os.getenv("BASELINE_ALPHA", "0.2"))  # weight of the newest week
+BASELINE_BAND_SIGMA = float(os.getenv("BASELINE_BAND_SIGMA", "2.0"))
+BASELINE_MIN_WEEKS = int(os.getenv("BASELINE_MIN_WEEKS", "3"))
+BASELINE_PREFETCH = os.getenv("BASELINE_PREFETCH", "True") == "True"
+# The consumption chart overlays baselines when it shows at most this many buildings
+BASELINE_OVERLAY_MAX_BUILDINGS = int(os.getenv("BASELINE_OVERLAY_MAX_BUILDINGS", "3"))
+
+EPOCH = datetime(1970, 1, 1)
+MS_PER_HOUR = 3_600_000
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_model = None  # BaselineModel, loaded on first use
+_loaded_mtime = None  # mtime of the file _model was loaded from
+
+# numpy is imported inside the helpers so importing this module stays cheap
+
+
+def epoch_hour(moment):
+    """Hours since the Unix epoch of a datetime (floored)"""
+    return int((moment - EPOCH).total_seconds() // 3600)
+
+
+def hour_iso(hour):
+    """ISO timestamp of the start of an epoch hour"""
+    return (EPOCH + timedelta(hours=int(hour))).isoformat()
+
+
+class BaselineModel:
+    """Smoothed mean and variance per building and hour of week, with weeks observed"""
+
+    def __init__(self, buildings=(), names=(), mean=None, var=None, count=None, fitted_through=None, fitted_at=0.0):
+        import numpy as np
+
+        self.buildings = [str(building) for building in buildings]
+        self.names = list(names)
+        self.rows = {building: row for row, building in enumerate(self.buildings)}
+        shape = (len(self.buildings), HOURS_PER_WEEK)
+        self.mean = mean if mean is not None else np.zeros(shape)
+        self.var = var if var is not None else np.zeros(shape)
+        self.count = count if count is not None else np.zeros(shape, dtype=np.int32)
+        self.fitted_through = fitted_through  # epoch hour (midnight) up to which days are fitted
+        self.fitted_at = fitted_at
+
+    def _row(self, building, name):
+        """Row of a building, adding an empty one for a new building"""
+        import numpy as np
+
+        row = self.rows.get(building)
+        if row is None:
+            row = self.rows[building] = len(self.buildings)
+            self.buildings.append(building)
+            self.names.append(name)
+            self.mean = np.vstack([self.mean, np.zeros((1, HOURS_PER_WEEK))])
+            self.var = np.vstack([self.var, np.zeros((1, HOURS_PER_WEEK))])
+            self.count = np.vstack([self.count, np.zeros((1, HOURS_PER_WEEK), dtype=np.int32)])
+        else:
+            self.names[row] = name
+        return row
+
+    def update(self, buildings, names, hours, values, alpha=BASELINE_ALPHA):
+        """Fold hourly observations (building, name, epoch hour, value) into the model, oldest first
+
+        A week of hours holds each hour-of-week slot once, so each week is one vectorized
+        update. Until a slot has seen 1 / alpha weeks it keeps a plain running mean.
+        """
+        import numpy as np
+
+        hours = np.asarray(hours, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        if not finite.any():
+            return
+        pairs = {}
+        for building, name in zip(buildings, names):
+            pairs.setdefault(str(building), name)
+        rows = {building: self._row(building, name) for building, name in pairs.items()}
+        row_of = np.array([rows[str(building)] for building in buildings], dtype=np.int64)[finite]
+        hours, values = hours[finite], values[finite]
+
+        weeks = (hours - hours.min()) // HOURS_PER_WEEK
+        slots = hour_of_week(hours * MS_PER_HOUR).astype(np.int64)
+        order = np.argsort(weeks, kind="stable")
+        bounds = np.flatnonzero(np.r_[True, np.diff(weeks[order]) != 0, True])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            chunk = order[lo:hi]
+            r, s, x = row_of[chunk], slots[chunk], values[chunk]
+            count = self.count[r, s] + 1
+            weight = np.maximum(alpha, 1.0 / count)
+            difference = x - self.mean[r, s]
+            step = weight * difference
+            self.mean[r, s] += step
+            self.var[r, s] = (1 - weight) * (self.var[r, s] + difference * step)
+            self.count[r, s] = count
+
+    def band(self, row, hours, sigma=BASELINE_BAND_SIGMA, min_weeks=BASELINE_MIN_WEEKS):
+        """(expected, lower, upper) arrays for a building row at epoch hours (NaN while warming up)"""
+        import numpy as np
+
+        slots = hour_of_week(np.asarray(hours, dtype=np.int64) * MS_PER_HOUR).astype(np.int64)
+        ready = self.count[row, slots] >= min_weeks
+        expected = np.where(ready, self.mean[row, slots], np.nan)
+        spread = sigma * np.sqrt(np.clip(self.var[row, slots], 0, None))
+        return expected, np.clip(expected - spread, 0, None), expected + spread
+
+    def save(self, path=BASELINE_PATH):
+        """Write the model atomically"""
+        import numpy as np
+
+        buffer = io.BytesIO()
+        meta = {"fitted_through": self.fitted_through, "fitted_at": self.fitted_at}
+        np.savez_compressed(
+            buffer, mean=self.mean, var=self.var, count=self.count,
+            buildings=np.array(self.buildings, dtype=str), names=np.array(self.names, dtype=str),
+            meta=np.array(json.dumps(meta)),
+        )
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=BASELINE_PATH):
+        """Read a stored model; an empty one when the file is missing or unreadable"""
+        import numpy as np
+
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with np.load(path) as stored:
+                meta = json.loads(str(stored["meta"]))
+                return cls(
+                    stored["buildings"].tolist(), stored["names"].tolist(), stored["mean"], stored["var"],
+                    stored["count"], meta["fitted_through"], meta["fitted_at"],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read baselines {path}: {e}")
+            return cls()
+
+
+def _stored_mtime():
+    """Modification time of the stored model, or None"""
+    try:
+        return os.path.getmtime(BASELINE_PATH)
+    except OSError:
+        return None
+
+
+def _model_now():
+    """The in-memory model, (re)loaded from disk on first use and after another process refits"""
+    global _model, _loaded_mtime
+    with _lock:
+        mtime = _stored_mtime()
+        if _model is None or (mtime is not None and mtime != _loaded_mtime):
+            _model, _loaded_mtime = BaselineModel.load(), mtime
+        return _model
+
+
+def _settled_midnight():
+    """Epoch hour of the last midnight whose day is complete (past the settle horizon)"""
+    settled = datetime.now() - timedelta(minutes=SEGMENT_SETTLE_MINUTES)
+    return epoch_hour(settled.replace(hour=0, minute=0, second=0, microsecond=0))
+
+
+def refit(force=False):
+    """Fit the complete days since the last fit (BASELINE_HISTORY_DAYS the first time or with force)
+
+    Returns the number of days fitted, or None when a rollup query failed (nothing is
+    recorded then, so the same days are retried next time). Buildings without rollup
+    rows are skipped, so an offline batch does not hold back the others.
+    """
+    global _loaded_mtime
+    with _refresh_lock:
+        model = BaselineModel() if force else _model_now()
+        end_hour = _settled_midnight()
+        start_hour = end_hour - BASELINE_HISTORY_DAYS * 24 if model.fitted_through is None else model.fitted_through
+        if start_hour >= end_hour:
+            return 0
+
+        buildings = get_buildings()
+        if buildings is None:
+            return None
+        started = time.perf_counter()
+        ids = sorted(str(b["BuildingID"]) for b in buildings)
+        frames = []
+        for batch in range(0, len(ids), COMPARE_MAX_BUILDINGS):
+            # Uncached: these days are read once, then folded into the model
+            data = get_building_comparison.__wrapped__(
+                tuple(ids[batch:batch + COMPARE_MAX_BUILDINGS]),
+                hour_iso(start_hour), hour_iso(end_hour), "hour", end_exclusive=True, allow_empty=True,
+            )
+            if data is None:
+                logger.warning(f"Baseline refit skipped: rollup query failed since {hour_iso(start_hour)}")
+                return None
+            # A batch of offline buildings has no rows; its days are simply not observed
+            if not data.empty:
+                frames.append(data)
+
+        import numpy as np
+        import pandas as pd
+
+        observed = None
+        if frames:
+            data = pd.concat(frames, ignore_index=True)
+            readings = data["readings"].to_numpy(dtype=np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.where(readings > 0, data["total"].to_numpy(dtype=np.float64) / readings, np.nan)
+            observed = (
+                data["BuildingID"].astype(str).tolist(), data["BuildingName"].astype(str).tolist(),
+                data["timestamp"].to_numpy(dtype=np.int64) // MS_PER_HOUR, values,
+            )
+        with _lock:
+            if observed is not None:
+                model.update(*observed)
+            model.fitted_through = end_hour
+            model.fitted_at = time.time()
+        try:
+            with _lock:
+                model.save()
+                _loaded_mtime = _stored_mtime()
+        except OSError as e:
+            logger.warning(f"Could not store baselines: {e}")
+        _replace(model)
+        days = (end_hour - start_hour) // 24
+        logger.info(
+            f"Baselines fitted on {days} days for {len(model.buildings)} buildings "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return days
+
+
+def _replace(model):
+    """Make a freshly fitted model the in-memory one"""
+    global _model
+    with _lock:
+        _model = model
+
+
+def refit_in_background(force=False):
+    """Refit on a daemon thread unless a refit is already running"""
+    if _refresh_lock.locked():
+        return None
+    thread = threading.Thread(target=refit, args=(force,), name="baseline-refit", daemon=True)
+    thread.start()
+    return thread
+
+
+def window_baseline(names, start_ms, end_ms):
+    """Hourly expected reading and normal range per building name over [start_ms, end_ms]
+
+    Returns [{name, x, expected, lower, upper}] (ISO hours; None while a slot warms up) for
+    the buildings with a fitted baseline; a lookup into the stored model, no query.
+    """
+    import numpy as np
+
+    model = _model_now()
+    if model.fitted_through is None or start_ms is None or end_ms is None:
+        return []
+    hours = np.arange(int(start_ms) // MS_PER_HOUR, int(end_ms) // MS_PER_HOUR + 1, dtype=np.int64)
+    x = np.datetime_as_string(hours.astype("datetime64[h]"), unit="s").tolist()
+    rows = {name: row for row, name in enumerate(model.names)}
+    series = []
+    for name in names:
+        row = rows.get(str(name))
+        if row is None:
+            continue
+        with _lock:
+            expected, lower, upper = model.band(row, hours)
+        if np.isnan(expected).all():
+            continue
+        series.append(
+            {
+                "name": str(name),
+                "x": x,
+                **{
+                    key: [None if np.isnan(value) else round(float(value), 2) for value in values]
+                    for key, values in (("expected", expected), ("lower", lower), ("upper", upper))
+                },
+            }
+        )
+    return series
+
+
+if __name__ == "__main__":
+    # Batch refit, e.g. from cron after the nightly load: python baselines.py [--full]
+    logging.basicConfig(level=logging.INFO)
+    fitted = refit(force="--full" in sys.argv)
+    sys.exit(0 if fitted is not None else 1)
@@ -0,0 +1,419 @@
+"""
+Performance Regression Runner for TCLD Dashboard
+Runs fixed scenarios (default view, single building, year-long range, export) through the
+real callbacks and endpoints against the synthetic warehouse (synthetic.py), and compares
+p50/p95 latency, rows fetched and peak memory with the baseline stored in the repo
+
+Usage:
+    python benchmark.py                           # run all scenarios, exit 1 on a regression
+    python benchmark.py --scenario export --repeat 10
+    python benchmark.py --update-baseline         # record the current results as the baseline
+    python benchmark.py --json perf_report.json   # also write the full report
+
+Every repeat starts cold (query, figure and area caches cleared; the coverage index and the
+baselines are rebuilt before timing starts, as a deployed worker keeps them on disk). Latency comes from the
+timed repeats; peak memory from one extra tracemalloc pass, so tracing does not skew timings
+(a scenario's peak is its heaviest stage's). Latency baselines are machine-specific: refresh
+the baseline on the machine that runs the gate.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Keep the app's background work out of the measurements; set before the app modules load
+os.environ.setdefault("PREWARM_ENABLED", "False")
+os.environ.setdefault("AREA_PREFETCH", "False")
+os.environ.setdefault("AREA_INDEX_PATH", os.path.join(tempfile.gettempdir(), "tcld_benchmark_area_index.json"))
+os.environ.setdefault("COVERAGE_PREFETCH", "False")
+os.environ.setdefault("BASELINE_PREFETCH", "False")
+os.environ.setdefault("BASELINE_PATH", os.path.join(tempfile.gettempdir(), "tcld_benchmark_baselines.npz"))
+# The synthetic IAQ fact is bucketed on any time column name; the panel needs one set
+os.environ.setdefault("IAQ_TIME_COLUMN", "HourStart")
+os.environ.setdefault("COVERAGE_INDEX_PATH", os.path.join(tempfile.gettempdir(), "tcld_benchmark_coverage.npz"))
+os.environ.setdefault("SLOW_QUERY_LOG", os.path.join(tempfile.gettempdir(), "tcld_benchmark_queries.jsonl"))
+
+# Regression gate configuration
+PERF_BASELINE = os.getenv("PERF_BASELINE", "perf_baseline.json")
+PERF_REPEAT = int(os.getenv("PERF_REPEAT", "5"))
+PERF_LATENCY_TOLERANCE = float(os.getenv("PERF_LATENCY_TOLERANCE", "0.25"))
+PERF_ROWS_TOLERANCE = float(os.getenv("PERF_ROWS_TOLERANCE", "0.0"))
+PERF_MEMORY_TOLERANCE = float(os.getenv("PERF_MEMORY_TOLERANCE", "0.20"))
+# Latency changes smaller than this are noise, whatever the ratio
+PERF_MIN_DELTA_MS = float(os.getenv("PERF_MIN_DELTA_MS", "5"))
+PERF_MIN_DELTA_MB = float(os.getenv("PERF_MIN_DELTA_MB", "1"))
+
+EXPORT_DAYS = 90
+YEAR_DAYS = 365
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR records logged while a scenario runs (callbacks log and swallow failures)"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Run:
+    """One execution of a scenario: per-stage wall time, queries, rows and (optionally) peak memory"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        from diagnostics import RECENT_QUERIES
+
+        RECENT_QUERIES.clear()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            records = list(RECENT_QUERIES)
+            stage = {
+                "ms": elapsed,
+                "queries": len(records),
+                "rows": sum(record.get("rows") or 0 for record in records),
+            }
+            if self.trace_memory:
+                stage["peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 1048576
+            self.stages[name] = stage
+
+
+# Scenarios: the callbacks a page view or action triggers, in the order the browser runs them
+
+
+def _window(days=None):
+    """(start, end) as the date picker sends them: the default window, or the last `days` days"""
+    from database import default_date_range
+
+    start, end = default_date_range()
+    if days:
+        start = (datetime.fromisoformat(end) - timedelta(days=days)).isoformat()
+    return start, end
+
+
+def _render(run, building_id, start, end):
+    """Load the EA Ptag window and draw the charts and table fed by it"""
+    import app
+
+    with run.stage("store"):
+        store = app.load_eaptag_store({"building_id": building_id, "start_date": start, "end_date": end})
+    with run.stage("charts"):
+        app.update_consumption_chart(store, None, start, end)
+        app.update_distribution_chart(store, None, start, end)
+        app.update_data_table(store, None, start, end)
+
+
+def default_view(run, warehouse):
+    """First page load: dropdowns, connection badge, metrics cards, default window"""
+    import app
+
+    start, end = _window()
+    with run.stage("buildings"):
+        app.populate_buildings(None, None)
+    with run.stage("connection"):
+        app.check_connection(None)
+    with run.stage("metrics"):
+        app.update_metrics(None, None, start, end)
+    with run.stage("coverage"):
+        app.update_coverage(None, None, start, end)
+    _render(run, None, start, end)
+
+
+def single_building(run, warehouse):
+    """One building selected: areas, its window, heatmap, IAQ panel and a three-building comparison"""
+    import app
+
+    start, end = _window()
+    building_ids = [b["BuildingID"] for b in warehouse.buildings[:3]]
+    with run.stage("areas"):
+        app.populate_areas(building_ids[0])
+    with run.stage("metrics"):
+        app.update_metrics(None, building_ids[0], start, end)
+    _render(run, building_ids[0], start, end)
+    with run.stage("heatmap"):
+        app.update_heatmap(building_ids[0], start, end, None)
+    with run.stage("iaq"):
+        app.load_iaq_store(building_ids[0], start, end, None, None)
+    with run.stage("comparison"):
+        app.update_comparison(building_ids, "per_area", "overlay", start, end)
+
+
+def year_range(run, warehouse):
+    """A year-long range for one building: metrics, window, heatmap, IAQ panel and comparison"""
+    import app
+
+    start, end = _window(YEAR_DAYS)
+    building_ids = [b["BuildingID"] for b in warehouse.buildings[:3]]
+    with run.stage("metrics"):
+        app.update_metrics(None, building_ids[0], start, end)
+    _render(run, building_ids[0], start, end)
+    with run.stage("heatmap"):
+        app.update_heatmap(building_ids[0], start, end, None)
+    with run.stage("iaq"):
+        app.load_iaq_store(building_ids[0], start, end, None, None)
+    with run.stage("comparison"):
+        app.update_comparison(building_ids, "per_area", "overlay", start, end)
+
+
+def export(run, warehouse):
+    """Streamed CSV export of one building's last EXPORT_DAYS days"""
+    import app
+
+    start, end = _window(EXPORT_DAYS)
+    building_id = warehouse.buildings[0]["BuildingID"]
+    client = app.server.test_client()
+    with run.stage("csv"):
+        response = client.get(
+            f"/export/eaptag.csv?building_id={building_id}&start_date={start}&end_date={end}"
+        )
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        if response.status_code != 200 or not size:
+            logger.error(f"Export returned {response.status_code} with {size} bytes")
+
+
+SCENARIOS = {
+    "default_view": default_view,
+    "single_building": single_building,
+    "year_range": year_range,
+    "export": export,
+}
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _reset():
+    """Cold start for a repeat: no cached queries, figures, area index or idle connections"""
+    import areas
+    import baselines
+    import cache
+    import coverage
+    import database
+
+    coverage._index = None
+    coverage.refresh_index(force=True)
+    baselines.refit(force=True)
+    cache.clear()
+    database.pool.clear()
+    areas._index = None
+    if os.path.exists(areas.AREA_INDEX_PATH):
+        os.remove(areas.AREA_INDEX_PATH)
+
+
+def run_scenario(name, warehouse, repeat=PERF_REPEAT):
+    """Run a scenario cold `repeat` times plus one memory pass; returns its result record"""
+    scenario = SCENARIOS[name]
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    try:
+        _reset()
+        scenario(Run(), warehouse)  # warm-up: imports, first-call setup
+        runs = []
+        for _ in range(repeat):
+            _reset()
+            run = Run()
+            scenario(run, warehouse)
+            runs.append(run)
+
+        _reset()
+        tracemalloc.start()
+        try:
+            memory = Run(trace_memory=True)
+            scenario(memory, warehouse)
+        finally:
+            tracemalloc.stop()
+    finally:
+        logging.getLogger().removeHandler(errors)
+
+    totals = [sum(stage["ms"] for stage in run.stages.values()) for run in runs]
+    stages = {}
+    for stage in runs[0].stages:
+        times = [run.stages[stage]["ms"] for run in runs]
+        stages[stage] = {
+            "p50_ms": round(_percentile(times, 0.5), 1),
+            "p95_ms": round(_percentile(times, 0.95), 1),
+            "queries": runs[-1].stages[stage]["queries"],
+            "rows": runs[-1].stages[stage]["rows"],
+            "peak_mb": round(memory.stages[stage]["peak_mb"], 2),
+        }
+    return {
+        "p50_ms": round(_percentile(totals, 0.5), 1),
+        "p95_ms": round(_percentile(totals, 0.95), 1),
+        "queries": sum(stage["queries"] for stage in stages.values()),
+        "rows": sum(stage["rows"] for stage in stages.values()),
+        # Peak traced allocation of the heaviest stage (each stage is measured from its own start)
+        "peak_mb": max(stage["peak_mb"] for stage in stages.values()),
+        "errors": errors.count,
+        "repeat": repeat,
+        "stages": stages,
+    }
+
+
+def _regressed(metric, new, old):
+    """True when new is worse than old beyond the metric's tolerance (and noise floor)"""
+    if old is None or new is None:
+        return False
+    if metric in ("p50_ms", "p95_ms"):
+        return new - old > PERF_MIN_DELTA_MS and new > old * (1 + PERF_LATENCY_TOLERANCE)
+    if metric == "peak_mb":
+        return new - old > PERF_MIN_DELTA_MB and new > old * (1 + PERF_MEMORY_TOLERANCE)
+    return new > old * (1 + PERF_ROWS_TOLERANCE)
+
+
+GATED_METRICS = ("p50_ms", "p95_ms", "rows", "peak_mb")
+
+
+def compare(results, baseline):
+    """Regressions per scenario: [(scenario, stage or None, metric, old, new)]
+
+    Scenario totals and per-stage rows are gated; stage latencies are reported, not gated
+    (single stages are too short for stable ratios).
+    """
+    regressions = []
+    for name, result in results.items():
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if result["errors"]:
+            regressions.append((name, None, "errors", 0, result["errors"]))
+        if old is None:
+            continue
+        for metric in GATED_METRICS:
+            if _regressed(metric, result[metric], old.get(metric)):
+                regressions.append((name, None, metric, old.get(metric), result[metric]))
+        for stage, values in result["stages"].items():
+            old_stage = old.get("stages", {}).get(stage, {})
+            if _regressed("rows", values["rows"], old_stage.get("rows")):
+                regressions.append((name, stage, "rows", old_stage.get("rows"), values["rows"]))
+    return regressions
+
+
+def _diff(new, old):
+    """'new (+x%)' for the report"""
+    if old is None:
+        return f"{new} (new)"
+    if not old:
+        return f"{new}" if new == old else f"{new} (was 0)"
+    return f"{new} ({(new - old) / old * 100:+.0f}%)"
+
+
+def print_report(results, baseline, regressions):
+    """Scenario and per-stage table with changes against the baseline"""
+    flagged = {(name, stage, metric) for name, stage, metric, _, _ in regressions}
+    old_scenarios = (baseline or {}).get("scenarios", {})
+    print("=" * 100)
+    print("PERFORMANCE REPORT")
+    if baseline:
+        print(f"Baseline: {PERF_BASELINE} ({baseline.get('recorded_at')}, {baseline.get('machine')})")
+    print("=" * 100)
+    header = f"{'':<28}{'p50 ms':>16}{'p95 ms':>16}{'queries':>10}{'rows':>16}{'peak MB':>14}"
+    for name, result in results.items():
+        old = old_scenarios.get(name, {})
+        print(f"\n{name}" + (f"  ({result['errors']} errors logged)" if result["errors"] else ""))
+        print(header)
+        lines = [(None, result, old)] + [
+            (stage, values, old.get("stages", {}).get(stage, {})) for stage, values in result["stages"].items()
+        ]
+        for stage, values, previous in lines:
+            cells = []
+            for metric, width in (("p50_ms", 16), ("p95_ms", 16), ("queries", 10), ("rows", 16), ("peak_mb", 14)):
+                cell = _diff(values[metric], previous.get(metric)) if previous else str(values[metric])
+                if (name, stage, metric) in flagged:
+                    cell = "!" + cell
+                cells.append(f"{cell:>{width}}")
+            print(f"  {'total' if stage is None else stage:<26}" + "".join(cells))
+
+    print("\n" + "=" * 100)
+    if regressions:
+        print(f"REGRESSIONS ({len(regressions)}):")
+        for name, stage, metric, old, new in regressions:
+            print(f"  {name}{'/' + stage if stage else ''} {metric}: {old} -> {new}")
+    elif baseline:
+        print("No regressions against the baseline")
+    else:
+        print(f"No baseline at {PERF_BASELINE}; record one with --update-baseline")
+
+
+def load_baseline(path=PERF_BASELINE):
+    """The stored baseline, or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=PERF_BASELINE, previous=None):
+    """Store results as the baseline, keeping scenarios that were not re-run"""
+    scenarios = dict((previous or {}).get("scenarios", {}))
+    scenarios.update(results)
+    baseline = {
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": f"{platform.machine()} {platform.system()}, Python {platform.python_version()}",
+        "scenarios": scenarios,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCLD dashboard performance regression runner")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these")
+    parser.add_argument("--repeat", type=int, default=PERF_REPEAT, help="timed cold runs per scenario")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--json", help="write the results and regressions to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    import database
+    from synthetic import SyntheticWarehouse
+
+    warehouse = SyntheticWarehouse()
+    database.pool.clear()
+    database.pool.connect = warehouse.connect
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        print(f"Running {name} ({args.repeat} cold runs)...", flush=True)
+        results[name] = run_scenario(name, warehouse, max(1, args.repeat))
+
+    baseline = load_baseline()
+    regressions = compare(results, baseline)
+    print_report(results, baseline, regressions)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "regressions": regressions}, f, indent=2, default=str)
+    if args.update_baseline:
+        save_baseline(results, previous=baseline)
+        print(f"\nBaseline written to {PERF_BASELINE}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
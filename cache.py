@@ -0,0 +1,176 @@
+"""
+Query Cache Module for TCLD Dashboard
+In-process TTL cache for database results plus access statistics used for pre-warming
+"""
+
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from admission import sheds, shedding
+from frames import frame_nbytes
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "900"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "256")) * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (expires_at, value, nbytes)
+_total_bytes = 0
+_access_counts = Counter()  # key -> number of interactive lookups
+_stale_served = Counter()  # cache name -> expired results served under overload
+_registry = {}  # cache name -> undecorated function
+_ttls = {}  # cache name -> ttl given to cached()
+
+
+def make_key(name, func, args, kwargs):
+    """Build a cache key from the bound call arguments, so positional and keyword calls match"""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return (name, tuple(bound.arguments.items()))
+
+
+def get(key, allow_stale=False):
+    """Return the cached value for key, or None when missing or (unless allow_stale) expired
+
+    Expired entries stay until evicted, so they can still be served under overload.
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic() and not allow_stale:
+            return None
+        _entries.move_to_end(key)
+        return value
+
+
+def _discard(key):
+    """Remove an entry and its bytes from the total (caller holds the lock)"""
+    global _total_bytes
+    _, _, nbytes = _entries.pop(key)
+    _total_bytes -= nbytes
+
+
+def put(key, value, ttl=None):
+    """Store a value, evicting least recently used entries over the entry or byte limit"""
+    global _total_bytes
+    ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+    nbytes = frame_nbytes(value)
+    with _lock:
+        if key in _entries:
+            _discard(key)
+        _entries[key] = (time.monotonic() + ttl, value, nbytes)
+        _total_bytes += nbytes
+        while len(_entries) > 1 and (
+            len(_entries) > CACHE_MAX_ENTRIES or _total_bytes > CACHE_MAX_BYTES
+        ):
+            _discard(next(iter(_entries)))
+
+
+def clear():
+    """Drop all cached entries (access statistics are kept)"""
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+
+
+def stats():
+    """Report entry count and byte footprint, overall and per cache name"""
+    with _lock:
+        by_name = {}
+        for (name, _), (_, _, nbytes) in _entries.items():
+            entry = by_name.setdefault(name, {"entries": 0, "bytes": 0})
+            entry["entries"] += 1
+            entry["bytes"] += nbytes
+        return {
+            "entries": len(_entries),
+            "bytes": _total_bytes,
+            "by_name": by_name,
+            "stale_served": sum(_stale_served.values()),
+        }
+
+
+def record_access(key):
+    """Count an interactive lookup of key"""
+    with _lock:
+        _access_counts[key] += 1
+
+
+def top_accessed(n=10, name=None):
+    """Return the n most requested cache keys, optionally restricted to one cache name"""
+    with _lock:
+        ranked = _access_counts.most_common()
+    if name is not None:
+        ranked = [(key, count) for key, count in ranked if key[0] == name]
+    return ranked[:n]
+
+
+def cached(name, ttl=None):
+    """Decorator caching non-empty results of a query function under name
+
+    Under overload (see admission.py) an expired result is served instead of queueing,
+    or instead of None when the query itself was shed.
+    """
+
+    def decorator(func):
+        _registry[name] = func
+        _ttls[name] = ttl
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(name, func, args, kwargs)
+            record_access(key)
+            value = get(key)
+            if value is not None:
+                return value
+            stale = get(key, allow_stale=True)
+            if stale is not None and shedding():
+                return _serve_stale(name, stale)
+
+            shed_before = sheds()
+            value = func(*args, **kwargs)
+            if value is not None:
+                put(key, value, ttl)
+            elif stale is not None and sheds() > shed_before:
+                return _serve_stale(name, stale)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def _serve_stale(name, value):
+    """Count and return an expired result served under overload"""
+    with _lock:
+        _stale_served[name] += 1
+    logger.info(f"Serving stale {name} result under load")
+    return value
+
+
+def key_for(name, *args, **kwargs):
+    """Build the cache key a registered function would use for these arguments"""
+    return make_key(name, _registry[name], args, kwargs)
+
+
+def warm(key, ttl=None):
+    """Recompute a cache key from its registered function without counting an access"""
+    name, arguments = key
+    func = _registry.get(name)
+    if func is None:
+        logger.warning(f"No cached function registered as {name}")
+        return None
+    value = func(**dict(arguments))
+    if value is not None:
+        put(key, value, _ttls.get(name) if ttl is None else ttl)
+    return value
@@ -0,0 +1,122 @@
+"""
+Catalog Snapshot Module for TCLD Dashboard
+Reads the versioned warehouse catalog snapshots written by schema_discovery.py,
+diffs them (added/removed/changed tables, renames) and resolves renamed tables
+
+Snapshots live in SCHEMA_SNAPSHOT_DIR as catalog_<taken_at>_<version>.json, plus a
+catalog_latest.json copy; version is a hash of the table and column metadata only.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SNAPSHOT_DIR = os.getenv("SCHEMA_SNAPSHOT_DIR", "schema_snapshots")
+LATEST_SNAPSHOT = "catalog_latest.json"
+
+# Share of identical (column, type) pairs for a removed and an added table to count as a rename
+RENAME_SIMILARITY = float(os.getenv("SCHEMA_RENAME_SIMILARITY", "0.9"))
+
+
+def catalog_version(tables):
+    """Content hash of table and column metadata (samples excluded)"""
+    canonical = json.dumps(
+        {name: table["columns"] for name, table in sorted(tables.items())}, sort_keys=True, default=str
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def snapshot_path(name=LATEST_SNAPSHOT, directory=None):
+    """Path of a snapshot file in the snapshot directory"""
+    return os.path.join(directory or SCHEMA_SNAPSHOT_DIR, name)
+
+
+def load_snapshot(path=None):
+    """Load a snapshot (default: the latest); None if there is none yet"""
+    path = path or snapshot_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _signature(table):
+    """(column, type) pairs of a table"""
+    return {(column["name"].lower(), column["type"].lower()) for column in table["columns"]}
+
+
+def diff_snapshots(old, new, similarity=RENAME_SIMILARITY):
+    """Compare two snapshots: added, removed, renamed ({old: new}) and changed tables
+
+    A removed table whose columns match an added table's (Jaccard >= similarity) is reported
+    as a rename rather than a drop plus a create.
+    """
+    old_tables = (old or {}).get("tables", {})
+    new_tables = new.get("tables", {})
+    added = sorted(set(new_tables) - set(old_tables))
+    removed = sorted(set(old_tables) - set(new_tables))
+
+    renamed = {}
+    for old_name in removed:
+        old_signature = _signature(old_tables[old_name])
+        best, best_score = None, 0.0
+        for new_name in added:
+            if new_name in renamed.values():
+                continue
+            new_signature = _signature(new_tables[new_name])
+            union = old_signature | new_signature
+            score = len(old_signature & new_signature) / len(union) if union else 0.0
+            if score > best_score:
+                best, best_score = new_name, score
+        if best is not None and best_score >= similarity:
+            renamed[old_name] = best
+
+    changed = {}
+    for name in sorted(set(old_tables) & set(new_tables)):
+        before, after = _signature(old_tables[name]), _signature(new_tables[name])
+        if before != after:
+            changed[name] = {
+                "added_columns": sorted(f"{c} {t}" for c, t in after - before),
+                "removed_columns": sorted(f"{c} {t}" for c, t in before - after),
+            }
+
+    return {
+        "added": [name for name in added if name not in renamed.values()],
+        "removed": [name for name in removed if name not in renamed],
+        "renamed": renamed,
+        "changed": changed,
+    }
+
+
+@lru_cache(maxsize=None)
+def resolve_table(name):
+    """Current name of a table ("schema.table"), following renames recorded in the latest snapshot
+
+    Returns name unchanged when there is no snapshot or the table still exists.
+    """
+    try:
+        snapshot = load_snapshot()
+    except Exception as e:
+        logger.warning(f"Could not read catalog snapshot: {e}")
+        return name
+    if not snapshot or name in snapshot.get("tables", {}):
+        return name
+
+    renames = snapshot.get("renames", {})
+    current, seen = name, set()
+    while current in renames and current not in seen:
+        seen.add(current)
+        current = renames[current]
+    if current != name:
+        logger.warning(f"Table {name} was renamed to {current}; using the new name")
+    return current
+
+
+def table_names(snapshot=None):
+    """Sorted "schema.table" names in a snapshot (default: the latest)"""
+    snapshot = snapshot or load_snapshot()
+    return sorted((snapshot or {}).get("tables", {}))
@@ -0,0 +1,337 @@
+"""
+Coverage Module for TCLD Dashboard
+Per-meter bitmap of which hourly buckets have readings, so "which meters are stale" and
+"how complete is this window" are answered from memory instead of a warehouse scan
+
+Each meter has one bit per hour (packed 8 to a byte, COVERAGE_DAYS of history). The index
+is built from per-meter runs of consecutive hours (a gaps-and-islands query, one row per
+run), extended incrementally: background refreshes only read hours since the last
+extraction, and the live poller marks the buckets of every reading it ingests. A window
+query unpacks just that window's bytes: O(meters x buckets), independent of reading volume.
+The index is stored locally (COVERAGE_INDEX_PATH) and reloaded at startup.
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import DEFAULT_RANGE_DAYS, get_buildings, get_coverage_runs
+from rollups import SQL_EPOCH_HOURS
+from segments import normalize_range
+
+logger = logging.getLogger(__name__)
+
+# Coverage configuration
+COVERAGE_INDEX_PATH = os.getenv("COVERAGE_INDEX_PATH", "coverage_index.npz")
+COVERAGE_DAYS = int(os.getenv("COVERAGE_DAYS", "400"))
+COVERAGE_REFRESH_SECONDS = int(os.getenv("COVERAGE_REFRESH_SECONDS", "900"))
+COVERAGE_STALE_HOURS = int(os.getenv("COVERAGE_STALE_HOURS", "6"))
+COVERAGE_PREFETCH = os.getenv("COVERAGE_PREFETCH", "True") == "True"
+# Most gap intervals returned for shading (the longest are kept)
+COVERAGE_MAX_GAPS = int(os.getenv("COVERAGE_MAX_GAPS", "100"))
+
+EPOCH = datetime(1970, 1, 1)
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_index = None  # CoverageIndex, loaded on first use
+
+# numpy is imported inside the helpers so importing this module stays cheap
+
+
+def epoch_hour(moment):
+    """Hours since the Unix epoch of a datetime or ISO string (floored)"""
+    if not isinstance(moment, datetime):
+        moment = datetime.fromisoformat(str(moment)).replace(tzinfo=None)
+    return int((moment - EPOCH).total_seconds() // 3600)
+
+
+def hour_iso(hour):
+    """ISO timestamp of the start of an epoch hour"""
+    return (EPOCH + timedelta(hours=int(hour))).isoformat()
+
+
+class CoverageIndex:
+    """Hourly reading bitmaps per meter code, plus each meter's newest covered hour"""
+
+    def __init__(self, meters=(), origin=None, bits=None, last_seen=None, watermark=None, extracted_at=0.0):
+        import numpy as np
+
+        self.meters = list(meters)
+        self.rows = {meter: row for row, meter in enumerate(self.meters)}
+        self.origin = origin  # epoch hour of bit 0, a multiple of 8
+        self.bits = bits if bits is not None else np.zeros((len(self.meters), 0), dtype=np.uint8)
+        self.last_seen = last_seen if last_seen is not None else np.full(len(self.meters), -1, dtype=np.int64)
+        self.watermark = watermark  # epoch hour up to which runs were extracted
+        self.extracted_at = extracted_at
+
+    def _row(self, meter):
+        """Row of a meter, adding an empty one for a new meter"""
+        import numpy as np
+
+        row = self.rows.get(meter)
+        if row is None:
+            row = self.rows[meter] = len(self.meters)
+            self.meters.append(meter)
+            self.bits = np.vstack([self.bits, np.zeros((1, self.bits.shape[1]), dtype=np.uint8)])
+            self.last_seen = np.append(self.last_seen, -1)
+        return row
+
+    def _fit(self, first_hour, last_hour):
+        """Grow the bitmap to cover [first_hour, last_hour], dropping hours beyond COVERAGE_DAYS"""
+        import numpy as np
+
+        floor = last_hour - COVERAGE_DAYS * 24
+        first_hour = max(first_hour, floor)
+        if self.origin is None:
+            self.origin = first_hour // 8 * 8
+        if first_hour < self.origin:
+            extra = -(-(self.origin - first_hour) // 8)
+            self.bits = np.hstack([np.zeros((len(self.meters), extra), dtype=np.uint8), self.bits])
+            self.origin -= extra * 8
+        needed = (last_hour - self.origin) // 8 + 1
+        if needed > self.bits.shape[1]:
+            # Grow by at least a week of bytes, so hourly live marks rarely reallocate
+            grow = max(needed - self.bits.shape[1], 21)
+            self.bits = np.hstack([self.bits, np.zeros((len(self.meters), grow), dtype=np.uint8)])
+        drop = (floor - self.origin) // 8
+        if drop > 0:
+            self.bits = self.bits[:, drop:]
+            self.origin += drop * 8
+
+    def _rows_of(self, meters):
+        """Row per meter code of a list (codes looked up once each)"""
+        import numpy as np
+
+        codes, inverse = np.unique(np.asarray(meters, dtype=str), return_inverse=True)
+        return np.array([self._row(code) for code in codes.tolist()], dtype=np.int64)[inverse]
+
+    def mark(self, meters, hours):
+        """Set the bits of (meter code, epoch hour) pairs (vectorized over the pairs)"""
+        import numpy as np
+
+        hours = np.asarray(hours, dtype=np.int64)
+        if not len(hours):
+            return
+        self._mark_rows(self._rows_of(meters), hours)
+
+    def _mark_rows(self, rows, hours):
+        """Set the bits of (row, epoch hour) pairs"""
+        import numpy as np
+
+        self._fit(int(hours.min()), int(hours.max()))
+        keep = hours >= self.origin
+        rows, offsets = rows[keep], hours[keep] - self.origin
+        np.bitwise_or.at(self.bits, (rows, offsets >> 3), (0x80 >> (offsets & 7)).astype(np.uint8))
+        np.maximum.at(self.last_seen, rows, hours[keep])
+
+    def mark_runs(self, meters, firsts, lasts):
+        """Set the bits of inclusive hour runs [first, last] per meter"""
+        import numpy as np
+
+        firsts = np.asarray(firsts, dtype=np.int64)
+        lasts = np.asarray(lasts, dtype=np.int64)
+        if not len(firsts):
+            return
+        # Clip to the retained history before expanding runs into hours
+        firsts = np.maximum(firsts, lasts.max() - COVERAGE_DAYS * 24)
+        keep = firsts <= lasts
+        rows = self._rows_of(meters)[keep]
+        firsts, lasts = firsts[keep], lasts[keep]
+        lengths = lasts - firsts + 1
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        hours = np.arange(lengths.sum()) - starts + np.repeat(firsts, lengths)
+        self._mark_rows(np.repeat(rows, lengths), hours)
+
+    def window(self, rows, start_hour, end_hour):
+        """meters x hours matrix (0/1) of the given rows over [start_hour, end_hour)"""
+        import numpy as np
+
+        result = np.zeros((len(rows), max(0, end_hour - start_hour)), dtype=np.uint8)
+        if self.origin is None or not result.size:
+            return result
+        lo = max(start_hour, self.origin)
+        hi = min(end_hour, self.origin + self.bits.shape[1] * 8)
+        if lo >= hi:
+            return result
+        # Only the bytes of the window are unpacked
+        first_byte, last_byte = (lo - self.origin) >> 3, ((hi - 1 - self.origin) >> 3) + 1
+        unpacked = np.unpackbits(self.bits[np.asarray(rows)][:, first_byte:last_byte], axis=1)
+        skip = (lo - self.origin) - first_byte * 8
+        result[:, lo - start_hour:hi - start_hour] = unpacked[:, skip:skip + hi - lo]
+        return result
+
+    def save(self, path=COVERAGE_INDEX_PATH):
+        """Write the index atomically"""
+        import numpy as np
+
+        buffer = io.BytesIO()
+        meta = {"origin": self.origin, "watermark": self.watermark, "extracted_at": self.extracted_at}
+        np.savez_compressed(
+            buffer, bits=self.bits, last_seen=self.last_seen, meters=np.array(self.meters, dtype=str),
+            meta=np.array(json.dumps(meta)),
+        )
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=COVERAGE_INDEX_PATH):
+        """Read a stored index; an empty one when the file is missing or unreadable"""
+        import numpy as np
+
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with np.load(path) as stored:
+                meta = json.loads(str(stored["meta"]))
+                return cls(
+                    stored["meters"].tolist(), meta["origin"], stored["bits"], stored["last_seen"],
+                    meta["watermark"], meta["extracted_at"],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read coverage index {path}: {e}")
+            return cls()
+
+
+def _index_now():
+    """The in-memory index, loaded from disk on first use"""
+    global _index
+    with _lock:
+        if _index is None:
+            _index = CoverageIndex.load()
+        return _index
+
+
+def refresh_index(force=False):
+    """Extract coverage runs since the last extraction (all retained history the first time)
+
+    Returns the number of meters in the index, or None when the query failed.
+    """
+    with _refresh_lock:
+        index = _index_now()
+        if not force and time.time() - index.extracted_at < COVERAGE_REFRESH_SECONDS:
+            return len(index.meters)
+
+        now_hour = epoch_hour(datetime.now())
+        # Re-read the watermark hour itself: it may have been partial at the last extraction
+        since_hour = now_hour - COVERAGE_DAYS * 24 if force or index.watermark is None else index.watermark
+        started = time.perf_counter()
+        df = get_coverage_runs(hour_iso(since_hour))
+        if df is None:
+            return None
+
+        with _lock:
+            index.mark_runs(
+                df["metercode"].astype(str).tolist(),
+                df["firstHour"].astype("int64") - SQL_EPOCH_HOURS,
+                df["lastHour"].astype("int64") - SQL_EPOCH_HOURS,
+            )
+            index.watermark = now_hour
+            index.extracted_at = time.time()
+        try:
+            with _lock:
+                index.save()
+        except OSError as e:
+            logger.warning(f"Could not store coverage index: {e}")
+        logger.info(
+            f"Coverage index updated from {len(df)} runs: {len(index.meters)} meters "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return len(index.meters)
+
+
+def refresh_in_background(force=False):
+    """Refresh the index on a daemon thread unless a refresh is already running"""
+    if _refresh_lock.locked():
+        return None
+    thread = threading.Thread(target=refresh_index, args=(force,), name="coverage-index", daemon=True)
+    thread.start()
+    return thread
+
+
+def observe(rows):
+    """Mark the buckets of ingested readings (dicts with ptagId and timestamp), e.g. live deltas"""
+    rows = [row for row in rows if row.get("ptagId") is not None and row.get("timestamp") is not None]
+    if not rows:
+        return
+    index = _index_now()
+    with _lock:
+        index.mark([str(row["ptagId"]) for row in rows], [epoch_hour(row["timestamp"]) for row in rows])
+
+
+def _building_name(building_id):
+    """Name of a building (a warehouse query when not cached, so call it outside _lock)"""
+    return next(
+        (b.get("BuildingName") for b in get_buildings() or [] if str(b.get("BuildingID")) == str(building_id)),
+        None,
+    )
+
+
+def _meter_rows(index, building_id, name):
+    """Index rows of a building's meters (codes start with its name, as in the warehouse joins)"""
+    if not building_id:
+        return list(range(len(index.meters)))
+    if not name:
+        return []
+    return [row for row, meter in enumerate(index.meters) if meter.startswith(str(name))]
+
+
+def _gap_runs(counts, meters, start_hour):
+    """[start ISO, end ISO, missing share] per run of hours where some meters have no reading"""
+    import numpy as np
+
+    missing = 1 - counts / meters
+    partial = missing > 0
+    edges = np.flatnonzero(np.diff(np.r_[False, partial, False].astype(np.int8)))
+    runs = [(int(a), int(b), float(missing[a:b].max())) for a, b in zip(edges[::2], edges[1::2])]
+    if len(runs) > COVERAGE_MAX_GAPS:
+        runs = sorted(sorted(runs, key=lambda run: run[1] - run[0], reverse=True)[:COVERAGE_MAX_GAPS])
+    return [[hour_iso(start_hour + a), hour_iso(start_hour + b), round(share, 3)] for a, b, share in runs]
+
+
+def window_coverage(building_id=None, start_date=None, end_date=None):
+    """Coverage of a window for a building (all meters when None), or None before the first extraction
+
+    Returns meters, reporting (meters with any reading in the window), coverage (% of
+    meter-hours with readings), stale (meters without readings for COVERAGE_STALE_HOURS),
+    gaps ([start, end, missing share] for chart shading) and as_of. The current hour is
+    still filling up and is left out.
+    """
+    index = _index_now()
+    if time.time() - index.extracted_at >= COVERAGE_REFRESH_SECONDS:
+        refresh_in_background()
+    if index.watermark is None:
+        return None
+
+    start, end = normalize_range(start_date, end_date)
+    now_hour = epoch_hour(datetime.now())
+    end_hour = min(epoch_hour(end), now_hour)
+    start_hour = epoch_hour(start) if start else end_hour - DEFAULT_RANGE_DAYS * 24
+    name = _building_name(building_id) if building_id else None
+
+    with _lock:
+        rows = _meter_rows(index, building_id, name)
+        window = index.window(rows, start_hour, end_hour)
+        last_seen = index.last_seen[rows].tolist() if rows else []
+        meters = [index.meters[row] for row in rows]
+    stale = sorted(meter for meter, seen in zip(meters, last_seen) if seen < now_hour - COVERAGE_STALE_HOURS)
+
+    counts = window.sum(axis=0, dtype="int64")
+    reporting = int(window.any(axis=1).sum())
+    buckets = len(counts)
+    covered = int(counts.sum())
+    return {
+        "meters": len(rows),
+        "reporting": reporting,
+        "buckets": buckets,
+        "coverage": round(100 * covered / (len(rows) * buckets), 1) if rows and buckets else None,
+        "stale": stale,
+        "gaps": _gap_runs(counts, len(rows), start_hour) if rows and buckets else [],
+        "as_of": hour_iso(index.watermark),
+    }
@@ -3,13 +3,22 @@ Database Connection Module for TCLD Dashboard
 Handles Azure Synapse database operations with username/password authentication
 """
 
-import pyodbc
-import pandas as pd
 import logging
 import os
+import re
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
+from datetime import datetime, timedelta
 
-# Load environment variables
+from admission import export_gate, warehouse_gate
+from cache import cached
+from diagnostics import QueryTrace, capture_plan, note_connect
+from frames import compact_frame
+from statements import ConnectionPool, Statement, prepared_cursor
+
+# Load environment variables (cheap; module settings below read them at import)
+# pyodbc and pandas are imported on first query to keep app import and worker boot fast
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -20,24 +29,69 @@ DB_NAME = os.getenv("DB_NAME", "tcld_syn_db_dev")
 DB_USER = os.getenv("DB_USER", "readonlyappuser")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "sqHbKRVQmk7TYDyEXtfWG6")
 
-# Connection string using SQL Server authentication (username/password)
-CONNECTION_STRING = (
-    f"Driver={{ODBC Driver 17 for SQL Server}};"
-    f"Server={DB_SERVER};"
-    f"Database={DB_NAME};"
-    f"UID={DB_USER};"
-    f"PWD={DB_PASSWORD};"
-    f"Encrypt=yes;"
-    f"TrustServerCertificate=no;"
-    f"Connection Timeout=30;"
-)
+
+@lru_cache(maxsize=1)
+def get_connection_string():
+    """Connection string using SQL Server authentication (username/password), built on first use"""
+    return (
+        f"Driver={{ODBC Driver 17 for SQL Server}};"
+        f"Server={DB_SERVER};"
+        f"Database={DB_NAME};"
+        f"UID={DB_USER};"
+        f"PWD={DB_PASSWORD};"
+        f"Encrypt=yes;"
+        f"TrustServerCertificate=no;"
+        f"Connection Timeout=30;"
+    )
+
+
+# Warehouse tables (schema-qualified); renames detected by schema_discovery.py are followed
+EAPTAG_TABLE = os.getenv("EAPTAG_TABLE", "dbo.DW_F_EAPtag_T")
+BUILDING_TABLE = os.getenv("BUILDING_TABLE", "dbo.DW_D_BUILDING_BK20260120")
+IAQ_TABLE = os.getenv("IAQ_TABLE", "dbo.DM_F_IAQ_BuildingLayer_Hourly_Dashboard_AllDate_CN")
+
+# Time column of the IAQ fact; when set, the area index (areas.py) refreshes incrementally
+# and the IAQ panel is available
+IAQ_TIME_COLUMN = os.getenv("IAQ_TIME_COLUMN", "")
+
+# IAQ measurement columns shown in the IAQ panel, by result alias ("PM2.5" -> "PM2_5")
+IAQ_METRICS = {
+    re.sub(r"\W+", "_", name.strip()).strip("_"): name.strip()
+    for name in os.getenv("IAQ_METRICS", "PM2.5,PM10,CO2,Temperature,Humidity").split(",")
+    if name.strip()
+}
+
+# Default dashboard window, aligned to the hour so repeated page loads share cache keys
+DEFAULT_RANGE_DAYS = int(os.getenv("DEFAULT_RANGE_DAYS", "30"))
+
+# Rows fetched per dashboard window; area and sub-range changes are filtered in the browser
+STORE_ROW_LIMIT = int(os.getenv("STORE_ROW_LIMIT", "5000"))
+
+# Building comparison: most buildings per batched query, and SQL bucket expressions by name
+# ({column} is the time column being bucketed)
+COMPARE_MAX_BUILDINGS = int(os.getenv("COMPARE_MAX_BUILDINGS", "20"))
+BUCKET_EXPRESSIONS = {
+    "hour": "DATEADD(hour, DATEDIFF(hour, 0, {column}), 0)",
+    "day": "DATEADD(day, DATEDIFF(day, 0, {column}), 0)",
+}
+
+
+def default_date_range():
+    """Return the default (start_date, end_date) as ISO strings, as the date picker sends them"""
+    end = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    start = end - timedelta(days=DEFAULT_RANGE_DAYS)
+    return start.isoformat(), end.isoformat()
 
 
 def get_connection():
     """Get database connection"""
     try:
         logger.info(f"Attempting to connect to {DB_SERVER}/{DB_NAME} as {DB_USER}")
-        conn = pyodbc.connect(CONNECTION_STRING, timeout=30)
+        import pyodbc
+
+        started = time.perf_counter()
+        conn = pyodbc.connect(get_connection_string(), timeout=30)
+        note_connect((time.perf_counter() - started) * 1000)
         logger.info("Database connection successful")
         return conn
     except Exception as e:
@@ -46,46 +100,367 @@ def get_connection():
         return None
 
 
+# Connections (and the statements prepared on them) are reused across queries;
+# checkouts wait for a warehouse admission slot
+pool = ConnectionPool(get_connection, gate=warehouse_gate)
+
+TABLES = {"eaptag": EAPTAG_TABLE, "building": BUILDING_TABLE, "iaq": IAQ_TABLE}
+
+# Canonical statements: optional filters pick a variant, values are always parameters
+PING = Statement("test_connection", "SELECT 1")
+
+BUILDINGS = Statement(
+    "get_buildings",
+    """
+        SELECT DISTINCT
+            BuildingID,
+            BuildingName,
+            Region,
+            PortfolioType
+        FROM {building}
+        WHERE BuildingID IS NOT NULL
+        ORDER BY BuildingName
+        """,
+    tables=TABLES,
+)
+
+AREAS = Statement(
+    "get_areas",
+    """
+        SELECT DISTINCT
+            LocationName as areaName,
+            Area as areaCode,
+            Portfolio as buildingCode
+        FROM {iaq}
+        WHERE Portfolio = ?
+        ORDER BY LocationName
+        """,
+    tables=TABLES,
+)
+
+# All buildings' areas in one pass, for the area index; lastSeen is its refresh watermark
+ALL_AREAS = Statement(
+    "get_all_areas",
+    """
+        SELECT
+            Portfolio as buildingCode,
+            LocationName as areaName,
+            Area as areaCode"""
+    + (f",\n            MAX({IAQ_TIME_COLUMN}) as lastSeen" if IAQ_TIME_COLUMN else "")
+    + """
+        FROM {iaq}
+        WHERE Portfolio IS NOT NULL""",
+    (("since", f"{IAQ_TIME_COLUMN} > ?"),) if IAQ_TIME_COLUMN else (),
+    " GROUP BY Portfolio, LocationName, Area",
+    TABLES,
+)
+
+# Building and area filters shared by the EA Ptag reading statements
+READING_FILTERS = (
+    ("building_id", "b.BuildingID = ?"),
+    ("area_id", "iaq.LocationName = ?"),
+)
+
+EAPTAG_DATA = Statement(
+    "get_eaptag_data",
+    """
+        SELECT TOP (?)
+            b.BuildingName,
+            iaq.LocationName,
+            e.metercode as ptagId,
+            e.timestamp,
+            e.MeterReadings as value,
+            e.UOM as unit
+        FROM {eaptag} e
+        LEFT JOIN {building} b ON e.metercode LIKE b.BuildingName + '%'
+        LEFT JOIN {iaq} iaq ON iaq.Portfolio = b.BuildingID
+        WHERE 1=1""",
+    READING_FILTERS
+    + (
+        ("start_date", "e.timestamp >= ?"),
+        ("end_date", "e.timestamp <= ?"),
+        ("end_before", "e.timestamp < ?"),
+    ),
+    " ORDER BY e.timestamp DESC",
+    TABLES,
+)
+
+EAPTAG_SINCE = Statement(
+    "get_eaptag_data_since",
+    """
+        SELECT TOP (?)
+            b.BuildingID,
+            b.BuildingName,
+            iaq.LocationName,
+            e.metercode as ptagId,
+            e.timestamp,
+            e.MeterReadings as value,
+            e.UOM as unit
+        FROM {eaptag} e
+        LEFT JOIN {building} b ON e.metercode LIKE b.BuildingName + '%'
+        LEFT JOIN {iaq} iaq ON iaq.Portfolio = b.BuildingID
+        WHERE e.timestamp > ?""",
+    READING_FILTERS,
+    " ORDER BY e.timestamp ASC",
+    TABLES,
+)
+
+LATEST_READING = Statement("get_latest_reading_time", "SELECT MAX(timestamp) FROM {eaptag}", tables=TABLES)
+
+EAPTAG_BATCHES = Statement(
+    "iter_eaptag_batches",
+    """
+        SELECT
+            b.BuildingName,
+            iaq.LocationName,
+            e.metercode as ptagId,
+            e.timestamp,
+            e.MeterReadings as value,
+            e.UOM as unit
+        FROM {eaptag} e
+        LEFT JOIN {building} b ON e.metercode LIKE b.BuildingName + '%'
+        LEFT JOIN {iaq} iaq ON iaq.Portfolio = b.BuildingID
+        WHERE 1=1""",
+    READING_FILTERS
+    + (
+        ("start_date", "e.timestamp >= ?"),
+        ("end_before", "e.timestamp < ?"),
+        # Keyset cursor: rows after (timestamp, ptagId, LocationName), in the ORDER BY order
+        (
+            "after",
+            "(e.timestamp > ? OR (e.timestamp = ? AND (e.metercode > ?"
+            " OR (e.metercode = ? AND ISNULL(iaq.LocationName, '') > ?))))",
+        ),
+    ),
+    " ORDER BY e.timestamp ASC, e.metercode ASC, ISNULL(iaq.LocationName, '') ASC",
+    TABLES,
+)
+
+# Areas are counted in their own aggregate: joining IAQ rows onto readings
+# would repeat every reading once per area and inflate the sums
+COMPARISONS = {
+    bucket: Statement(
+        f"get_building_comparison:{bucket}",
+        """
+        WITH readings AS (
+            SELECT
+                b.BuildingID,
+                b.BuildingName,
+                """
+        + expression.replace("{column}", "e.timestamp")
+        + """ as bucket,
+                CAST(e.MeterReadings AS FLOAT) as value
+            FROM {eaptag} e
+            JOIN {building} b ON e.metercode LIKE b.BuildingName + '%'
+            WHERE b.BuildingID IN ({in_list})""",
+        (
+            ("start_date", "e.timestamp >= ?"),
+            ("end_date", "e.timestamp <= ?"),
+            ("end_before", "e.timestamp < ?"),
+        ),
+        """
+        ),
+        areas AS (
+            SELECT Portfolio as BuildingID, COUNT(DISTINCT LocationName) as areaCount
+            FROM {iaq}
+            WHERE Portfolio IN ({in_list})
+            GROUP BY Portfolio
+        )
+        SELECT
+            r.BuildingID,
+            r.BuildingName,
+            r.bucket as timestamp,
+            SUM(r.value) as total,
+            MAX(r.value) as peak,
+            COUNT(*) as readings,
+            MAX(a.areaCount) as areaCount
+        FROM readings r
+        LEFT JOIN areas a ON a.BuildingID = r.BuildingID
+        GROUP BY r.BuildingID, r.BuildingName, r.bucket
+        ORDER BY r.BuildingName, r.bucket
+        """,
+        TABLES,
+    )
+    for bucket, expression in BUCKET_EXPRESSIONS.items()
+}
+
+# IAQ measurements per area and time bucket for one building, from the IAQ fact alone: energy
+# is fetched separately (COMPARISONS) and joined by bucket in the browser, so no reading is
+# repeated per area. samples is the number of IAQ rows in the bucket (for re-aggregation)
+IAQ_SERIES = {
+    bucket: Statement(
+        f"get_iaq_series:{bucket}",
+        """
+        SELECT
+            iaq.Area as areaCode,
+            iaq.LocationName as areaName,
+            """
+        + expression.replace("{column}", f"iaq.{IAQ_TIME_COLUMN}")
+        + """ as timestamp,
+            COUNT(*) as samples"""
+        + "".join(f",\n            AVG(CAST(iaq.[{name}] AS FLOAT)) as {key}" for key, name in IAQ_METRICS.items())
+        + """
+        FROM {iaq} iaq
+        WHERE iaq.Portfolio = ?""",
+        (
+            ("start_date", f"iaq.{IAQ_TIME_COLUMN} >= ?"),
+            ("end_before", f"iaq.{IAQ_TIME_COLUMN} < ?"),
+        ),
+        """
+        GROUP BY iaq.Area, iaq.LocationName, """
+        + expression.replace("{column}", f"iaq.{IAQ_TIME_COLUMN}")
+        + """
+        ORDER BY areaCode, timestamp
+        """,
+        TABLES,
+    )
+    for bucket, expression in BUCKET_EXPRESSIONS.items()
+} if IAQ_TIME_COLUMN else {}
+
+# The segment width is a parameter, so it is applied in a derived table and grouped on by name
+METRICS_BY_SEGMENT = Statement(
+    "get_metrics_by_segment",
+    """
+        SELECT
+            segment,
+            SUM(value) as totalEnergyConsumption,
+            COUNT(value) as valueCount,
+            MAX(value) as peakConsumption,
+            MIN(value) as lowestConsumption,
+            COUNT(*) as recordCount,
+            MIN(timestamp) as startDate,
+            MAX(timestamp) as endDate
+        FROM (
+            SELECT
+                DATEADD(hour, (DATEDIFF(hour, ?, timestamp) / ?) * ?, ?) as segment,
+                timestamp,
+                CAST(MeterReadings AS FLOAT) as value
+            FROM {eaptag}
+            WHERE timestamp >= ? AND timestamp < ?
+        ) s
+        GROUP BY segment
+        """,
+    tables=TABLES,
+)
+
+DASHBOARD_METRICS = Statement(
+    "get_dashboard_metrics",
+    """
+        SELECT
+            SUM(CAST(MeterReadings AS FLOAT)) as totalEnergyConsumption,
+            AVG(CAST(MeterReadings AS FLOAT)) as averageConsumption,
+            MAX(CAST(MeterReadings AS FLOAT)) as peakConsumption,
+            MIN(CAST(MeterReadings AS FLOAT)) as lowestConsumption,
+            COUNT(*) as recordCount,
+            MIN(timestamp) as startDate,
+            MAX(timestamp) as endDate
+        FROM {eaptag}
+        WHERE 1=1""",
+    (
+        ("start_date", "timestamp >= ?"),
+        ("end_date", "timestamp <= ?"),
+    ),
+    tables=TABLES,
+)
+
+# Runs of consecutive hours with readings per meter (gaps and islands): a meter reporting
+# every hour for a year is one row. Hours are DATEDIFF(hour, 0, timestamp); see coverage.py
+COVERAGE_RUNS = Statement(
+    "get_coverage_runs",
+    """
+        SELECT metercode, MIN(hour) as firstHour, MAX(hour) as lastHour
+        FROM (
+            SELECT
+                metercode,
+                hour,
+                hour - ROW_NUMBER() OVER (PARTITION BY metercode ORDER BY hour) as island
+            FROM (
+                SELECT DISTINCT metercode, DATEDIFF(hour, 0, timestamp) as hour
+                FROM {eaptag}
+                WHERE timestamp >= ?
+            ) h
+        ) runs
+        GROUP BY metercode, island
+        """,
+    tables=TABLES,
+)
+
+
+def query_frame(conn, query, params=None, name="query"):
+    """Run a query into a DataFrame (like pd.read_sql), recording phase timings in diagnostics
+
+    On a pooled connection the statement runs on its prepared cursor (see statements.py).
+    """
+    import pandas as pd
+
+    trace = QueryTrace(name, query, params)
+    rows, error = None, None
+    try:
+        cursor, trace.reused = prepared_cursor(conn, query, name)
+        with trace.phase("execute"):
+            cursor.execute(query, params or [])
+        with trace.phase("fetch"):
+            records = [tuple(row) for row in cursor.fetchall()]
+        with trace.phase("frame"):
+            df = pd.DataFrame.from_records(
+                records, columns=[column[0] for column in cursor.description], coerce_float=True
+            )
+        rows = len(df)
+        capture_plan(conn, trace)
+        return df
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        trace.finish(rows, error)
+
+
+def query_scalar(conn, query, params=None, name="query"):
+    """Run a single-value query, recording it in diagnostics like query_frame"""
+    trace = QueryTrace(name, query, params)
+    rows, error = None, None
+    try:
+        cursor, trace.reused = prepared_cursor(conn, query, name)
+        with trace.phase("execute"):
+            cursor.execute(query, params or [])
+        with trace.phase("fetch"):
+            row = cursor.fetchone()
+        rows = 0 if row is None else 1
+        return None if row is None else row[0]
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        trace.finish(rows, error)
+
+
+@cached("test_connection", ttl=30)
 def test_connection():
     """Test database connection"""
     try:
-        conn = get_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            result = cursor.fetchone()
-            conn.close()
-            return result is not None
-        return False
+        with pool.connection() as conn:
+            if conn:
+                result = query_scalar(conn, *PING.bind(), name="test_connection")
+                return result is not None
+            return False
     except Exception as e:
         logger.error(f"Connection test failed: {e}")
         return False
 
 
+@cached("get_buildings")
 def get_buildings():
     """Get list of all buildings"""
     try:
-        conn = get_connection()
-        if not conn:
-            logger.error("Failed to get database connection in get_buildings()")
-            return None
+        with pool.connection() as conn:
+            if not conn:
+                logger.error("Failed to get database connection in get_buildings()")
+                return None
 
-        # Query the most recent building dimension table
-        query = """
-        SELECT DISTINCT
-            BuildingID,
-            BuildingName,
-            Region,
-            PortfolioType
-        FROM dbo.DW_D_BUILDING_BK20260120
-        WHERE BuildingID IS NOT NULL
-        ORDER BY BuildingName
-        """
+            # Query the most recent building dimension table
+            logger.info("Executing query to get buildings...")
+            df = query_frame(conn, *BUILDINGS.bind(), "get_buildings")
 
-        logger.info("Executing query to get buildings...")
-        df = pd.read_sql(query, conn)
-        conn.close()
-        
         logger.info(f"Retrieved {len(df)} buildings from database")
 
         if df.empty:
@@ -100,29 +475,19 @@ def get_buildings():
         return None
 
 
+@cached("get_areas")
 def get_areas(building_id):
     """Get areas/locations for a specific building from IAQ dashboard data"""
     try:
         if not building_id:
             return None
 
-        conn = get_connection()
-        if not conn:
-            return None
-
-        # Query the IAQ dashboard to get unique locations/areas for a building
-        query = """
-        SELECT DISTINCT
-            LocationName as areaName,
-            Area as areaCode,
-            Portfolio as buildingCode
-        FROM dbo.DM_F_IAQ_BuildingLayer_Hourly_Dashboard_AllDate_CN
-        WHERE Portfolio = ?
-        ORDER BY LocationName
-        """
+        with pool.connection() as conn:
+            if not conn:
+                return None
 
-        df = pd.read_sql(query, conn, params=[building_id])
-        conn.close()
+            # Query the IAQ dashboard to get unique locations/areas for a building
+            df = query_frame(conn, *AREAS.bind([building_id]), "get_areas")
 
         if df.empty:
             logger.warning(f"No areas found for building {building_id}")
@@ -136,97 +501,262 @@ def get_areas(building_id):
         return None
 
 
-def get_eaptag_data(building_id=None, area_id=None, start_date=None, end_date=None, limit=100):
-    """Get EA Ptag (energy meter) data from available tables with building and location info"""
+def get_all_areas(since=None):
+    """Get the areas of every building in one grouped query (not cached; see areas.py)
+
+    since (with IAQ_TIME_COLUMN set) limits the scan to IAQ rows newer than a previous watermark.
+    """
     try:
-        conn = get_connection()
-        if not conn:
-            return None
+        with pool.connection() as conn:
+            if not conn:
+                return None
 
-        # Query combines EA Ptag data with building and location information
-        query = f"""
-        SELECT TOP {limit}
-            b.BuildingName,
-            iaq.LocationName,
-            e.metercode as ptagId,
-            e.timestamp,
-            e.MeterReadings as value,
-            e.UOM as unit
-        FROM dbo.DW_F_EAPtag_T e
-        LEFT JOIN dbo.DW_D_BUILDING_BK20260120 b ON e.metercode LIKE b.BuildingName + '%'
-        LEFT JOIN dbo.DM_F_IAQ_BuildingLayer_Hourly_Dashboard_AllDate_CN iaq ON iaq.Portfolio = b.BuildingID
-        WHERE 1=1
-        """
+            query, params = ALL_AREAS.bind(since=since if IAQ_TIME_COLUMN else None)
+            logger.info(f"Extracting areas for all buildings{' since ' + str(since) if since else ''}...")
+            df = query_frame(conn, query, params, "get_all_areas")
 
-        params = []
+        return df.to_dict("records")
+    except Exception as e:
+        logger.error(f"Error getting all areas: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
 
-        if building_id:
-            query += " AND b.BuildingID = ?"
-            params.append(building_id)
 
-        if area_id:
-            query += " AND iaq.LocationName = ?"
-            params.append(area_id)
+@cached("get_eaptag_data")
+def get_eaptag_data(building_id=None, area_id=None, start_date=None, end_date=None, limit=100,
+                    end_exclusive=False, allow_empty=False):
+    """Get EA Ptag (energy meter) data from available tables with building and location info
 
-        if start_date:
-            query += " AND e.timestamp >= ?"
-            params.append(start_date)
+    Returns a compact DataFrame (see frames.compact_frame) with epoch-ms timestamps.
+    end_exclusive makes the range half-open, as used for cached segments (see segments.py);
+    allow_empty returns an empty frame for no rows, so None only means the query failed.
+    """
+    try:
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            # Query combines EA Ptag data with building and location information
+            query, params = EAPTAG_DATA.bind(
+                [int(limit)],
+                building_id=building_id or None,
+                area_id=area_id or None,
+                start_date=start_date or None,
+                end_date=None if end_exclusive else end_date or None,
+                end_before=end_date or None if end_exclusive else None,
+            )
+
+            logger.info(f"Executing EA Ptag query with {len(params)} parameters...")
+            df = query_frame(conn, query, params, "get_eaptag_data")
+
+        if df.empty and not allow_empty:
+            logger.warning("EA Ptag query returned no results")
+            return None
 
-        if end_date:
-            query += " AND e.timestamp <= ?"
-            params.append(end_date)
+        return compact_frame(df)
+    except Exception as e:
+        logger.error(f"Error getting EA Ptag data: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
 
-        query += " ORDER BY e.timestamp DESC"
 
-        logger.info(f"Executing EA Ptag query with {len(params)} parameters...")
-        df = pd.read_sql(query, conn, params=params)
-        conn.close()
+def get_eaptag_data_since(since, building_id=None, area_id=None, limit=1000):
+    """Get EA Ptag readings newer than a timestamp, oldest first, for live appends (not cached)"""
+    try:
+        with pool.connection() as conn:
+            if not conn:
+                return None
 
-        if df.empty:
-            logger.warning("EA Ptag query returned no results")
-            return None
+            query, params = EAPTAG_SINCE.bind(
+                [int(limit), since], building_id=building_id or None, area_id=area_id or None
+            )
+            df = query_frame(conn, query, params, "get_eaptag_data_since")
 
         return df.to_dict("records")
     except Exception as e:
-        logger.error(f"Error getting EA Ptag data: {e}")
+        logger.error(f"Error getting new EA Ptag data: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return None
 
 
-def get_dashboard_metrics(building_id=None, start_date=None, end_date=None):
-    """Get dashboard metrics (summary statistics)"""
+def get_latest_reading_time():
+    """Get the timestamp of the newest EA Ptag reading (cheap change check for live mode)"""
     try:
-        conn = get_connection()
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            return query_scalar(conn, *LATEST_READING.bind(), name="get_latest_reading_time")
+    except Exception as e:
+        logger.error(f"Error getting latest reading time: {e}")
+        return None
+
+
+def iter_eaptag_batches(building_id=None, area_id=None, start_date=None, end_date=None,
+                        after=None, after_ptag=None, after_location=None, batch_size=5000):
+    """Stream the full filtered EA Ptag result (no TOP) as (columns, rows) batches
+
+    The range is half-open, [start_date, end_date), like the cached segments (see
+    segments.normalize_range).
+    Rows are ordered by (timestamp, ptagId, LocationName) and fetched with cursor.fetchmany,
+    so memory stays flat. after, after_ptag and after_location (the last row received)
+    resume an interrupted export just past that row; with after alone, every row at that
+    timestamp is sent again.
+    The connection is held while the client downloads, so it is admitted by export_gate,
+    not the warehouse gate that callbacks queue on.
+    """
+    with pool.connection(gate=export_gate) as conn:
         if not conn:
+            raise ConnectionError("Database connection failed")
+
+        query, params = EAPTAG_BATCHES.bind(
+            building_id=building_id or None,
+            area_id=area_id or None,
+            start_date=start_date or None,
+            end_before=end_date or None,
+            after=(after, after, after_ptag or "", after_ptag or "", after_location or "") if after else None,
+        )
+
+        trace = QueryTrace("iter_eaptag_batches", query, params)
+        total, error = 0, None
+        try:
+            cursor, trace.reused = prepared_cursor(conn, query, "iter_eaptag_batches")
+            cursor.arraysize = batch_size
+            with trace.phase("execute"):
+                cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+
+            while True:
+                with trace.phase("fetch"):
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                total += len(rows)
+                yield columns, rows
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Elapsed includes time spent streaming to the client between fetches
+            trace.finish(total, error)
+
+
+@cached("get_building_comparison")
+def get_building_comparison(building_ids, start_date=None, end_date=None, bucket="day", end_exclusive=False,
+                            allow_empty=False):
+    """Get consumption per building and time bucket for several buildings in one grouped query
+
+    building_ids is a sorted tuple (hashable, so equal selections share a cache entry).
+    Returns a compact DataFrame: BuildingID, BuildingName, timestamp (bucket start),
+    total, peak, readings and areaCount (monitored IAQ areas, used to normalize).
+    allow_empty returns an empty frame for no rows, as for get_eaptag_data.
+    """
+    try:
+        building_ids = list(building_ids or ())[:COMPARE_MAX_BUILDINGS]
+        if not building_ids:
             return None
 
-        query = """
-        SELECT
-            SUM(CAST(MeterReadings AS FLOAT)) as totalEnergyConsumption,
-            AVG(CAST(MeterReadings AS FLOAT)) as averageConsumption,
-            MAX(CAST(MeterReadings AS FLOAT)) as peakConsumption,
-            MIN(CAST(MeterReadings AS FLOAT)) as lowestConsumption,
-            COUNT(*) as recordCount,
-            MIN(timestamp) as startDate,
-            MAX(timestamp) as endDate
-        FROM dbo.DW_F_EAPtag_T
-        WHERE 1=1
-        """
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            query, params = COMPARISONS[bucket].bind(
+                in_values=building_ids,
+                start_date=start_date or None,
+                end_date=None if end_exclusive else end_date or None,
+                end_before=end_date or None if end_exclusive else None,
+            )
+
+            logger.info(f"Executing comparison query for {len(building_ids)} buildings by {bucket}...")
+            df = query_frame(conn, query, params, "get_building_comparison")
+
+        if df.empty and not allow_empty:
+            logger.warning("Comparison query returned no results")
+            return None
+
+        return compact_frame(df)
+    except Exception as e:
+        logger.error(f"Error getting building comparison: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+
+
+@cached("get_iaq_series")
+def get_iaq_series(building_id, start_date=None, end_date=None, bucket="hour", allow_empty=False):
+    """Get IAQ measurements per area and time bucket for one building over [start_date, end_date)
+
+    Returns a compact DataFrame: areaCode, areaName, timestamp (bucket start), samples and one
+    column per IAQ_METRICS alias; None without IAQ_TIME_COLUMN (the IAQ fact cannot be bucketed).
+    allow_empty returns an empty frame for no rows, as for get_eaptag_data.
+    """
+    try:
+        if not building_id or not IAQ_SERIES:
+            return None
+
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            query, params = IAQ_SERIES[bucket].bind(
+                [building_id], start_date=start_date or None, end_before=end_date or None
+            )
+            logger.info(f"Executing IAQ query for building {building_id} by {bucket}...")
+            df = query_frame(conn, query, params, "get_iaq_series")
+
+        if df.empty and not allow_empty:
+            logger.warning(f"No IAQ measurements found for building {building_id}")
+            return None
+
+        return compact_frame(df)
+    except Exception as e:
+        logger.error(f"Error getting IAQ series: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+
+
+def get_metrics_by_segment(start_date, end_date, segment_hours=24, origin=None):
+    """Get dashboard metrics per segment_hours bucket over [start_date, end_date), in one grouped query
+
+    Buckets are counted from origin (an hour boundary at or before start_date; start_date
+    when omitted), so passing a segment start lines them up with the cached segments.
+    Returns a DataFrame with one row per non-empty bucket (segment start, totals for
+    combining); not cached here, segments.py caches each bucket.
+    """
+    try:
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            segment_hours = int(segment_hours)
+            origin = origin or start_date
+            query, params = METRICS_BY_SEGMENT.bind(
+                [origin, segment_hours, segment_hours, origin, start_date, end_date]
+            )
+            return query_frame(conn, query, params, "get_metrics_by_segment")
+    except Exception as e:
+        logger.error(f"Error getting metrics by segment: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
 
-        params = []
 
-        if start_date:
-            query += " AND timestamp >= ?"
-            params.append(start_date)
+@cached("get_dashboard_metrics")
+def get_dashboard_metrics(building_id=None, start_date=None, end_date=None):
+    """Get dashboard metrics (summary statistics)"""
+    try:
+        with pool.connection() as conn:
+            if not conn:
+                return None
 
-        if end_date:
-            query += " AND timestamp <= ?"
-            params.append(end_date)
+            query, params = DASHBOARD_METRICS.bind(start_date=start_date or None, end_date=end_date or None)
 
-        logger.info("Executing metrics query...")
-        df = pd.read_sql(query, conn, params=params)
-        conn.close()
+            logger.info("Executing metrics query...")
+            df = query_frame(conn, query, params, "get_dashboard_metrics")
 
         if df.empty:
             logger.warning("Metrics query returned no results")
@@ -248,3 +778,22 @@ def get_dashboard_metrics(building_id=None, start_date=None, end_date=None):
         import traceback
         logger.error(traceback.format_exc())
         return None
+
+
+def get_coverage_runs(since):
+    """Get per-meter runs of consecutive hours with readings since a timestamp (not cached; see coverage.py)
+
+    Returns a DataFrame of metercode, firstHour and lastHour (inclusive DATEDIFF(hour, 0, ...) hours).
+    """
+    try:
+        with pool.connection() as conn:
+            if not conn:
+                return None
+
+            logger.info(f"Extracting meter coverage since {since}...")
+            return query_frame(conn, *COVERAGE_RUNS.bind([since]), "get_coverage_runs")
+    except Exception as e:
+        logger.error(f"Error getting coverage runs: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
@@ -1,9 +1,14 @@
 """
 Database Diagnostic Script
-Checks connection and available tables
+Checks connection and available tables, and summarizes the slow-query log
+
+Usage:
+    python diagnose.py                      # connection and table report
+    python diagnose.py slow-queries --top 10
 """
 
-import pyodbc
+import argparse
+import json
 import os
 from dotenv import load_dotenv
 
@@ -23,91 +28,153 @@ CONNECTION_STRING = (
     f"Connection Timeout=30;"
 )
 
-print("=" * 60)
-print("DATABASE DIAGNOSTIC REPORT")
-print("=" * 60)
-print(f"\nConnection Details:")
-print(f"  Server: {DB_SERVER}")
-print(f"  Database: {DB_NAME}")
-print(f"  Auth Method: {DB_AUTH_METHOD}")
-
-print("\n" + "=" * 60)
-print("STEP 1: Testing Connection...")
-print("=" * 60)
-
-try:
-    conn = pyodbc.connect(CONNECTION_STRING)
-    print("✓ Connection SUCCESSFUL")
-    
-    cursor = conn.cursor()
-    
-    # Test basic query
-    print("\n" + "=" * 60)
-    print("STEP 2: Testing Basic Query...")
+
+def run_report():
+    """Connection and table report"""
+    import pyodbc
+
     print("=" * 60)
-    
-    cursor.execute("SELECT 1 as test")
-    result = cursor.fetchone()
-    print(f"✓ Basic query works: {result}")
-    
-    # Get all tables
-    print("\n" + "=" * 60)
-    print("STEP 3: Available Tables in Database...")
+    print("DATABASE DIAGNOSTIC REPORT")
     print("=" * 60)
-    
-    cursor.execute("""
-    SELECT TABLE_SCHEMA, TABLE_NAME
-    FROM INFORMATION_SCHEMA.TABLES
-    WHERE TABLE_TYPE = 'BASE TABLE'
-    ORDER BY TABLE_SCHEMA, TABLE_NAME
-    """)
-    
-    tables = cursor.fetchall()
-    print(f"\nFound {len(tables)} tables:")
-    for schema, table_name in tables:
-        print(f"  - {schema}.{table_name}")
-    
-    # Check for specific tables we're querying
+    print(f"\nConnection Details:")
+    print(f"  Server: {DB_SERVER}")
+    print(f"  Database: {DB_NAME}")
+    print(f"  Auth Method: {DB_AUTH_METHOD}")
+
     print("\n" + "=" * 60)
-    print("STEP 4: Checking Tables Used by Dashboard...")
+    print("STEP 1: Testing Connection...")
     print("=" * 60)
-    
-    tables_to_check = [
-        ("dbo", "DW_D_Building"),
-        ("dbo", "DW_D_Area"),
-        ("dbo", "DW_F_EAPtag"),
-        ("dbo", "Config_AlertEmail_SmartWaste"),
-    ]
-    
-    for schema, table in tables_to_check:
-        cursor.execute(f"""
-        SELECT COUNT(*) as row_count
-        FROM {schema}.{table}
+
+    try:
+        conn = pyodbc.connect(CONNECTION_STRING)
+        print("✓ Connection SUCCESSFUL")
+
+        cursor = conn.cursor()
+
+        # Test basic query
+        print("\n" + "=" * 60)
+        print("STEP 2: Testing Basic Query...")
+        print("=" * 60)
+
+        cursor.execute("SELECT 1 as test")
+        result = cursor.fetchone()
+        print(f"✓ Basic query works: {result}")
+
+        # Get all tables
+        print("\n" + "=" * 60)
+        print("STEP 3: Available Tables in Database...")
+        print("=" * 60)
+
+        cursor.execute("""
+        SELECT TABLE_SCHEMA, TABLE_NAME
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_TYPE = 'BASE TABLE'
+        ORDER BY TABLE_SCHEMA, TABLE_NAME
         """)
-        count = cursor.fetchone()[0]
-        status = "✓" if count > 0 else "✗"
-        print(f"{status} {schema}.{table}: {count} rows")
-    
-    # Check building data
+
+        tables = cursor.fetchall()
+        print(f"\nFound {len(tables)} tables:")
+        for schema, table_name in tables:
+            print(f"  - {schema}.{table_name}")
+
+        # Check for specific tables we're querying
+        print("\n" + "=" * 60)
+        print("STEP 4: Checking Tables Used by Dashboard...")
+        print("=" * 60)
+
+        tables_to_check = [
+            ("dbo", "DW_D_Building"),
+            ("dbo", "DW_D_Area"),
+            ("dbo", "DW_F_EAPtag"),
+            ("dbo", "Config_AlertEmail_SmartWaste"),
+        ]
+
+        for schema, table in tables_to_check:
+            cursor.execute(f"""
+            SELECT COUNT(*) as row_count
+            FROM {schema}.{table}
+            """)
+            count = cursor.fetchone()[0]
+            status = "✓" if count > 0 else "✗"
+            print(f"{status} {schema}.{table}: {count} rows")
+
+        # Check building data
+        print("\n" + "=" * 60)
+        print("STEP 5: Sample Data from DW_D_Building...")
+        print("=" * 60)
+
+        cursor.execute("SELECT TOP 5 * FROM dbo.DW_D_Building")
+        buildings = cursor.fetchall()
+        print(f"Found {len(buildings)} buildings:")
+        for row in buildings:
+            print(f"  - {row}")
+
+        conn.close()
+
+    except pyodbc.Error as e:
+        print(f"✗ Database Error: {e}")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        import traceback
+        traceback.print_exc()
+
     print("\n" + "=" * 60)
-    print("STEP 5: Sample Data from DW_D_Building...")
+    print("DIAGNOSTIC COMPLETE")
+    print("=" * 60)
+
+
+def run_slow_queries(log_path, top, show_sql):
+    """Summarize the worst statements in the slow-query log (see diagnostics.py)"""
+    from diagnostics import read_log, summarize
+
+    records = read_log(log_path)
     print("=" * 60)
-    
-    cursor.execute("SELECT TOP 5 * FROM dbo.DW_D_Building")
-    buildings = cursor.fetchall()
-    print(f"Found {len(buildings)} buildings:")
-    for row in buildings:
-        print(f"  - {row}")
-    
-    conn.close()
-    
-except pyodbc.Error as e:
-    print(f"✗ Database Error: {e}")
-except Exception as e:
-    print(f"✗ Error: {e}")
-    import traceback
-    traceback.print_exc()
-
-print("\n" + "=" * 60)
-print("DIAGNOSTIC COMPLETE")
-print("=" * 60)
+    print("SLOW QUERY REPORT")
+    print("=" * 60)
+    print(f"\nLog: {log_path} ({len(records)} records)")
+    if not records:
+        print("No records; set SLOW_QUERY_MS lower or QUERY_DIAGNOSTICS=True to log every query")
+        return
+
+    for rank, entry in enumerate(summarize(records, top), start=1):
+        print("\n" + "-" * 60)
+        print(f"{rank}. {entry['name']} [{entry['sql_hash']}]")
+        print(
+            f"   runs: {entry['count']}  errors: {entry['errors']}  total: {entry['total_ms']:.0f} ms"
+        )
+        print(
+            f"   p50: {entry['p50_ms']:.0f} ms  p95: {entry['p95_ms']:.0f} ms  max: {entry['max_ms']:.0f} ms"
+            f"  mean rows: {entry['mean_rows']}"
+        )
+        if entry["reuse_rate"] is not None:
+            print(f"   prepared cursor reuse: {entry['reuse_rate']:.0%}")
+        phases = "  ".join(f"{phase}: {ms:.0f} ms" for phase, ms in entry["phases"].items())
+        print(f"   mean phases: {phases}")
+        print(f"   slowest params: {json.dumps(entry['worst_params'])}")
+        if entry["plan"]:
+            print(f"   plan: {json.dumps(entry['plan'])[:500]}")
+        if show_sql:
+            print(f"   sql: {entry['sql']}")
+
+
+def main():
+    """Parse the command line and run the chosen diagnostic"""
+    from diagnostics import SLOW_QUERY_LOG
+
+    parser = argparse.ArgumentParser(description="TCLD dashboard database diagnostics")
+    subcommands = parser.add_subparsers(dest="command")
+    subcommands.add_parser("check", help="connection and table report (default)")
+    slow = subcommands.add_parser("slow-queries", help="summarize the slow-query log")
+    slow.add_argument("--log", default=SLOW_QUERY_LOG, help="query log path")
+    slow.add_argument("--top", type=int, default=10, help="number of statements to show")
+    slow.add_argument("--sql", action="store_true", help="print each statement's SQL text")
+    args = parser.parse_args()
+
+    if args.command == "slow-queries":
+        run_slow_queries(args.log, args.top, args.sql)
+    else:
+        run_report()
+
+
+if __name__ == "__main__":
+    main()
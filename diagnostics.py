@@ -0,0 +1,236 @@
+"""
+Query Diagnostics Module for TCLD Dashboard
+Times every database.py query by phase (connect, execute, fetch, frame) and records
+the SQL text hash, parameters and row count
+
+Queries slower than SLOW_QUERY_MS are appended to the slow-query log (JSON lines);
+with QUERY_DIAGNOSTICS=True every query is logged. QUERY_PLAN_CAPTURE adds the estimated
+plan (showplan: SET SHOWPLAN_XML) or the Synapse request steps (steps: sys.dm_pdw_request_steps),
+once per distinct statement. Summarize the log with: python diagnose.py slow-queries
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+# Diagnostics configuration
+QUERY_DIAGNOSTICS = os.getenv("QUERY_DIAGNOSTICS", "False").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "2000"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.jsonl")
+SLOW_QUERY_LOG_MAX_MB = int(os.getenv("SLOW_QUERY_LOG_MAX_MB", "20"))
+QUERY_PLAN_CAPTURE = os.getenv("QUERY_PLAN_CAPTURE", "off").lower()  # off | showplan | steps
+QUERY_PLAN_DIR = os.getenv("QUERY_PLAN_DIR", "query_plans")
+
+# Most recent query records, kept in memory for inspection from a shell
+RECENT_QUERIES = deque(maxlen=int(os.getenv("RECENT_QUERIES", "200")))
+
+_local = threading.local()
+_plans_lock = threading.Lock()
+_planned = set()  # statement hashes whose plan has been captured by this process
+_query_log = None
+
+
+def sql_hash(sql):
+    """Stable short hash of a statement with whitespace normalized"""
+    normalized = re.sub(r"\s+", " ", sql).strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def _json_param(value):
+    """Parameters as JSON-safe values (dates and decimals as strings)"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _log():
+    """JSON-lines logger for query records, rotated by size"""
+    global _query_log
+    if _query_log is None:
+        query_log = logging.getLogger("tcld.query_log")
+        query_log.propagate = False
+        query_log.setLevel(logging.INFO)
+        if not query_log.handlers:
+            handler = RotatingFileHandler(
+                SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_MAX_MB * 1024 * 1024, backupCount=3, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            query_log.addHandler(handler)
+        _query_log = query_log
+    return _query_log
+
+
+def note_connect(elapsed_ms):
+    """Remember connection time on this thread; the next query record on it picks it up"""
+    _local.connect_ms = elapsed_ms
+
+
+class QueryTrace:
+    """Phase timings and outcome of one query"""
+
+    def __init__(self, name, sql, params=None):
+        self.name = name
+        self.sql = sql
+        self.params = [_json_param(p) for p in (params or [])]
+        self.hash = sql_hash(sql)
+        self.phases = {}
+        connect_ms = getattr(_local, "connect_ms", None)
+        if connect_ms is not None:
+            self.phases["connect"] = round(connect_ms, 1)
+            _local.connect_ms = None
+        self.plan = None
+        self.reused = None  # ran on an already prepared cursor (see statements.py)
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as one named phase (repeated phases accumulate)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.phases[name] = round(self.phases.get(name, 0) + elapsed, 1)
+
+    def finish(self, rows, error=None):
+        """Record the query; write it to the log if slow (or always in diagnostics mode)"""
+        elapsed = (time.perf_counter() - self.started) * 1000 + self.phases.get("connect", 0)
+        record = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "name": self.name,
+            "sql_hash": self.hash,
+            "elapsed_ms": round(elapsed, 1),
+            "phases": self.phases,
+            "rows": rows,
+            "params": self.params,
+            "slow": elapsed >= SLOW_QUERY_MS,
+        }
+        if error is not None:
+            record["error"] = str(error)[:500]
+        if self.plan:
+            record["plan"] = self.plan
+        if self.reused is not None:
+            record["reused"] = self.reused
+        RECENT_QUERIES.append(record)
+
+        if record["slow"] or QUERY_DIAGNOSTICS:
+            # Full text once per record keeps the log self-contained for diagnose.py
+            _log().info(json.dumps(dict(record, sql=re.sub(r"\s+", " ", self.sql).strip())))
+        if record["slow"]:
+            logger.warning(f"Slow query {self.name} [{self.hash}]: {elapsed:.0f} ms, {rows} rows, phases {self.phases}")
+        return record
+
+
+def capture_plan(conn, trace):
+    """Attach the estimated plan or request steps to trace, once per statement (best effort)"""
+    if QUERY_PLAN_CAPTURE not in ("showplan", "steps"):
+        return
+    with _plans_lock:
+        if trace.hash in _planned:
+            return
+        _planned.add(trace.hash)
+
+    try:
+        cursor = conn.cursor()
+        if QUERY_PLAN_CAPTURE == "showplan":
+            cursor.execute("SET SHOWPLAN_XML ON")
+            try:
+                cursor.execute(trace.sql, trace.params)
+                plan_xml = cursor.fetchone()[0]
+            finally:
+                cursor.execute("SET SHOWPLAN_XML OFF")
+            os.makedirs(QUERY_PLAN_DIR, exist_ok=True)
+            path = os.path.join(QUERY_PLAN_DIR, f"{trace.hash}.sqlplan")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(plan_xml)
+            trace.plan = {"showplan": path}
+        else:
+            # Synapse dedicated pools: distributed steps of this session's latest request
+            cursor.execute(
+                """
+                SELECT s.step_index, s.operation_type, s.location_type, s.total_elapsed_time, s.row_count
+                FROM sys.dm_pdw_request_steps s
+                WHERE s.request_id = (
+                    SELECT TOP 1 r.request_id FROM sys.dm_pdw_exec_requests r
+                    WHERE r.session_id = SESSION_ID() AND r.command NOT LIKE '%dm_pdw_request_steps%'
+                    ORDER BY r.submit_time DESC
+                )
+                ORDER BY s.step_index
+                """
+            )
+            trace.plan = {
+                "steps": [
+                    {"step": row[0], "operation": row[1], "location": row[2], "elapsed_ms": row[3], "rows": row[4]}
+                    for row in cursor.fetchall()
+                ]
+            }
+    except Exception as e:
+        logger.warning(f"Could not capture plan for {trace.name} [{trace.hash}]: {e}")
+
+
+def read_log(path=SLOW_QUERY_LOG):
+    """Query records from the log and its rotated backups, oldest first"""
+    records = []
+    for candidate in [f"{path}.{i}" for i in (3, 2, 1)] + [path]:
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(records, top=10):
+    """Worst statements by total time: count, p50/p95/max ms, mean rows, mean phase split"""
+    groups = {}
+    for record in records:
+        groups.setdefault(record["sql_hash"], []).append(record)
+
+    summary = []
+    for digest, group in groups.items():
+        elapsed = [r["elapsed_ms"] for r in group]
+        phases = {}
+        for r in group:
+            for phase, ms in r.get("phases", {}).items():
+                phases[phase] = phases.get(phase, 0) + ms
+        worst = max(group, key=lambda r: r["elapsed_ms"])
+        reuse = [r["reused"] for r in group if "reused" in r]
+        summary.append(
+            {
+                "sql_hash": digest,
+                "name": group[-1]["name"],
+                "count": len(group),
+                "errors": sum(1 for r in group if "error" in r),
+                "total_ms": round(sum(elapsed), 1),
+                "p50_ms": _percentile(elapsed, 0.5),
+                "p95_ms": _percentile(elapsed, 0.95),
+                "max_ms": worst["elapsed_ms"],
+                "mean_rows": round(sum(r.get("rows") or 0 for r in group) / len(group), 1),
+                "reuse_rate": round(sum(reuse) / len(reuse), 3) if reuse else None,
+                "phases": {phase: round(ms / len(group), 1) for phase, ms in phases.items()},
+                "worst_params": worst.get("params"),
+                "plan": next((r["plan"] for r in reversed(group) if r.get("plan")), None),
+                "sql": group[-1].get("sql", ""),
+            }
+        )
+    summary.sort(key=lambda s: s["total_ms"], reverse=True)
+    return summary[:top]
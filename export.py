@@ -0,0 +1,173 @@
+"""
+Data Export Module for TCLD Dashboard
+Streams the full filtered EA Ptag result as chunked CSV or Parquet
+
+GET /export/eaptag.csv?building_id=&area_id=&start_date=&end_date=&after=&after_ptag=&after_location=
+GET /export/eaptag.parquet?...   (requires pyarrow)
+
+Rows are ordered by timestamp, ptagId and LocationName. To resume, pass the last row
+received as after (timestamp), after_ptag and after_location; the export continues just
+past it. With after alone, all rows at that timestamp are sent again (drop the ones you have).
+start_date and end_date are snapped like the dashboard range (segments.normalize_range), so a
+date-only end_date includes that whole day.
+"""
+
+import csv
+import io
+import itertools
+import logging
+import os
+
+from flask import Blueprint, Response, request, stream_with_context
+
+from database import iter_eaptag_batches
+from segments import normalize_range
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the warehouse cursor per streamed chunk
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))
+
+# Export columns and their Parquet types; fixed so all-NULL batches still share one schema
+PARQUET_TYPES = {
+    "BuildingName": "string",
+    "LocationName": "string",
+    "ptagId": "string",
+    "timestamp": "timestamp[ms]",
+    "value": "float64",
+    "unit": "string",
+}
+
+export_bp = Blueprint("export", __name__)
+
+
+def _filters():
+    """Export filters from the query string (empty values mean no filter), with half-open date bounds"""
+    filters = {
+        name: request.args.get(name) or None
+        for name in ("building_id", "area_id", "start_date", "end_date", "after", "after_ptag", "after_location")
+    }
+    if filters["end_date"]:
+        filters["start_date"], filters["end_date"] = normalize_range(filters["start_date"], filters["end_date"])
+    elif filters["start_date"]:
+        # No end: export everything from start_date on, not just up to now
+        filters["start_date"], _ = normalize_range(filters["start_date"], None)
+    return filters
+
+
+def _iso(value):
+    """Format datetimes like the rest of the dashboard; pass other values through"""
+    return value.strftime("%Y-%m-%dT%H:%M:%S") if hasattr(value, "strftime") else value
+
+
+def _csv_chunks(batches):
+    """Encode each fetched batch as one CSV chunk"""
+    header_written = False
+    for columns, rows in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows([_iso(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+    if not header_written:
+        yield (",".join(PARQUET_TYPES) + "\r\n").encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the response generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(batches):
+    """Encode each fetched batch as one Parquet row group"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for columns, rows in batches:
+            arrays = {}
+            for i, column in enumerate(columns):
+                values = [row[i] for row in rows]
+                if column == "value":
+                    values = [None if v is None else float(v) for v in values]
+                arrays[column] = pa.array(values, type=PARQUET_TYPES.get(column))
+            table = pa.Table.from_pydict(arrays)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table)
+            yield sink.drain()
+        if writer is None:
+            # No rows: still produce a valid, empty Parquet file
+            schema = pa.schema([(name, pa.type_for_alias(alias)) for name, alias in PARQUET_TYPES.items()])
+            writer = pq.ParquetWriter(sink, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+@export_bp.route("/export/eaptag.<fmt>")
+def export_eaptag(fmt):
+    """Stream the filtered EA Ptag data without the dashboard's TOP limit"""
+    if fmt not in ("csv", "parquet"):
+        return Response("Unsupported export format; use csv or parquet", status=404)
+
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return Response("Parquet export requires the pyarrow package", status=501)
+
+    try:
+        filters = _filters()
+    except ValueError:
+        return Response("start_date and end_date must be ISO dates", status=400)
+    logger.info(f"Streaming EA Ptag {fmt} export with filters {filters}")
+    batches = iter_eaptag_batches(batch_size=EXPORT_BATCH_ROWS, **filters)
+    try:
+        # Run the query before sending headers, so failures still get a proper status
+        first = next(batches, None)
+    except Exception as e:
+        logger.error(f"Error starting EA Ptag export: {e}")
+        return Response("Export failed: database unavailable", status=503)
+    batches = itertools.chain([first] if first else [], batches)
+    chunks = _csv_chunks(batches) if fmt == "csv" else _parquet_chunks(batches)
+
+    suffix = f"_after_{filters['after']}" if filters["after"] else ""
+    filename = f"eaptag{suffix}.{fmt}".replace(":", "-")
+    mimetype = "text/csv" if fmt == "csv" else "application/vnd.apache.parquet"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
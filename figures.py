@@ -0,0 +1,284 @@
+"""
+Figure Builders for TCLD Dashboard
+Plotly graph_objects figures for the callback hot path, with layouts precomputed once
+"""
+
+import os
+
+import plotly.graph_objs as go
+
+import cache
+
+# Above this many points the consumption chart renders with WebGL (Scattergl) instead of SVG
+WEBGL_POINT_THRESHOLD = int(os.getenv("WEBGL_POINT_THRESHOLD", "10000"))
+
+# Name of the marker trace overlaying flagged readings (see anomaly.py)
+ANOMALY_TRACE = "Anomalies"
+ANOMALY_MARKER = {"color": "#d62728", "size": 9, "symbol": "x"}
+
+# Shading of data gaps (see coverage.py); opacity grows with the share of meters missing
+GAP_FILL = "#6c757d"
+GAP_MIN_OPACITY = 0.08
+GAP_MAX_OPACITY = 0.3
+
+# Baseline overlay (see baselines.py): expected reading as a dotted line over its normal range
+BASELINE_SUFFIX = " baseline"
+BAND_SUFFIX = " normal range"
+BASELINE_LINE = {"color": "#495057", "width": 1, "dash": "dot"}
+BAND_FILL = "rgba(108, 117, 125, 0.15)"
+
+# Minimal template: the default "plotly" template adds several KB to every figure
+LEAN_TEMPLATE = go.layout.Template(
+    layout=go.Layout(
+        colorway=[
+            "#636efa", "#EF553B", "#00cc96", "#ab63fa", "#FFA15A",
+            "#19d3f3", "#FF6692", "#B6E880", "#FF97FF", "#FECB52",
+        ],
+        font={"color": "#2a3f5f"},
+        paper_bgcolor="white",
+        xaxis={"gridcolor": "white", "zeroline": False},
+        yaxis={"gridcolor": "white", "zeroline": False},
+    )
+)
+
+CONSUMPTION_LAYOUT = go.Layout(
+    template=LEAN_TEMPLATE,
+    title="Energy Consumption Over Time",
+    xaxis={"title": "Date"},
+    yaxis={"title": "Consumption (kWh)"},
+    legend={"title": "BuildingName"},
+    hovermode="x unified",
+    plot_bgcolor="#f8f9fa",
+    height=400,
+)
+
+DISTRIBUTION_LAYOUT = go.Layout(
+    template=LEAN_TEMPLATE,
+    title="Consumption Distribution by Building",
+    xaxis={"title": "BuildingName"},
+    yaxis={"title": "Consumption (kWh)"},
+    plot_bgcolor="#f8f9fa",
+    height=400,
+    showlegend=False,
+)
+
+COMPARISON_LAYOUT = go.Layout(
+    template=LEAN_TEMPLATE,
+    title="Building Comparison",
+    xaxis={"title": "Date"},
+    legend={"title": "BuildingName"},
+    hovermode="x unified",
+    plot_bgcolor="#f8f9fa",
+    height=450,
+)
+
+COMPARISON_METRICS_LAYOUT = go.Layout(
+    template=LEAN_TEMPLATE,
+    title="Normalized Consumption by Building",
+    yaxis={"title": "Consumption (kWh per area)"},
+    plot_bgcolor="#f8f9fa",
+    height=400,
+    showlegend=False,
+)
+
+HEATMAP_LAYOUT = go.Layout(
+    template=LEAN_TEMPLATE,
+    title="Hourly Consumption Heatmap",
+    xaxis={"title": "Date"},
+    yaxis={"title": "Hour of day", "dtick": 3, "autorange": "reversed"},
+    plot_bgcolor="#f8f9fa",
+    height=400,
+)
+
+# Small multiples: panels per row
+COMPARISON_COLUMNS = 4
+
+
+def trace_type(point_count):
+    """Plotly trace type for a line chart with this many points"""
+    return "scattergl" if point_count > WEBGL_POINT_THRESHOLD else "scatter"
+
+
+def anomaly_trace(df):
+    """Marker trace for rows flagged in the boolean anomaly column"""
+    flagged = df[df["anomaly"].fillna(False).astype(bool)]
+    return go.Scatter(
+        x=flagged["timestamp"].to_numpy(),
+        y=flagged["value"].to_numpy(),
+        text=flagged["ptagId"].to_numpy(),
+        mode="markers",
+        name=ANOMALY_TRACE,
+        marker=ANOMALY_MARKER,
+        hovertemplate="%{text}: %{y}<extra>Anomaly</extra>",
+    )
+
+
+def gap_shapes(gaps):
+    """Background rectangles for [start, end, missing share] gap intervals"""
+    return [
+        {
+            "type": "rect",
+            "xref": "x",
+            "yref": "paper",
+            "x0": start,
+            "x1": end,
+            "y0": 0,
+            "y1": 1,
+            "fillcolor": GAP_FILL,
+            "opacity": round(GAP_MIN_OPACITY + (GAP_MAX_OPACITY - GAP_MIN_OPACITY) * share, 3),
+            "line": {"width": 0},
+            "layer": "below",
+        }
+        for start, end, share in gaps or []
+    ]
+
+
+def baseline_names(baseline):
+    """Names of the baseline traces, in figure order (band, then expected, per building)"""
+    return [f"{series['name']}{suffix}" for series in baseline or [] for suffix in (BAND_SUFFIX, BASELINE_SUFFIX)]
+
+
+def baseline_traces(baseline):
+    """Normal-range band and expected line per building from window_baseline series"""
+    traces = []
+    for series in baseline or []:
+        x, name = series["x"], series["name"]
+        traces.append(
+            go.Scatter(
+                x=x + x[::-1],
+                y=series["upper"] + series["lower"][::-1],
+                fill="toself",
+                fillcolor=BAND_FILL,
+                line={"width": 0},
+                hoverinfo="skip",
+                showlegend=False,
+                name=f"{name}{BAND_SUFFIX}",
+            )
+        )
+        traces.append(go.Scatter(x=x, y=series["expected"], mode="lines", line=BASELINE_LINE, name=f"{name}{BASELINE_SUFFIX}"))
+    return traces
+
+
+def consumption_figure(df, gaps=None, baseline=None):
+    """Line per building of value over timestamp (ISO strings), WebGL above the threshold,
+    with flagged readings overlaid as a final marker trace, data gaps shaded and
+    baselines (drawn first, underneath) when given"""
+    df = df.sort_values("timestamp", kind="stable")
+    trace_class = go.Scattergl if trace_type(len(df)) == "scattergl" else go.Scatter
+    traces = baseline_traces(baseline) + [
+        trace_class(
+            x=group["timestamp"].to_numpy(),
+            y=group["value"].to_numpy(),
+            mode="lines",
+            name=str(name),
+        )
+        for name, group in df.groupby("BuildingName", sort=False, observed=True)
+    ]
+    if "anomaly" in df.columns and df["anomaly"].fillna(False).astype(bool).any():
+        traces.append(anomaly_trace(df))
+    layout = go.Layout(CONSUMPTION_LAYOUT, shapes=gap_shapes(gaps)) if gaps else CONSUMPTION_LAYOUT
+    return {"data": traces, "layout": layout}
+
+
+def distribution_figure(df):
+    """Box of value per building"""
+    traces = [
+        go.Box(
+            x=group["BuildingName"].to_numpy(),
+            y=group["value"].to_numpy(),
+            name=str(name),
+        )
+        for name, group in df.groupby("BuildingName", sort=False, observed=True)
+    ]
+    return {"data": traces, "layout": DISTRIBUTION_LAYOUT}
+
+
+def comparison_figure(df, column, label, mode="overlay"):
+    """Series of `column` per building, overlaid on one axis or as small multiples"""
+    groups = list(df.groupby("BuildingName", sort=True, observed=True))
+    if mode != "multiples" or len(groups) < 2:
+        traces = [
+            go.Scatter(x=group["timestamp"].to_numpy(), y=group[column].to_numpy(), mode="lines", name=str(name))
+            for name, group in groups
+        ]
+        return {"data": traces, "layout": go.Layout(COMPARISON_LAYOUT, yaxis={"title": label})}
+
+    from plotly.subplots import make_subplots
+
+    rows = -(-len(groups) // COMPARISON_COLUMNS)
+    figure = make_subplots(
+        rows=rows,
+        cols=COMPARISON_COLUMNS,
+        shared_xaxes=True,
+        shared_yaxes=True,
+        subplot_titles=[str(name) for name, _ in groups],
+        vertical_spacing=0.3 / rows,
+    )
+    for i, (name, group) in enumerate(groups):
+        figure.add_trace(
+            go.Scatter(x=group["timestamp"].to_numpy(), y=group[column].to_numpy(), mode="lines", name=str(name)),
+            row=i // COMPARISON_COLUMNS + 1,
+            col=i % COMPARISON_COLUMNS + 1,
+        )
+    figure.update_layout(COMPARISON_LAYOUT, height=max(450, 220 * rows), showlegend=False)
+    figure.update_yaxes(title=None)
+    figure.update_yaxes(title=label, col=1)
+    return {"data": list(figure.data), "layout": figure.layout}
+
+
+def comparison_metrics_figure(summary):
+    """Bar of kWh per monitored area per building, with totals and peaks on hover"""
+    trace = go.Bar(
+        x=summary["BuildingName"].astype(str).to_numpy(),
+        y=summary["kwh_per_area"].to_numpy(),
+        customdata=summary[["total", "peak", "areaCount"]].to_numpy(),
+        hovertemplate=(
+            "%{x}<br>%{y:.2f} kWh per area<br>Total %{customdata[0]:.2f} kWh"
+            "<br>Peak %{customdata[1]:.2f}<br>%{customdata[2]} areas<extra></extra>"
+        ),
+    )
+    return {"data": [trace], "layout": COMPARISON_METRICS_LAYOUT}
+
+
+def heatmap_figure(days, matrix, title=None):
+    """Hour-of-day x day heatmap from a pre-binned days x 24 matrix (see rollups.day_hour_matrix)
+
+    The payload is len(days) * 24 cells regardless of how many readings were binned.
+    """
+    import numpy as np
+
+    z = np.round(matrix.T, 2)  # rows: hour of day, columns: day
+    trace = go.Heatmap(
+        x=days,
+        y=list(range(24)),
+        z=np.where(np.isnan(z), None, z).tolist(),
+        colorscale="YlOrRd",
+        colorbar={"title": "kWh"},
+        hovertemplate="%{x} %{y}:00<br>%{z:.2f} kWh<extra></extra>",
+        hoverongaps=False,
+    )
+    layout = HEATMAP_LAYOUT if title is None else go.Layout(HEATMAP_LAYOUT, title=title)
+    return {"data": [trace], "layout": layout}
+
+
+def memoized(chart, version, options, build):
+    """Return build()'s result for (data version, chart, options), building only on a miss
+
+    Figures are cached in JSON-ready form, so a hit does no DataFrame or figure work.
+    """
+    if version is None:
+        return build()
+    key = ("figure", (version, chart, options, WEBGL_POINT_THRESHOLD))
+    result = cache.get(key)
+    if result is None:
+        result = build()
+        cache.put(key, result)
+    return result
+
+
+def to_plain(figure):
+    """Convert a {"data": traces, "layout": layout} figure to plain JSON-ready dicts"""
+    return {
+        "data": [trace.to_plotly_json() for trace in figure["data"]],
+        "layout": figure["layout"].to_plotly_json(),
+    }
@@ -0,0 +1,95 @@
+"""
+Compact Frame Helpers for TCLD Dashboard
+Memory-lean DataFrame representation for cached and in-flight EA Ptag datasets
+"""
+
+import hashlib
+
+# numpy and pandas are imported inside the helpers so importing this module stays cheap
+
+# Repeated strings are dictionary-encoded instead of stored once per row
+CATEGORY_COLUMNS = ["BuildingID", "BuildingName", "LocationName", "ptagId", "unit", "areaCode", "areaName"]
+
+# float32 is used for readings only when it is exact to display precision (2 decimals)
+VALUE_TOLERANCE = 0.005
+
+
+def compact_frame(df):
+    """Convert a query result to categorical strings, float32 values and int64 epoch-ms timestamps"""
+    import pandas as pd
+
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    if "value" in df.columns:
+        values = pd.to_numeric(df["value"], errors="coerce").astype("float64")
+        narrowed = values.astype("float32")
+        error = (narrowed.astype("float64") - values).abs().max()
+        df["value"] = narrowed if not error > VALUE_TOLERANCE else values
+
+    if "timestamp" in df.columns:
+        df["timestamp"] = to_epoch_ms(df["timestamp"])
+
+    return df
+
+
+def to_epoch_ms(series):
+    """Convert a datetime-like series to int64 milliseconds since the epoch"""
+    import numpy as np
+    import pandas as pd
+
+    return pd.to_datetime(series).astype("datetime64[ms]").astype(np.int64)
+
+
+def iso_timestamps(series):
+    """Format int64 epoch-ms timestamps as sortable 'YYYY-MM-DDTHH:MM:SS' strings"""
+    import pandas as pd
+
+    return pd.to_datetime(series, unit="ms").dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def frame_version(df):
+    """Content hash of a frame, computed once and remembered on the (cached) frame itself"""
+    if df is None:
+        return "empty"
+    version = df.attrs.get("version")
+    if version is None:
+        import pandas as pd
+
+        hashed = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        version = hashlib.sha1(hashed.tobytes()).hexdigest()[:16]
+        df.attrs["version"] = version
+    return version
+
+
+def frame_nbytes(value):
+    """Approximate memory footprint of a cached value in bytes"""
+    if hasattr(value, "memory_usage"):  # DataFrame
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if hasattr(value, "nbytes"):  # numpy array
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(frame_nbytes(k) + frame_nbytes(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(frame_nbytes(item) for item in value) + 8 * len(value) + 56
+    if isinstance(value, str):
+        return 49 + len(value)
+    return 32
+
+
+def concat_frames(frames):
+    """Concatenate compact frames, keeping the categorical columns categorical
+
+    Categories differ between frames fetched separately, which pandas would otherwise widen to object.
+    """
+    import pandas as pd
+
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and df[column].dtype != "category":
+            df[column] = df[column].astype("category")
+    return df
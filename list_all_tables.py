@@ -1,25 +1,11 @@
-"""Find all available tables"""
-import pyodbc
-import os
-from dotenv import load_dotenv
+"""Find all available tables (reads the catalog snapshot written by schema_discovery.py)"""
+from catalog import load_snapshot
 
-load_dotenv()
+snapshot = load_snapshot()
+if snapshot is None:
+    raise SystemExit("No catalog snapshot yet; run: python schema_discovery.py")
 
-DB_SERVER = os.getenv("DB_SERVER")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CONNECTION_STRING = f"Driver={{ODBC Driver 17 for SQL Server}};Server={DB_SERVER};Database={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
-
-conn = pyodbc.connect(CONNECTION_STRING, timeout=30)
-cursor = conn.cursor()
-
-cursor.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE' ORDER BY TABLE_NAME")
-tables = cursor.fetchall()
-
-print("All tables in database:")
-for table in tables:
-    print(f"  {table[0]}")
-
-conn.close()
+print(f"All tables in database (snapshot {snapshot['version']}, {snapshot['taken_at']}):")
+for full_name, table in sorted(snapshot["tables"].items()):
+    if table.get("type", "BASE TABLE") == "BASE TABLE":
+        print(f"  {table['name']}")
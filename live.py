@@ -0,0 +1,158 @@
+"""
+Live Update Module for TCLD Dashboard
+One shared poller per process watches for new EA Ptag readings and buffers the deltas;
+sessions only compare timestamps, so N open dashboards cost one warehouse poll
+
+The cursor a session keeps is the newest reading timestamp it has, which means the same
+thing in every worker process (a per-process counter would not), so a session whose
+requests land on different gunicorn workers neither misses nor repeats readings.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from anomaly import flag_new_rows
+from coverage import observe as mark_coverage
+from database import get_eaptag_data_since, get_latest_reading_time
+
+logger = logging.getLogger(__name__)
+
+# Poller configuration
+LIVE_POLL_SECONDS = int(os.getenv("LIVE_POLL_SECONDS", "30"))
+LIVE_BUFFER_ROWS = int(os.getenv("LIVE_BUFFER_ROWS", "20000"))
+LIVE_IDLE_SECONDS = int(os.getenv("LIVE_IDLE_SECONDS", "300"))
+
+_lock = threading.Lock()
+_buffer = deque(maxlen=LIVE_BUFFER_ROWS)  # new readings, oldest first
+_state = {
+    "latest": None,  # newest timestamp seen by the poller (ISO string)
+    "buffer_start": None,  # readings after this timestamp are all in the buffer
+    "last_seen": 0.0,  # monotonic time of the last subscriber check-in
+}
+_poller_thread = None
+_anomaly_state = None  # per-meter tail and seasonal profile carried between polls
+
+
+def _iso(value):
+    """Format a timestamp the way the dashboard stores compare them"""
+    import pandas as pd
+
+    return pd.Timestamp(value).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def poll_once():
+    """Check the warehouse for new readings and buffer them; returns True when some were buffered"""
+    latest = get_latest_reading_time()
+    if latest is None:
+        return False
+    latest = _iso(latest)
+
+    with _lock:
+        previous = _state["latest"]
+    if previous is None:
+        # First poll only establishes the baseline; earlier data comes from the normal load
+        with _lock:
+            _state["latest"] = _state["buffer_start"] = latest
+        return False
+    if latest <= previous:
+        return False
+
+    rows = get_eaptag_data_since(previous, limit=LIVE_BUFFER_ROWS)
+    if not rows:
+        return False
+    for row in rows:
+        row["timestamp"] = _iso(row["timestamp"])
+    rows = _complete_timestamps(rows, LIVE_BUFFER_ROWS)
+    _flag_anomalies(rows)
+    mark_coverage(rows)
+
+    with _lock:
+        if len(_buffer) + len(rows) > LIVE_BUFFER_ROWS:
+            # Oldest rows are about to be dropped; coverage now starts after them
+            dropped = len(_buffer) + len(rows) - LIVE_BUFFER_ROWS
+            combined = list(_buffer) + rows
+            _state["buffer_start"] = combined[dropped - 1]["timestamp"]
+        _buffer.extend(rows)
+        # A TOP-limited delta may stop short of MAX(timestamp); the next poll continues from here
+        _state["latest"] = latest = rows[-1]["timestamp"]
+
+    logger.info(f"Live poller buffered {len(rows)} new readings (up to {latest})")
+    return True
+
+
+def _complete_timestamps(rows, limit):
+    """Drop the readings at the newest timestamp of a TOP-truncated delta (some may be cut off)
+
+    The cursor then stops at the last timestamp delivered in full, and the next poll fetches
+    the dropped timestamp again, whole. A delta of a single timestamp is kept as is.
+    """
+    if len(rows) < limit:
+        return rows
+    last = rows[-1]["timestamp"]
+    complete = [row for row in rows if row["timestamp"] != last]
+    if not complete:
+        logger.warning(f"More than {limit} readings at {last}; raise LIVE_BUFFER_ROWS to receive them all")
+        return rows
+    return complete
+
+
+def _flag_anomalies(rows):
+    """Set row["anomaly"], scoring only the new readings against the carried state"""
+    global _anomaly_state
+    import pandas as pd
+
+    try:
+        frame = pd.DataFrame(rows, columns=["ptagId", "timestamp", "value"])
+        flags, _anomaly_state = flag_new_rows(frame, _anomaly_state)
+        for row, flag in zip(rows, flags):
+            row["anomaly"] = bool(flag)
+    except Exception as e:
+        logger.error(f"Anomaly scoring of live readings failed: {e}")
+
+
+def _poll_loop():
+    """Poll until no session has checked in for LIVE_IDLE_SECONDS"""
+    global _poller_thread
+    while True:
+        with _lock:
+            idle = time.monotonic() - _state["last_seen"]
+            if idle > LIVE_IDLE_SECONDS:
+                _poller_thread = None
+                logger.info("Live poller stopped (no subscribers)")
+                return
+        try:
+            poll_once()
+        except Exception as e:
+            logger.error(f"Live poll failed: {e}")
+        time.sleep(LIVE_POLL_SECONDS)
+
+
+def subscribe():
+    """Register a session check-in, start the shared poller if needed; returns latest_timestamp()"""
+    global _poller_thread
+    with _lock:
+        _state["last_seen"] = time.monotonic()
+        if _poller_thread is None:
+            _poller_thread = threading.Thread(target=_poll_loop, name="live-poller", daemon=True)
+            _poller_thread.start()
+            logger.info(f"Live poller started (every {LIVE_POLL_SECONDS}s)")
+        return _state["latest"]
+
+
+def readings_since(since):
+    """Return (rows newer than since, synced_to), or (None, None) when the buffer does not cover since"""
+    with _lock:
+        buffer_start = _state["buffer_start"]
+        if buffer_start is None or since is None or since < buffer_start:
+            return None, None
+        rows = [row for row in _buffer if row["timestamp"] > since]
+        return rows, _state["latest"]
+
+
+def latest_timestamp():
+    """Newest timestamp known to the poller"""
+    with _lock:
+        return _state["latest"]
@@ -0,0 +1,197 @@
+"""
+Offload Module for TCLD Dashboard
+Runs CPU-bound analytics stages (anomaly scoring) on a small, bounded process pool, so a
+heavy view does not hold the GIL while light requests wait
+
+Frames and arrays cross the process boundary through shared memory blocks: numeric
+columns are copied once into the block and read in place by the worker, categorical
+columns travel as integer codes (only the category labels are pickled). Results come
+back the same way. Inputs under OFFLOAD_MIN_ROWS run inline, where the transfer would
+cost more than it saves; OFFLOAD_WORKERS=0 disables the pool.
+
+The default threshold is measured: a round trip costs about 2 ms, while scoring costs
+about 18 ms at 1,000 rows and 28 ms at 5,000 (the eaptag-store cap), so offloading pays
+from about 2,000 rows. Heatmap binning (days x 24 hourly sums, under 1 ms) and figure
+building (3-9 ms on a full store, memoized per data version) stay inline: the round trip
+would cost as much as the work.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from anomaly import ANOMALY_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+# One core is left to the web process: on a single core the round trip is pure overhead
+OFFLOAD_WORKERS = int(os.getenv("OFFLOAD_WORKERS", str(min(2, (os.cpu_count() or 1) - 1))))
+OFFLOAD_MIN_ROWS = int(os.getenv("OFFLOAD_MIN_ROWS", "2000"))
+OFFLOAD_TIMEOUT_SECONDS = int(os.getenv("OFFLOAD_TIMEOUT_SECONDS", "60"))
+# Tasks waiting or running at once; further heavy requests wait for a slot
+OFFLOAD_MAX_PENDING = int(os.getenv("OFFLOAD_MAX_PENDING", str(2 * max(1, OFFLOAD_WORKERS))))
+
+ALIGNMENT = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, OFFLOAD_MAX_PENDING))
+
+# numpy, pandas and multiprocessing are imported inside the helpers so importing this module stays cheap
+
+
+def share_arrays(arrays, categories=None):
+    """Copy named numpy arrays into one shared memory block; returns (block, descriptor)
+
+    The descriptor is small and picklable: block name, per-array dtype, shape and offset,
+    plus categories (labels of categorical columns stored as codes).
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    layout, offset = [], 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, shape, start), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)[...] = array
+    return block, {"block": block.name, "layout": layout, "categories": categories or {}}
+
+
+def attach_arrays(descriptor):
+    """Views onto a shared block's arrays (no copy); returns (block, {name: array})"""
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(name=descriptor["block"])
+    arrays = {
+        name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+        for name, dtype, shape, start in descriptor["layout"]
+    }
+    return block, arrays
+
+
+def share_frame(df, columns):
+    """Share DataFrame columns: categoricals and strings as codes, everything else as is"""
+    arrays, categories = {}, {}
+    for column in columns:
+        series = df[column]
+        if series.dtype == "category" or series.dtype == object:
+            values = series if series.dtype == "category" else series.astype("category")
+            arrays[column] = values.cat.codes.to_numpy()
+            categories[column] = values.cat.categories.tolist()
+        else:
+            arrays[column] = series.to_numpy()
+    return share_arrays(arrays, categories)
+
+
+def frame_from(arrays, categories):
+    """DataFrame over shared arrays, rebuilding categorical columns from their codes"""
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            name: pd.Categorical.from_codes(array, categories[name]) if name in categories else array
+            for name, array in arrays.items()
+        },
+        copy=False,
+    )
+
+
+def _execute(task, descriptor, args):
+    """Worker side: attach the input, run task(frame, *args), share the resulting arrays"""
+    block, arrays = attach_arrays(descriptor)
+    try:
+        result = task(frame_from(arrays, descriptor["categories"]), *args)
+        del arrays
+    finally:
+        block.close()
+    output, result_descriptor = share_arrays(result)
+    output.close()  # the parent unlinks it once read
+    return result_descriptor
+
+
+def _collect(descriptor):
+    """Parent side: copy a worker's result arrays out of shared memory and free the block"""
+    import numpy as np
+
+    block, arrays = attach_arrays(descriptor)
+    try:
+        return {name: np.array(array) for name, array in arrays.items()}
+    finally:
+        del arrays
+        block.close()
+        block.unlink()
+
+
+def _executor():
+    """The process pool, started on first use (spawned workers, safe alongside threads)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            _pool = ProcessPoolExecutor(
+                max_workers=OFFLOAD_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Offload pool started with {OFFLOAD_WORKERS} workers")
+        return _pool
+
+
+def shutdown():
+    """Stop the pool's workers"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+def run(task, df, columns, *args, min_rows=None):
+    """Run task(df[columns], *args) -> {name: array} in the pool, or inline for small inputs
+
+    task must be a module-level function. Falls back to running inline if the pool fails.
+    """
+    min_rows = OFFLOAD_MIN_ROWS if min_rows is None else min_rows
+    if OFFLOAD_WORKERS <= 0 or len(df) < min_rows:
+        return task(df[columns], *args)
+
+    from concurrent.futures.process import BrokenProcessPool
+
+    with _slots:
+        block, descriptor = share_frame(df, columns)
+        try:
+            future = _executor().submit(_execute, task, descriptor, args)
+            return _collect(future.result(timeout=OFFLOAD_TIMEOUT_SECONDS))
+        except BrokenProcessPool as e:
+            logger.warning(f"Offload pool broke ({e}); restarting it and running {task.__name__} inline")
+            shutdown()
+        except Exception as e:
+            logger.warning(f"Offloaded {task.__name__} failed ({e}); running it inline")
+        finally:
+            block.close()
+            block.unlink()
+    return task(df[columns], *args)
+
+
+# Offloadable stages: module-level so workers can unpickle them by name
+
+
+def anomaly_task(df, threshold):
+    """Anomaly flags for the rows of df"""
+    from anomaly import flag_rows as score_rows
+
+    return {"flags": score_rows(df, threshold=threshold)}
+
+
+def flag_rows(df, threshold=ANOMALY_THRESHOLD):
+    """anomaly.flag_rows, offloaded for large frames"""
+    return run(anomaly_task, df, ["ptagId", "timestamp", "value"], threshold)["flags"]
@@ -0,0 +1,164 @@
+"""
+Pre-warming Scheduler for TCLD Dashboard
+Precomputes the default view and the most requested queries on a cron schedule,
+so the first interactive load of the day hits a warm cache
+
+Runs as a daemon thread inside the app process (PREWARM_ENABLED=True).
+Standalone (python prewarm.py [--once]) it only warms the warehouse-side result cache,
+since the in-process cache is per worker
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import cache
+from areas import refresh_index
+import baselines
+import coverage
+from database import STORE_ROW_LIMIT, default_date_range  # importing database registers the cached queries
+from segments import normalize_range  # importing segments registers the window caches
+
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "False") == "True"
+PREWARM_CRON = os.getenv("PREWARM_CRON", "*/10 * * * *")
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "10"))
+
+# Functions whose most requested calls are recomputed on every run
+POPULAR_QUERIES = ["eaptag_window", "metrics_window", "comparison_window"]
+
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+
+
+def _cron_field_matches(field, value, low, high):
+    """Check one cron field (*, */n, a-b, a-b/n, a,b,c) against a value"""
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = end = int(part)
+        if start <= value <= end and (value - start) % step == 0:
+            return True
+    return False
+
+
+def cron_matches(expression, moment):
+    """Return True when a 5-field cron expression (min hour dom month dow) matches moment
+
+    As in cron, when both day of month and day of week are restricted (neither starts
+    with *), a day matching either one matches; otherwise both must match.
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Invalid cron expression: {expression!r}")
+    minute, hour, day, month, weekday = fields
+    weekday_value = moment.isoweekday() % 7
+    day_matches = _cron_field_matches(day, moment.day, 1, 31)
+    # Sunday is 0 or 7
+    weekday_matches = _cron_field_matches(weekday, weekday_value, 0, 7) or (
+        weekday_value == 0 and _cron_field_matches(weekday, 7, 0, 7)
+    )
+    if day.startswith("*") or weekday.startswith("*"):
+        days_match = day_matches and weekday_matches
+    else:
+        days_match = day_matches or weekday_matches
+    return (
+        _cron_field_matches(minute, moment.minute, 0, 59)
+        and _cron_field_matches(hour, moment.hour, 0, 23)
+        and days_match
+        and _cron_field_matches(month, moment.month, 1, 12)
+    )
+
+
+def warm_default_view():
+    """Precompute the queries behind the default (no filter, default range) dashboard"""
+    start_date, end_date = normalize_range(*default_date_range())
+    cache.warm(cache.key_for("get_buildings"))
+    refresh_index()  # no-op until the area index is due for its (incremental) refresh
+    coverage.refresh_index()  # likewise for the meter coverage index
+    baselines.refit()  # no-op until another day is complete
+    # Refreshes the open tail; closed segments are only fetched on first use
+    cache.warm(cache.key_for("metrics_window", start_date, end_date))
+    cache.warm(cache.key_for("eaptag_window", None, None, start_date, end_date, STORE_ROW_LIMIT))
+
+
+def warm_popular(top_n=PREWARM_TOP_N):
+    """Recompute the most requested calls recorded in the access statistics"""
+    warmed = 0
+    for name in POPULAR_QUERIES:
+        for key, count in cache.top_accessed(top_n, name=name):
+            logger.debug(f"Pre-warming {name} ({count} hits)")
+            cache.warm(key)
+            warmed += 1
+    return warmed
+
+
+def run_prewarm():
+    """Run one full pre-warming pass"""
+    started = time.perf_counter()
+    try:
+        warm_default_view()
+        warmed = warm_popular()
+        elapsed = time.perf_counter() - started
+        footprint = cache.stats()
+        logger.info(
+            f"Pre-warm complete: default view + {warmed} popular queries in {elapsed:.1f}s "
+            f"(cache: {footprint['entries']} entries, {footprint['bytes'] / 1048576:.1f} MB)"
+        )
+    except Exception as e:
+        logger.error(f"Pre-warm failed: {e}")
+
+
+def _scheduler_loop(expression):
+    """Run the pre-warm pass once per matching minute"""
+    last_run = None
+    while True:
+        now = datetime.now().replace(second=0, microsecond=0)
+        if now != last_run and cron_matches(expression, now):
+            last_run = now
+            run_prewarm()
+        time.sleep(20)
+
+
+def _scheduler_loop_after_warm(expression):
+    """Warm immediately (e.g. on a worker's first request), then follow the cron schedule"""
+    run_prewarm()
+    _scheduler_loop(expression)
+
+
+def start_scheduler(expression=PREWARM_CRON, run_now=False):
+    """Start the background scheduler thread once per process"""
+    global _scheduler_thread
+    cron_matches(expression, datetime.now())  # validate before starting
+    with _scheduler_lock:
+        if _scheduler_thread is not None:
+            return _scheduler_thread
+        _scheduler_thread = threading.Thread(
+            target=_scheduler_loop_after_warm if run_now else _scheduler_loop,
+            args=(expression,),
+            name="prewarm-scheduler",
+            daemon=True,
+        )
+        _scheduler_thread.start()
+    logger.info(f"Pre-warm scheduler started with cron '{expression}'")
+    return _scheduler_thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_prewarm()
+    if "--once" not in sys.argv:
+        _scheduler_loop(PREWARM_CRON)
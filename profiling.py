@@ -0,0 +1,346 @@
+"""
+Profiling Module for TCLD Dashboard
+On-demand profiling of Dash callbacks in a running worker, driven by admin endpoints
+(no restart, no debug mode)
+
+POST /admin/profile/start?callbacks=20&seconds=60&mode=cprofile|sample&memory=1
+GET  /admin/profile/status
+POST /admin/profile/stop
+GET  /admin/profile/download      -> profile_<stamp>.zip
+
+Requests need ADMIN_TOKEN as "Authorization: Bearer <token>" (or X-Admin-Token); without
+ADMIN_TOKEN the endpoints do not exist. A session covers the next N callbacks or T seconds,
+whichever comes first, on the worker that received the start request. cprofile mode writes
+one .pstats file (plus a text summary) per callback; sample mode writes folded stacks per
+callback for flame graph tools. memory=1 adds a tracemalloc snapshot diff of the session.
+
+cprofile mode profiles one callback at a time: on Python 3.12+ cProfile sits on
+sys.monitoring, which allows a single active profiler per process (a second enable() raises
+ValueError) and records every thread, so a .pstats file also holds whatever other threads
+ran meanwhile. Callbacks arriving while one is profiled run unprofiled (counted as skipped);
+use sample mode for concurrent callbacks.
+"""
+
+import hmac
+import io
+import json
+import logging
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Profiling configuration
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_MAX_CALLBACKS = int(os.getenv("PROFILE_MAX_CALLBACKS", "200"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "600"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_TOP_ALLOCATIONS = 50
+PROFILE_TRACE_FRAMES = 10  # tracemalloc traceback depth; deeper is slower
+
+CALLBACK_PATH = "/_dash-update-component"
+
+profiling_bp = Blueprint("profiling", __name__)
+
+_lock = threading.Lock()
+_session = None  # the active profiling session, if any
+_last_profile = None  # (filename, zip bytes) of the last finished session
+_cprofile_lock = threading.Lock()  # held while a callback is under cProfile
+
+
+def _callback_name():
+    """Name of the callback a Dash update request runs (its output ids)"""
+    body = request.get_json(silent=True) or {}
+    output = body.get("output") or "unknown"
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", output.strip(".")).strip("_")[:80] or "unknown"
+
+
+class ProfileSession:
+    """One profiling run: per-callback cProfile stats or folded stack samples, plus memory"""
+
+    def __init__(self, mode, callbacks, seconds, memory):
+        self.mode = mode
+        self.max_callbacks = callbacks
+        self.deadline = time.monotonic() + seconds
+        self.started_at = datetime.now()
+        self.memory = memory
+        self.callbacks = 0
+        self.skipped = 0  # cprofile callbacks that ran while another one was profiled
+        self.timings = {}  # callback -> [elapsed ms, ...]
+        self.stats = {}  # callback -> pstats.Stats (cprofile)
+        self.folded = {}  # callback -> {stack: samples} (sample)
+        self.active = {}  # thread id -> callback name (sample)
+        self.finished = False
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        self._baseline = None
+        self._sampler = None
+
+        if memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACE_FRAMES)
+                self._started_tracemalloc = True
+            self._baseline = tracemalloc.take_snapshot()
+        if mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def expired(self):
+        """True once the callback budget or the time budget is used up"""
+        return self.callbacks >= self.max_callbacks or time.monotonic() >= self.deadline
+
+    def begin(self, name):
+        """Start profiling the callback running on this thread; returns a token for end()
+
+        None when the session is over, or in cprofile mode when another callback (or another
+        profiler) holds the process's profiler; that callback then runs unprofiled.
+        """
+        with self._lock:
+            if self.finished or self.expired():
+                return None
+        profile = None
+        if self.mode == "cprofile":
+            import cProfile
+
+            if not _cprofile_lock.acquire(blocking=False):
+                with self._lock:
+                    self.skipped += 1
+                return None
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+            except ValueError as e:
+                # "Another profiling tool is already active" (Python 3.12+)
+                _cprofile_lock.release()
+                logger.warning(f"Callback {name} not profiled: {e}")
+                with self._lock:
+                    self.skipped += 1
+                return None
+        else:
+            self.active[threading.get_ident()] = name
+        with self._lock:
+            self.callbacks += 1
+        return (name, profile, time.perf_counter())
+
+    def end(self, token):
+        """Stop profiling a callback and fold its data into the session"""
+        name, profile, started = token
+        elapsed = (time.perf_counter() - started) * 1000
+        if profile is not None:
+            import pstats
+
+            profile.disable()
+            _cprofile_lock.release()
+        else:
+            self.active.pop(threading.get_ident(), None)
+        with self._lock:
+            self.timings.setdefault(name, []).append(round(elapsed, 1))
+            if profile is not None:
+                if name in self.stats:
+                    self.stats[name].add(profile)
+                else:
+                    self.stats[name] = pstats.Stats(profile)
+
+    def _sample_loop(self):
+        """Record the stack of every thread running a profiled callback, every interval"""
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        while not self.finished and time.monotonic() < self.deadline:
+            frames = sys._current_frames()
+            for thread_id, name in list(self.active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    folded = ";".join([name] + stack[::-1])
+                    with self._lock:
+                        samples = self.folded.setdefault(name, {})
+                        samples[folded] = samples.get(folded, 0) + 1
+            time.sleep(interval)
+
+    def finish(self):
+        """Stop sampling and memory tracing; returns (filename, zip bytes)"""
+        self.finished = True
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+
+        memory_report = None
+        if self.memory:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            differences = snapshot.compare_to(self._baseline, "lineno")[:PROFILE_TOP_ALLOCATIONS]
+            memory_report = "\n".join(
+                [f"traced current: {current / 1048576:.1f} MB, peak: {peak / 1048576:.1f} MB", ""]
+                + [str(difference) for difference in differences]
+            )
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        return self._archive(memory_report)
+
+    def _archive(self, memory_report):
+        """Zip the session: summary.json, per-callback profiles, memory.txt"""
+        stamp = self.started_at.strftime("%Y%m%dT%H%M%S")
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("summary.json", json.dumps(self.summary(), indent=1))
+            for name, stats in self.stats.items():
+                # Same format as Stats.dump_stats: load with pstats.Stats(path) or snakeviz
+                archive.writestr(f"cprofile/{name}.pstats", marshal.dumps(stats.stats))
+                text = io.StringIO()
+                stats.stream = text
+                stats.sort_stats("cumulative").print_stats(40)
+                archive.writestr(f"cprofile/{name}.txt", text.getvalue())
+            for name, samples in self.folded.items():
+                # Folded stacks: flamegraph.pl, speedscope or inferno read these directly
+                lines = [f"{stack} {count}" for stack, count in sorted(samples.items())]
+                archive.writestr(f"flame/{name}.folded", "\n".join(lines) + "\n")
+            if memory_report is not None:
+                archive.writestr("memory.txt", memory_report)
+        return f"profile_{stamp}.zip", buffer.getvalue()
+
+    def summary(self):
+        """Session settings and per-callback call counts and timings"""
+        return {
+            "mode": self.mode,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "callbacks_profiled": self.callbacks,
+            "callbacks_skipped": self.skipped,
+            "max_callbacks": self.max_callbacks,
+            "seconds_left": max(0, round(self.deadline - time.monotonic())),
+            "memory": self.memory,
+            "finished": self.finished,
+            "callbacks": {
+                name: {"calls": len(times), "total_ms": round(sum(times), 1), "max_ms": max(times)}
+                for name, times in self.timings.items()
+            },
+        }
+
+
+def _finish_session():
+    """End the active session and keep its archive for download"""
+    global _session, _last_profile
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        _last_profile = session.finish()
+        logger.info(f"Profiling session finished: {session.callbacks} callbacks, {_last_profile[0]}")
+    return session
+
+
+@profiling_bp.before_app_request
+def _begin_callback_profile():
+    """Profile Dash callback requests while a session is active"""
+    session = _session
+    if session is None or request.path != CALLBACK_PATH:
+        return
+    if session.expired():
+        _finish_session()
+        return
+    g.profile_token = session.begin(_callback_name())
+    g.profile_session = session
+
+
+@profiling_bp.teardown_app_request
+def _end_callback_profile(error=None):
+    """Fold the finished callback into the session; close the session once its budget is spent"""
+    token = g.pop("profile_token", None)
+    session = g.pop("profile_session", None)
+    if token is None or session is None:
+        return
+    session.end(token)
+    if session is _session and session.expired():
+        _finish_session()
+
+
+def _authorized():
+    """Constant-time check of the admin token (bearer or X-Admin-Token header)"""
+    supplied = request.headers.get("X-Admin-Token", "")
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        supplied = header[len("Bearer "):]
+    return bool(supplied) and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+@profiling_bp.before_request
+def _require_admin():
+    """Hide the endpoints without ADMIN_TOKEN; reject requests without the right token"""
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not _authorized():
+        abort(401)
+
+
+@profiling_bp.route("/admin/profile/start", methods=["POST"])
+def start_profile():
+    """Start a session for the next N callbacks or T seconds"""
+    global _session
+    mode = request.args.get("mode", "cprofile")
+    if mode not in ("cprofile", "sample"):
+        return jsonify({"error": "mode must be cprofile or sample"}), 400
+    try:
+        callbacks = min(int(request.args.get("callbacks", "20")), PROFILE_MAX_CALLBACKS)
+        seconds = min(float(request.args.get("seconds", "60")), PROFILE_MAX_SECONDS)
+    except ValueError:
+        return jsonify({"error": "callbacks and seconds must be numbers"}), 400
+    memory = request.args.get("memory", "0").lower() in ("1", "true", "yes")
+
+    with _lock:
+        if _session is not None and not _session.expired():
+            return jsonify({"error": "a profiling session is already running", **_session.summary()}), 409
+    if _session is not None:
+        _finish_session()
+    with _lock:
+        _session = ProfileSession(mode, callbacks, seconds, memory)
+        summary = _session.summary()
+    logger.info(f"Profiling session started: {mode}, {callbacks} callbacks / {seconds:.0f}s, memory={memory}")
+    return jsonify(summary)
+
+
+@profiling_bp.route("/admin/profile/status")
+def profile_status():
+    """The active session's progress, or the last archive's name"""
+    session = _session
+    if session is not None and session.expired():
+        _finish_session()
+        session = None
+    if session is not None:
+        return jsonify({"active": True, **session.summary()})
+    return jsonify({"active": False, "last_profile": _last_profile[0] if _last_profile else None})
+
+
+@profiling_bp.route("/admin/profile/stop", methods=["POST"])
+def stop_profile():
+    """End the active session early"""
+    session = _finish_session()
+    if session is None:
+        return jsonify({"error": "no profiling session is running"}), 404
+    return jsonify({"active": False, **session.summary(), "last_profile": _last_profile[0]})
+
+
+@profiling_bp.route("/admin/profile/download")
+def download_profile():
+    """The last finished session as a zip archive"""
+    if _session is not None and _session.expired():
+        _finish_session()
+    if _last_profile is None:
+        return jsonify({"error": "no finished profiling session yet"}), 404
+    filename, data = _last_profile
+    return Response(
+        data,
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
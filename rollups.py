@@ -0,0 +1,64 @@
+"""
+Rollup Helpers for TCLD Dashboard
+Vectorized time bucketing of epoch-ms readings into dense, fixed-size arrays
+(e.g. a day x hour-of-day matrix), so chart payloads depend on the range, not the raw volume
+"""
+
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 24 * MS_PER_HOUR
+
+# SQL Server's DATEDIFF(hour, 0, x) counts hours from 1900-01-01, this many before the Unix epoch
+SQL_EPOCH_HOURS = 613608
+
+# numpy is imported inside the helpers so importing this module stays cheap
+
+
+def hour_buckets(timestamps_ms):
+    """Epoch hour (start of the hour) for each epoch-ms timestamp"""
+    import numpy as np
+
+    return np.asarray(timestamps_ms, dtype=np.int64) // MS_PER_HOUR
+
+
+def day_range(start_ms, end_ms):
+    """Epoch days covering [start_ms, end_ms], inclusive"""
+    import numpy as np
+
+    return np.arange(int(start_ms) // MS_PER_DAY, int(end_ms) // MS_PER_DAY + 1, dtype=np.int64)
+
+
+def day_hour_matrix(timestamps_ms, values, start_ms=None, end_ms=None, how="sum"):
+    """Bin readings into a days x 24 matrix; returns (epoch days, matrix)
+
+    Cells without readings are NaN. how is "sum" or "mean". The day axis spans start_ms..end_ms
+    (defaulting to the data's own range), so the result is always len(days) x 24 cells.
+    """
+    import numpy as np
+
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if start_ms is None or end_ms is None:
+        if len(timestamps_ms) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 24))
+        start_ms = timestamps_ms.min() if start_ms is None else start_ms
+        end_ms = timestamps_ms.max() if end_ms is None else end_ms
+
+    days = day_range(start_ms, end_ms)
+    hours = hour_buckets(timestamps_ms)
+    cell = hours - (days[0] * 24 if len(days) else 0)
+    valid = (cell >= 0) & (cell < len(days) * 24) & np.isfinite(values)
+
+    size = len(days) * 24
+    totals = np.bincount(cell[valid], weights=values[valid], minlength=size)
+    counts = np.bincount(cell[valid], minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matrix = totals / counts if how == "mean" else totals
+    matrix[counts == 0] = np.nan
+    return days, matrix.reshape(len(days), 24)
+
+
+def day_labels(days):
+    """ISO dates ('YYYY-MM-DD') for epoch days"""
+    import numpy as np
+
+    return np.datetime_as_string(np.asarray(days, dtype="datetime64[D]"), unit="D").tolist()
@@ -1,120 +1,236 @@
 """
-Schema Discovery Script - Identifies actual table and column names in Azure Synapse
+Schema Discovery Script - Snapshots the Azure Synapse catalog (tables, columns, sample rows)
+
+Pulls all column metadata in one set-based INFORMATION_SCHEMA query, samples tables
+concurrently over a small connection pool, and writes a versioned snapshot (JSON, plus
+Parquet when pyarrow is installed) to SCHEMA_SNAPSHOT_DIR. Renames and column changes are
+reported by diffing against the previous snapshot; the app and scripts read the snapshot
+through catalog.py instead of re-querying.
+
+Usage:
+    python schema_discovery.py                  # snapshot + diff against the previous one
+    python schema_discovery.py --sample-all --workers 8
+    python schema_discovery.py --diff OLD.json NEW.json
 """
 
-import pyodbc
+import argparse
+import json
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from dotenv import load_dotenv
 
+from catalog import (
+    LATEST_SNAPSHOT,
+    SCHEMA_SNAPSHOT_DIR,
+    catalog_version,
+    diff_snapshots,
+    load_snapshot,
+)
+
 load_dotenv()
 
-# Database configuration
-DB_SERVER = os.getenv("DB_SERVER", "dev-saw-tcld-01.sql.azuresynapse.net")
-DB_NAME = os.getenv("DB_NAME", "tcld_syn_db_dev")
-DB_USER = os.getenv("DB_USER", "readonlyappuser")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "sqHbKRVQmk7TYDyEXtfWG6")
-
-CONNECTION_STRING = (
-    f"Driver={{ODBC Driver 17 for SQL Server}};"
-    f"Server={DB_SERVER};"
-    f"Database={DB_NAME};"
-    f"UID={DB_USER};"
-    f"PWD={DB_PASSWORD};"
-    f"Encrypt=yes;"
-    f"TrustServerCertificate=no;"
-    f"Connection Timeout=30;"
-)
+# Sampling configuration
+SCHEMA_SAMPLE_WORKERS = int(os.getenv("SCHEMA_SAMPLE_WORKERS", "4"))
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "3"))
 
-try:
-    print("Connecting to database...")
-    conn = pyodbc.connect(CONNECTION_STRING, timeout=30)
+# Tables sampled by default (all tables with --sample-all)
+RELEVANT_KEYWORDS = ["building", "area", "ptag", "energy", "metric", "tag", "fact", "dimension", "dim", "iaq"]
+
+CATALOG_QUERY = """
+    SELECT
+        t.TABLE_SCHEMA,
+        t.TABLE_NAME,
+        t.TABLE_TYPE,
+        c.COLUMN_NAME,
+        c.DATA_TYPE,
+        c.IS_NULLABLE
+    FROM INFORMATION_SCHEMA.TABLES t
+    JOIN INFORMATION_SCHEMA.COLUMNS c
+        ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+    ORDER BY t.TABLE_SCHEMA, t.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+
+def connect():
+    """Open a connection with the dashboard's credentials"""
+    import pyodbc
+
+    from database import get_connection_string
+
+    return pyodbc.connect(get_connection_string(), timeout=30)
+
+
+def fetch_catalog(conn):
+    """All tables and their columns from one set-based query, keyed "schema.table" """
     cursor = conn.cursor()
-    
-    # Get all tables
-    print("\n" + "="*80)
-    print("AVAILABLE TABLES:")
-    print("="*80)
-    cursor.execute("""
-        SELECT TABLE_NAME 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_TYPE='BASE TABLE'
-        ORDER BY TABLE_NAME
-    """)
-    tables = cursor.fetchall()
-    for table in tables:
-        print(f"  - {table[0]}")
-    
-    # For each table that looks relevant, show columns
-    relevant_keywords = ['building', 'area', 'ptag', 'energy', 'metric', 'tag', 'fact', 'dimension']
-    
-    for table_row in tables:
-        table_name = table_row[0]
-        # Check if table name contains relevant keywords
-        table_lower = table_name.lower()
-        
-        if any(keyword in table_lower for keyword in relevant_keywords):
-            print(f"\n{'-'*80}")
-            print(f"TABLE: {table_name}")
-            print(f"{'-'*80}")
-            
-            # Get columns for this table
-            cursor.execute(f"""
-                SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = '{table_name}'
-                ORDER BY ORDINAL_POSITION
-            """)
-            
-            columns = cursor.fetchall()
-            for col in columns:
-                nullable = "NULL" if col[2] == 'YES' else "NOT NULL"
-                print(f"  {col[0]:30} {col[1]:20} {nullable}")
-    
-    # Also try to peek at data from likely tables
-    print(f"\n{'='*80}")
-    print("SAMPLE DATA EXPLORATION:")
-    print(f"{'='*80}")
-    
-    # Try to find building-related tables
-    cursor.execute("""
-        SELECT TABLE_NAME 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_NAME LIKE '%[Bb]uilding%'
-           OR TABLE_NAME LIKE '%[Dd]im%'
-           OR TABLE_NAME LIKE '%[Ff]act%'
-    """)
-    
-    sample_tables = cursor.fetchall()
-    
-    for table_row in sample_tables:
-        table_name = table_row[0]
-        print(f"\nTable: {table_name}")
+    cursor.execute(CATALOG_QUERY)
+    tables = {}
+    for schema, table, table_type, column, data_type, nullable in cursor.fetchall():
+        entry = tables.setdefault(
+            f"{schema}.{table}", {"schema": schema, "name": table, "type": table_type, "columns": []}
+        )
+        entry["columns"].append({"name": column, "type": data_type, "nullable": nullable == "YES"})
+    return tables
+
+
+def _json_value(value):
+    """Sample values as JSON-safe values"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def sample_tables(tables, names, rows=SCHEMA_SAMPLE_ROWS, workers=SCHEMA_SAMPLE_WORKERS):
+    """Sample TOP rows of the named tables concurrently, one connection per worker thread"""
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def sample(name):
+        if not hasattr(local, "conn"):
+            local.conn = connect()
+            with lock:
+                connections.append(local.conn)
+        table = tables[name]
         try:
-            cursor.execute(f"SELECT TOP 3 * FROM [{table_name}]")
-            rows = cursor.fetchall()
-            
-            # Get column names
-            cursor.execute(f"""
-                SELECT COLUMN_NAME 
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = '{table_name}'
-                ORDER BY ORDINAL_POSITION
-            """)
-            col_names = [col[0] for col in cursor.fetchall()]
-            
-            print("  Columns:", ", ".join(col_names))
-            print(f"  Sample rows ({len(rows)}): ")
-            for row in rows:
-                print(f"    {row}")
+            cursor = local.conn.cursor()
+            cursor.execute(f"SELECT TOP {int(rows)} * FROM [{table['schema']}].[{table['name']}]")
+            return name, [[_json_value(value) for value in row] for row in cursor.fetchall()], None
         except Exception as e:
-            print(f"  Error reading table: {e}")
-    
-    conn.close()
-    print("\n" + "="*80)
-    print("Schema discovery complete!")
-    print("="*80)
-
-except Exception as e:
-    print(f"Error: {e}")
-    import traceback
-    traceback.print_exc()
+            return name, None, str(e)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(sample, names))
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def write_snapshot(snapshot, directory=SCHEMA_SNAPSHOT_DIR, parquet=True):
+    """Write the versioned snapshot and refresh catalog_latest.json; returns the JSON path"""
+    os.makedirs(directory, exist_ok=True)
+    stamp = snapshot["taken_at"].replace(":", "").replace("-", "")
+    base = f"catalog_{stamp}_{snapshot['version']}"
+    path = os.path.join(directory, f"{base}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=1, default=str)
+    shutil.copyfile(path, os.path.join(directory, LATEST_SNAPSHOT))
+
+    if parquet:
+        try:
+            import pandas as pd
+
+            columns = pd.DataFrame(
+                [
+                    {"table": name, "ordinal": i + 1, **column}
+                    for name, table in snapshot["tables"].items()
+                    for i, column in enumerate(table["columns"])
+                ]
+            )
+            columns.to_parquet(os.path.join(directory, f"{base}.parquet"), index=False)
+        except ImportError:
+            pass
+    return path
+
+
+def print_diff(diff):
+    """Human-readable snapshot diff"""
+    if not any(diff.values()):
+        print("No catalog changes since the previous snapshot")
+        return
+    for old_name, new_name in diff["renamed"].items():
+        print(f"  RENAMED  {old_name} -> {new_name}")
+    for name in diff["added"]:
+        print(f"  ADDED    {name}")
+    for name in diff["removed"]:
+        print(f"  REMOVED  {name}")
+    for name, change in diff["changed"].items():
+        print(f"  CHANGED  {name}")
+        for column in change["added_columns"]:
+            print(f"    + {column}")
+        for column in change["removed_columns"]:
+            print(f"    - {column}")
+
+
+def take_snapshot(sample_all=False, rows=SCHEMA_SAMPLE_ROWS, workers=SCHEMA_SAMPLE_WORKERS, parquet=True):
+    """Snapshot the catalog, diff it against the previous snapshot and write it"""
+    previous = load_snapshot()
+    started = time.perf_counter()
+
+    print("Connecting to database...")
+    conn = connect()
+    try:
+        tables = fetch_catalog(conn)
+    finally:
+        conn.close()
+    print(f"Catalog: {len(tables)} tables in {time.perf_counter() - started:.1f}s")
+
+    names = [
+        name for name in tables
+        if sample_all or any(keyword in tables[name]["name"].lower() for keyword in RELEVANT_KEYWORDS)
+    ]
+    if rows > 0 and names:
+        sampled_at = time.perf_counter()
+        for name, sample, error in sample_tables(tables, names, rows, workers):
+            if error:
+                tables[name]["sample_error"] = error
+            else:
+                tables[name]["sample"] = sample
+        print(f"Sampled {len(names)} tables with {workers} workers in {time.perf_counter() - sampled_at:.1f}s")
+
+    snapshot = {
+        "taken_at": datetime.now().isoformat(timespec="seconds"),
+        "version": catalog_version(tables),
+        "tables": tables,
+    }
+    diff = diff_snapshots(previous, snapshot) if previous else None
+    # Renames accumulate across snapshots so catalog.resolve_table can follow a chain
+    snapshot["renames"] = dict((previous or {}).get("renames", {}), **(diff or {}).get("renamed", {}))
+
+    path = write_snapshot(snapshot, parquet=parquet)
+    print(f"Snapshot {snapshot['version']} written to {path}")
+    if diff is not None:
+        print(f"\nChanges since {previous['taken_at']} ({previous['version']}):")
+        print_diff(diff)
+    return snapshot
+
+
+def main():
+    """Parse the command line and take (or diff) snapshots"""
+    parser = argparse.ArgumentParser(description="Snapshot and diff the warehouse catalog")
+    parser.add_argument("--sample-all", action="store_true", help="sample every table, not only relevant ones")
+    parser.add_argument("--sample-rows", type=int, default=SCHEMA_SAMPLE_ROWS, help="rows per sample (0 = none)")
+    parser.add_argument("--workers", type=int, default=SCHEMA_SAMPLE_WORKERS, help="concurrent sampling connections")
+    parser.add_argument("--no-parquet", action="store_true", help="write the JSON snapshot only")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="diff two snapshot files and exit")
+    args = parser.parse_args()
+
+    if args.diff:
+        snapshots = []
+        for path in args.diff:
+            try:
+                snapshot = load_snapshot(path)
+            except ValueError as e:
+                parser.error(f"{path} is not a snapshot file: {e}")
+            if snapshot is None:
+                parser.error(f"snapshot not found: {path}")
+            snapshots.append(snapshot)
+        print_diff(diff_snapshots(*snapshots))
+        return
+
+    try:
+        take_snapshot(args.sample_all, args.sample_rows, args.workers, not args.no_parquet)
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
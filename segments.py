@@ -0,0 +1,356 @@
+"""
+Range Segments Module for TCLD Dashboard
+Normalizes date ranges to bucket boundaries and composes query results from cached,
+bucket-aligned segments, so different sessions asking for overlapping ranges share work
+
+A normalized range is half-open [start, end): start is floored to the hour and end is
+snapped outward (to the next hour, or to the following midnight for a date-only end).
+It is split into closed historical segments of SEGMENT_HOURS (aligned to midnight), which
+are immutable and cached for SEGMENT_TTL_SECONDS, plus one open tail from the settle horizon
+(now - SEGMENT_SETTLE_MINUTES, floored to a segment boundary) to the end, cached briefly.
+Consecutive uncached segments are fetched with one query and cached individually.
+"""
+
+import logging
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import cache
+from cache import cached
+from database import (
+    get_building_comparison,
+    get_dashboard_metrics,
+    get_eaptag_data,
+    get_iaq_series,
+    get_metrics_by_segment,
+)
+from frames import concat_frames
+
+logger = logging.getLogger(__name__)
+
+# Segment configuration
+SEGMENT_HOURS = int(os.getenv("SEGMENT_HOURS", "24"))
+if SEGMENT_HOURS <= 0 or 24 % SEGMENT_HOURS:
+    # Segments restart at each midnight, so only divisors of 24 tile days evenly
+    raise ValueError(f"SEGMENT_HOURS must divide 24, got {SEGMENT_HOURS}")
+SEGMENT_SETTLE_MINUTES = int(os.getenv("SEGMENT_SETTLE_MINUTES", "120"))
+SEGMENT_TTL_SECONDS = int(os.getenv("SEGMENT_TTL_SECONDS", "86400"))
+TAIL_TTL_SECONDS = int(os.getenv("TAIL_TTL_SECONDS", "60"))
+
+HOUR = timedelta(hours=1)
+
+
+def _parse(value):
+    """A datetime from an ISO string or datetime (timezone dropped); None stays None"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime.fromisoformat(str(value)).replace(tzinfo=None)
+
+
+def floor_hour(moment):
+    """Start of the hour containing moment"""
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_segment(moment, segment_hours=SEGMENT_HOURS):
+    """Start of the segment containing moment (segments are aligned to midnight)"""
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    hours = int((moment - midnight) / HOUR) // segment_hours * segment_hours
+    return midnight + timedelta(hours=hours)
+
+
+def normalize_range(start_date, end_date, now=None):
+    """Snap a picker range outward to hour boundaries; returns half-open (start, end) ISO strings
+
+    A missing end means now; a missing start stays None (unbounded). A date-only end
+    ("2024-05-31") covers that whole day. Normalizing a normalized range is a no-op.
+    """
+    end = _parse(end_date) or (now or datetime.now())
+    if isinstance(end_date, str) and len(end_date) == 10:
+        end += timedelta(days=1)
+    elif end != floor_hour(end):
+        end = floor_hour(end) + HOUR
+
+    start = _parse(start_date)
+    if start is not None:
+        start = floor_hour(start)
+    return (start.isoformat() if start else None), end.isoformat()
+
+
+def split_range(start, end, now=None, segment_hours=SEGMENT_HOURS):
+    """Split a normalized range into [(start, end, closed)], oldest first
+
+    Closed segments end at or before the settle horizon; the rest is one open tail.
+    """
+    start, end = _parse(start), _parse(end)
+    horizon = floor_segment((now or datetime.now()) - timedelta(minutes=SEGMENT_SETTLE_MINUTES), segment_hours)
+    segments = []
+    cursor = start
+    while cursor < min(end, horizon):
+        boundary = min(floor_segment(cursor, segment_hours) + timedelta(hours=segment_hours), end)
+        segments.append((cursor, boundary, True))
+        cursor = boundary
+    if cursor < end:
+        segments.append((cursor, end, False))
+    return segments
+
+
+def segment_key(kind, segment, *arguments):
+    """Cache key of one segment's result"""
+    start, end, _ = segment
+    return (f"segment:{kind}", (arguments, start.isoformat(), end.isoformat()))
+
+
+def _ttl(segment):
+    """Closed segments are immutable; the open tail is refreshed often"""
+    return SEGMENT_TTL_SECONDS if segment[2] else TAIL_TTL_SECONDS
+
+
+def _epoch_ms(moment):
+    """Naive datetime as epoch milliseconds (the convention of frames.to_epoch_ms)"""
+    return int((moment - datetime(1970, 1, 1)) / timedelta(milliseconds=1))
+
+
+def _missing_runs(kind, segments, *arguments):
+    """Split segments into cached values and runs of consecutive uncached segments
+
+    Returns (cached {index: value}, runs [[index, ...]]), indexes into segments.
+    """
+    hits, runs = {}, []
+    for index, segment in enumerate(segments):
+        value = cache.get(segment_key(kind, segment, *arguments))
+        if value is not None:
+            hits[index] = value
+        elif runs and runs[-1][-1] == index - 1:
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    return hits, runs
+
+
+def _segment_of(labels_ms, segments):
+    """Index of the segment each bucket label (epoch ms) falls in
+
+    Bucket labels are aligned to the bucket, so a label can precede its segment's start
+    when the first segment is partial; each label goes to the last segment whose
+    segment boundary is at or before it.
+    """
+    import numpy as np
+
+    floors = [_epoch_ms(floor_segment(start)) for start, _, _ in segments]
+    indexes = [max(0, bisect_right(floors, label) - 1) for label in np.asarray(labels_ms, dtype=np.int64)]
+    return np.asarray(indexes, dtype=np.int64)
+
+
+def get_eaptag_window(building_id=None, area_id=None, start_date=None, end_date=None, limit=100):
+    """Latest limit readings in a range, composed from cached segments (see get_eaptag_data)"""
+    start, end = normalize_range(start_date, end_date)
+    if start is None:
+        return get_eaptag_data(building_id, area_id, None, end, limit, end_exclusive=True)
+    return _eaptag_window(building_id, area_id, start, end, limit)
+
+
+@cached("eaptag_window", ttl=TAIL_TTL_SECONDS)
+def _eaptag_window(building_id, area_id, start, end, limit):
+    """Compose the newest limit readings, walking segments newest first
+
+    Each run of uncached segments is one TOP limit query; a segment is cached only when the
+    run result holds all of its readings (it is newer than the oldest row of a full result).
+    A run without readings caches its segments empty; only a failed run fails the whole
+    window (None), so a partial window is never cached.
+    """
+    segments = split_range(start, end)[::-1]
+    arguments = (building_id, area_id, limit)
+    hits, runs = _missing_runs("eaptag", segments, *arguments)
+
+    pieces, count, index = [], 0, 0
+    while index < len(segments) and count < limit:
+        if index in hits:
+            pieces.append(hits[index])
+            count += len(hits[index])
+            index += 1
+            continue
+
+        run = next(run for run in runs if run[0] == index)
+        newest, oldest = segments[run[0]], segments[run[-1]]
+        data = get_eaptag_data.__wrapped__(
+            building_id, area_id, oldest[0].isoformat(), newest[1].isoformat(), limit,
+            end_exclusive=True, allow_empty=True,
+        )
+        if data is None:
+            return None
+        timestamps = data["timestamp"].to_numpy()
+        complete_after = timestamps.min() if len(data) >= limit else None
+        for position in run:
+            segment = segments[position]
+            if complete_after is not None and _epoch_ms(segment[0]) <= complete_after:
+                break
+            inside = (timestamps >= _epoch_ms(segment[0])) & (timestamps < _epoch_ms(segment[1]))
+            cache.put(segment_key("eaptag", segment, *arguments), data[inside], _ttl(segment))
+        pieces.append(data)
+        count += len(data)
+        index = run[-1] + 1
+
+    data = concat_frames(pieces)
+    if data is None or data.empty:
+        return None
+    return data.sort_values("timestamp", ascending=False, kind="stable").head(limit).reset_index(drop=True)
+
+
+def get_metrics_window(start_date=None, end_date=None):
+    """Dashboard metrics for a range, combined from cached per-segment aggregates"""
+    start, end = normalize_range(start_date, end_date)
+    if start is None:
+        return get_dashboard_metrics(None, None, end)
+    return _metrics_window(start, end)
+
+
+def _empty_metrics():
+    """Aggregates of a segment without readings"""
+    return {
+        "totalEnergyConsumption": 0.0,
+        "valueCount": 0,
+        "peakConsumption": None,
+        "lowestConsumption": None,
+        "recordCount": 0,
+        "startDate": None,
+        "endDate": None,
+    }
+
+
+def _combine_metrics(parts):
+    """Fold segment aggregates into one (sums add, extremes take the min/max)"""
+    combined = _empty_metrics()
+    for part in parts:
+        if not part["recordCount"]:
+            continue
+        combined["totalEnergyConsumption"] += part["totalEnergyConsumption"] or 0
+        combined["valueCount"] += part["valueCount"] or 0
+        combined["recordCount"] += part["recordCount"]
+        for name, pick in (("peakConsumption", max), ("lowestConsumption", min), ("endDate", max), ("startDate", min)):
+            values = [v for v in (combined[name], part[name]) if v is not None]
+            combined[name] = pick(values) if values else None
+    return combined
+
+
+@cached("metrics_window", ttl=TAIL_TTL_SECONDS)
+def _metrics_window(start, end):
+    """Combine per-segment metrics; each run of uncached segments is one grouped query"""
+    segments = split_range(start, end)
+    hits, runs = _missing_runs("metrics", segments)
+    parts = dict(hits)
+
+    for run in runs:
+        first, last = segments[run[0]], segments[run[-1]]
+        data = get_metrics_by_segment(
+            first[0].isoformat(), last[1].isoformat(), SEGMENT_HOURS, floor_segment(first[0]).isoformat()
+        )
+        if data is None:
+            return None
+        found = {position: [] for position in run}
+        if not data.empty:
+            import pandas as pd
+
+            labels = pd.to_datetime(data["segment"]).astype("datetime64[ms]").astype("int64")
+            rows = data.astype(object).where(data.notna(), None).to_dict("records")
+            for position, row in zip(_segment_of(labels, segments), rows):
+                found.setdefault(int(position), []).append(row)
+        for position in run:
+            parts[position] = _combine_metrics(found[position])
+            cache.put(segment_key("metrics", segments[position]), parts[position], _ttl(segments[position]))
+
+    metrics = _combine_metrics(parts.values())
+    if not metrics["recordCount"]:
+        return None
+    metrics["averageConsumption"] = (
+        metrics["totalEnergyConsumption"] / metrics["valueCount"] if metrics["valueCount"] else 0
+    )
+    metrics["peakConsumption"] = metrics["peakConsumption"] or 0
+    metrics["lowestConsumption"] = metrics["lowestConsumption"] or 0
+    return metrics
+
+
+def get_comparison_window(building_ids, start_date=None, end_date=None, bucket="day"):
+    """Per-building bucketed consumption for a range, composed from cached segments"""
+    start, end = normalize_range(start_date, end_date)
+    if start is None:
+        return get_building_comparison(building_ids, None, end, bucket, end_exclusive=True)
+    return _comparison_window(tuple(building_ids or ()), start, end, bucket)
+
+
+@cached("comparison_window", ttl=TAIL_TTL_SECONDS)
+def _comparison_window(building_ids, start, end, bucket):
+    """Concatenate per-segment bucket rows, re-aggregating buckets that span segments"""
+    segments = split_range(start, end)
+    arguments = (building_ids, bucket)
+    hits, runs = _missing_runs("comparison", segments, *arguments)
+    pieces = list(hits.values())
+
+    for run in runs:
+        first, last = segments[run[0]], segments[run[-1]]
+        data = get_building_comparison.__wrapped__(
+            building_ids, first[0].isoformat(), last[1].isoformat(), bucket,
+            end_exclusive=True, allow_empty=True,
+        )
+        if data is None:
+            return None
+        owners = _segment_of(data["timestamp"], segments)
+        for position in run:
+            segment = segments[position]
+            cache.put(segment_key("comparison", segment, *arguments), data[owners == position], _ttl(segment))
+        pieces.append(data)
+
+    data = concat_frames(pieces)
+    if data is None or data.empty:
+        return None
+    keys = ["BuildingID", "BuildingName", "timestamp"]
+    if data.duplicated(keys).any():
+        data = data.groupby(keys, observed=True, as_index=False).agg(
+            total=("total", "sum"), peak=("peak", "max"), readings=("readings", "sum"), areaCount=("areaCount", "max")
+        )
+    return data.sort_values(["BuildingName", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def get_iaq_window(building_id, start_date=None, end_date=None, bucket="hour"):
+    """IAQ measurements per area and bucket for a building over a range, composed from cached segments"""
+    start, end = normalize_range(start_date, end_date)
+    if start is None:
+        return get_iaq_series(building_id, None, end, bucket)
+    return _iaq_window(building_id, start, end, bucket)
+
+
+@cached("iaq_window", ttl=TAIL_TTL_SECONDS)
+def _iaq_window(building_id, start, end, bucket):
+    """Concatenate per-segment IAQ rows; buckets that span segments are re-averaged by samples"""
+    segments = split_range(start, end)
+    arguments = (building_id, bucket)
+    hits, runs = _missing_runs("iaq", segments, *arguments)
+    pieces = list(hits.values())
+
+    for run in runs:
+        first, last = segments[run[0]], segments[run[-1]]
+        data = get_iaq_series.__wrapped__(
+            building_id, first[0].isoformat(), last[1].isoformat(), bucket, allow_empty=True
+        )
+        if data is None:
+            return None
+        owners = _segment_of(data["timestamp"], segments)
+        for position in run:
+            segment = segments[position]
+            cache.put(segment_key("iaq", segment, *arguments), data[owners == position], _ttl(segment))
+        pieces.append(data)
+
+    data = concat_frames(pieces)
+    if data is None or data.empty:
+        return None
+    keys = ["areaCode", "areaName", "timestamp"]
+    if data.duplicated(keys).any():
+        metrics = [column for column in data.columns if column not in keys + ["samples"]]
+        weighted = data[metrics].mul(data["samples"], axis=0).assign(samples=data["samples"])
+        grouped = weighted.groupby([data[key] for key in keys], observed=True).sum(min_count=1)
+        grouped[metrics] = grouped[metrics].div(grouped["samples"], axis=0)
+        data = grouped.reset_index()
+    return data.sort_values(["areaCode", "timestamp"], kind="stable").reset_index(drop=True)
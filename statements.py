@@ -0,0 +1,262 @@
+"""
+Canonical Statements Module for TCLD Dashboard
+Builds a fixed set of fully parameterized SQL statements and keeps them prepared
+on pooled connections, so the warehouse sees the same statement text every time
+
+Optional filters select one of a few canonical variants instead of concatenating
+ad-hoc SQL, TOP is a parameter, and IN lists are padded to a few canonical sizes.
+Each pooled connection keeps one cursor per statement text: pyodbc re-prepares a
+statement only when a cursor executes different text, so repeat executions skip the
+prepare round trip. statement_stats() reports executions and prepared-cursor hits.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from catalog import resolve_table
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_IDLE_SECONDS = int(os.getenv("DB_POOL_IDLE_SECONDS", "300"))
+PREPARED_PER_CONNECTION = int(os.getenv("PREPARED_PER_CONNECTION", "32"))
+
+# IN lists are padded (repeating the last value) to the next of these sizes
+IN_LIST_SIZES = (1, 2, 4, 8, 16, 32)
+
+_stats_lock = threading.Lock()
+_executions = Counter()  # statement name -> executions
+_reuses = Counter()  # statement name -> executions on an already prepared cursor
+
+
+class Statement:
+    """A canonical statement: base SQL, optional filter clauses in a fixed order, and a suffix
+
+    sql and suffix may use {table} placeholders (resolved through catalog.resolve_table) and
+    {in_list}, the placeholder list for an IN filter. Each filter clause has one ? per value;
+    a clause with several ? takes a tuple of that many values.
+    """
+
+    def __init__(self, name, sql, filters=(), suffix="", tables=None):
+        self.name = name
+        self.sql = sql
+        self.filters = tuple(filters)
+        self.suffix = suffix
+        self.tables = dict(tables or {})
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def text(self, present=(), in_size=0):
+        """Statement text for the given filter keys and IN list size, built once per variant
+
+        The same str object is returned for a variant, so cursor re-execution is cheap.
+        """
+        variant = (tuple(present), in_size)
+        text = self._texts.get(variant)
+        if text is None:
+            names = {key: resolve_table(table) for key, table in self.tables.items()}
+            names["in_list"] = ", ".join("?" for _ in range(in_size))
+            clauses = "".join(f" AND {clause}" for key, clause in self.filters if key in present)
+            text = (self.sql + clauses + self.suffix).format(**names)
+            with self._lock:
+                text = self._texts.setdefault(variant, text)
+        return text
+
+    def bind(self, params=(), in_values=None, **filters):
+        """(text, params) for a call: params fill the base SQL, then filters with a value, in order
+
+        in_values (padded with in_list) are inserted wherever {in_list} appears, before the
+        filter values for the base SQL and again after them if the suffix repeats it.
+        """
+        present = tuple(key for key, _ in self.filters if filters.get(key) is not None)
+        values = list(params)
+        in_values = in_list(in_values) if in_values is not None else []
+        if "{in_list}" in self.sql:
+            values.extend(in_values)
+        for key in present:
+            value = filters[key]
+            values.extend(value) if isinstance(value, tuple) else values.append(value)
+        if "{in_list}" in self.suffix:
+            values.extend(in_values)
+        return self.text(present, len(in_values)), values
+
+    def variants(self):
+        """Number of distinct texts built so far"""
+        return len(self._texts)
+
+    def variant_of(self, text):
+        """(present filter keys, IN list size) of a text this statement built, or None"""
+        for variant, built in list(self._texts.items()):
+            if built is text or built == text:
+                return variant
+        return None
+
+    def unbind(self, text, values):
+        """Inverse of bind: (params, in_values, filters) for a text built here, or None
+
+        Used by the synthetic warehouse (synthetic.py) to answer statements without parsing SQL.
+        """
+        variant = self.variant_of(text)
+        if variant is None:
+            return None
+        present, in_size = variant
+        values = list(values)
+        widths = [clause.count("?") for key, clause in self.filters if key in present]
+        in_sql = in_size if "{in_list}" in self.sql else 0
+        in_suffix = in_size if "{in_list}" in self.suffix else 0
+        base = len(values) - in_sql - sum(widths) - in_suffix
+        in_values = values[base:base + in_sql] or values[len(values) - in_suffix:] if in_size else []
+        filters, position = {}, base + in_sql
+        for key, width in zip(present, widths):
+            value = values[position:position + width]
+            filters[key] = value[0] if width == 1 else tuple(value)
+            position += width
+        return values[:base], in_values, filters
+
+
+def in_list(values, sizes=IN_LIST_SIZES):
+    """Pad values to the next canonical size by repeating the last one (IN semantics unchanged)"""
+    values = list(values)
+    size = next((size for size in sizes if size >= len(values)), len(values))
+    return values + values[-1:] * (size - len(values))
+
+
+def _record(name, reused):
+    """Count an execution and whether it reused a prepared cursor"""
+    with _stats_lock:
+        _executions[name] += 1
+        if reused:
+            _reuses[name] += 1
+
+
+def statement_stats():
+    """Executions, prepared-cursor hits and hit rate per statement name"""
+    with _stats_lock:
+        return {
+            name: {
+                "executions": count,
+                "reused": _reuses[name],
+                "hit_rate": round(_reuses[name] / count, 3) if count else 0.0,
+            }
+            for name, count in _executions.items()
+        }
+
+
+class PooledConnection:
+    """An open connection plus one prepared cursor per statement text (least recently used first)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursors = OrderedDict()
+        self.released_at = time.monotonic()
+
+    def cursor(self):
+        """A fresh, unprepared cursor (plan capture, ad-hoc statements)"""
+        return self.conn.cursor()
+
+    def prepared(self, sql, name="query"):
+        """(cursor, reused): the cursor that last executed sql on this connection, or a new one"""
+        cursor = self.cursors.get(sql)
+        reused = cursor is not None
+        if reused:
+            self.cursors.move_to_end(sql)
+        else:
+            cursor = self.conn.cursor()
+            self.cursors[sql] = cursor
+            while len(self.cursors) > PREPARED_PER_CONNECTION:
+                _, oldest = self.cursors.popitem(last=False)
+                oldest.close()
+        _record(name, reused)
+        return cursor, reused
+
+    def close(self):
+        """Close the cursors and the connection"""
+        self.cursors.clear()
+        try:
+            self.conn.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled connection: {e}")
+
+
+def prepared_cursor(conn, sql, name="query"):
+    """(cursor, reused) for sql on a pooled connection; plain connections get a new cursor"""
+    if isinstance(conn, PooledConnection):
+        return conn.prepared(sql, name)
+    _record(name, False)
+    return conn.cursor(), False
+
+
+class ConnectionPool:
+    """Up to size idle connections kept open between queries; connections idle longer are closed
+
+    With a gate (see admission.py), each checkout first waits for an admission slot.
+    """
+
+    def __init__(self, connect, size=DB_POOL_SIZE, idle_seconds=DB_POOL_IDLE_SECONDS, gate=None):
+        self.connect = connect
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.gate = gate
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        """Most recently released live connection, or a new one (None if connecting fails)"""
+        now = time.monotonic()
+        expired = []
+        pooled = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.released_at > self.idle_seconds:
+                    expired.append(candidate)
+                else:
+                    pooled = candidate
+                    break
+        for candidate in expired:
+            candidate.close()
+        if pooled is None:
+            conn = self.connect()
+            pooled = PooledConnection(conn) if conn else None
+        return pooled
+
+    def _release(self, pooled):
+        """Return a healthy connection to the pool, closing it if the pool is full"""
+        pooled.released_at = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(pooled)
+                return
+        pooled.close()
+
+    @contextmanager
+    def connection(self, gate=None):
+        """Check out a connection for a with block (None if connecting fails or it was not admitted)
+
+        gate overrides the pool's gate (long streams use their own). A connection whose block
+        raised (or was abandoned mid-stream) is closed, not reused.
+        """
+        gate = gate or self.gate
+        with gate.slot() if gate is not None else nullcontext(True) as admitted:
+            pooled = self._checkout() if admitted else None
+            try:
+                yield pooled
+            except BaseException:
+                if pooled is not None:
+                    pooled.close()
+                raise
+            else:
+                if pooled is not None:
+                    self._release(pooled)
+
+    def clear(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
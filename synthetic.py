@@ -0,0 +1,517 @@
+"""
+Synthetic Warehouse Module for TCLD Dashboard
+Deterministic in-memory stand-in for the Synapse warehouse, for benchmarks and local runs
+without database access
+
+Generates buildings, IAQ areas, 15-minute EA Ptag readings (a daily and weekly load shape
+plus seeded noise) and hourly IAQ measurements per area ending at the current hour, and answers the canonical statements of
+database.py through a DB-API style connection (cursor, execute, fetchall, fetchmany).
+Statements are recognized by their canonical text (Statement.unbind), not by parsing SQL, so
+a new statement needs a handler here. Joins behave like the warehouse's: reading queries
+repeat each reading once per IAQ area of its building. With SYNTHETIC_GAPS, some readings
+are missing (a dead meter, an ingestion outage, a building offline for a day), so coverage
+and gap handling have something to find. Fixed per-execute and per-row delays stand in for
+network and warehouse time.
+
+    import database, synthetic
+    database.pool.connect = synthetic.SyntheticWarehouse().connect
+"""
+
+import itertools
+import logging
+import os
+import time
+from datetime import datetime
+
+from rollups import SQL_EPOCH_HOURS
+from statements import Statement
+
+logger = logging.getLogger(__name__)
+
+# Synthetic data configuration
+SYNTHETIC_BUILDINGS = int(os.getenv("SYNTHETIC_BUILDINGS", "12"))
+SYNTHETIC_METERS = int(os.getenv("SYNTHETIC_METERS", "4"))  # per building
+SYNTHETIC_DAYS = int(os.getenv("SYNTHETIC_DAYS", "400"))
+SYNTHETIC_INTERVAL_MINUTES = int(os.getenv("SYNTHETIC_INTERVAL_MINUTES", "15"))
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", "7"))
+SYNTHETIC_GAPS = os.getenv("SYNTHETIC_GAPS", "True") == "True"
+
+# Simulated warehouse cost: per executed statement and per fetched row
+SYNTHETIC_EXECUTE_MS = float(os.getenv("SYNTHETIC_EXECUTE_MS", "2"))
+SYNTHETIC_ROW_US = float(os.getenv("SYNTHETIC_ROW_US", "1"))
+
+EPOCH = datetime(1970, 1, 1)
+
+READING_COLUMNS = ["BuildingName", "LocationName", "ptagId", "timestamp", "value", "unit"]
+
+# Hourly IAQ measurements: (unoccupied level, occupied rise, noise) per known column;
+# other IAQ_METRICS columns get a generic 0-100 series
+IAQ_PROFILES = {
+    "PM2.5": (6.0, 10.0, 2.0),
+    "PM10": (12.0, 16.0, 3.0),
+    "CO2": (420.0, 480.0, 25.0),
+    "Temperature": (20.5, 3.0, 0.3),
+    "Humidity": (48.0, -6.0, 2.0),
+}
+STREAM_CHUNK_READINGS = 512  # timestamps per generated chunk of a streamed result
+
+# numpy is imported inside the class so importing this module stays cheap
+
+
+class SyntheticError(Exception):
+    """A statement the synthetic warehouse does not recognize"""
+
+
+def _seconds(value):
+    """Epoch seconds of a datetime, date or ISO string parameter"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value)[:19])
+    return (value - EPOCH).total_seconds()
+
+
+def _datetimes(seconds):
+    """datetime objects for an array of epoch seconds"""
+    import numpy as np
+
+    return np.asarray(seconds, dtype="int64").astype("datetime64[s]").astype(object)
+
+
+class SyntheticCursor:
+    """DB-API style cursor over a synthetic result"""
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.description = None
+        self.arraysize = 1
+        self._rows = iter(())
+
+    def execute(self, sql, params=()):
+        """Answer a canonical statement (rows are produced lazily)"""
+        columns, rows = self.warehouse.answer(sql, list(params or []))
+        self.description = [(column, None, None, None, None, None, True) for column in columns]
+        self._rows = iter(rows)
+        time.sleep(SYNTHETIC_EXECUTE_MS / 1000)
+        return self
+
+    def _fetched(self, rows):
+        """Charge the per-row delay for fetched rows"""
+        if rows and SYNTHETIC_ROW_US:
+            time.sleep(len(rows) * SYNTHETIC_ROW_US / 1_000_000)
+        return rows
+
+    def fetchall(self):
+        return self._fetched(list(self._rows))
+
+    def fetchmany(self, size=None):
+        return self._fetched(list(itertools.islice(self._rows, size or self.arraysize)))
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def close(self):
+        self._rows = iter(())
+
+
+class SyntheticConnection:
+    """DB-API style connection to a SyntheticWarehouse"""
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+
+    def cursor(self):
+        return SyntheticCursor(self.warehouse)
+
+    def close(self):
+        pass
+
+
+class SyntheticWarehouse:
+    """Buildings, areas and readings generated once; statements answered from numpy arrays"""
+
+    def __init__(self, buildings=SYNTHETIC_BUILDINGS, meters=SYNTHETIC_METERS, days=SYNTHETIC_DAYS,
+                 interval_minutes=SYNTHETIC_INTERVAL_MINUTES, seed=SYNTHETIC_SEED, gaps=SYNTHETIC_GAPS, end=None):
+        import numpy as np
+
+        end = end or datetime.now().replace(minute=0, second=0, microsecond=0)
+        self.interval = interval_minutes * 60
+        count = days * 24 * 60 // interval_minutes
+        # Reading times (epoch seconds), oldest first; the newest is the current hour
+        self.times = int(_seconds(end)) - self.interval * np.arange(count - 1, -1, -1, dtype=np.int64)
+        self.latest = end
+
+        self.buildings = [
+            {
+                "BuildingID": 1001 + i,
+                "BuildingName": f"BLD{i + 1:02d}",
+                "Region": ("North", "South", "East", "West")[i % 4],
+                "PortfolioType": ("Office", "Retail", "Laboratory")[i % 3],
+            }
+            for i in range(buildings)
+        ]
+        self.areas = [
+            [
+                {"areaName": f"{b['BuildingName']} Level {k + 1}", "areaCode": f"{b['BuildingName']}-L{k + 1}",
+                 "buildingCode": b["BuildingID"]}
+                for k in range(2 + i % 4)
+            ]
+            for i, b in enumerate(self.buildings)
+        ]
+        self.meter_building = np.repeat(np.arange(buildings), meters)
+        self.meter_codes = [f"{b['BuildingName']}-EM{m + 1}" for b in self.buildings for m in range(meters)]
+
+        rng = np.random.default_rng(seed)
+        hour = (self.times // 3600) % 24
+        weekday = (self.times // 86400 + 3) % 7  # 1970-01-01 was a Thursday; Monday is 0
+        shape = (0.35 + 0.65 * np.exp(-(((hour - 13) / 4.0) ** 2))) * np.where(weekday >= 5, 0.6, 1.0)
+        base = rng.uniform(20, 80, size=len(self.meter_codes))
+        noise = 1 + 0.05 * rng.standard_normal((len(self.meter_codes), count))
+        # Missing readings are NaN
+        self.values = np.round(base[:, None] * shape[None, :] * noise, 2).astype(np.float32)
+        if gaps:
+            self._add_gaps()
+
+        self._iaq = {}  # building index -> (hour starts, {metric alias: areas x hours})
+        self._statements = None
+        logger.info(
+            f"Synthetic warehouse: {buildings} buildings, {len(self.meter_codes)} meters, "
+            f"{count} readings each ({self.values.nbytes / 1048576:.1f} MB)"
+        )
+
+    def _add_gaps(self):
+        """Remove readings: a meter dead for two days, a six-hour outage, a building offline for a day"""
+        import numpy as np
+
+        per_day = 86400 // self.interval
+        count = len(self.times)
+        self.values[min(1, len(self.meter_codes) - 1), max(0, count - 2 * per_day):] = np.nan
+        outage = max(0, count - 10 * per_day)
+        self.values[:, outage:outage + per_day // 4] = np.nan
+        offline = max(0, count - 40 * per_day)
+        self.values[self.meter_building == min(2, len(self.buildings) - 1), offline:offline + per_day] = np.nan
+
+    def connect(self):
+        """A new connection (the ConnectionPool connect callable)"""
+        return SyntheticConnection(self)
+
+    # Statement dispatch
+
+    def statements(self):
+        """database.py's canonical statements, collected on first use"""
+        if self._statements is None:
+            import database
+
+            found = [value for value in vars(database).values() if isinstance(value, Statement)]
+            self._statements = found + list(database.COMPARISONS.values()) + list(database.IAQ_SERIES.values())
+        return self._statements
+
+    def answer(self, sql, params):
+        """(columns, rows iterable) for a canonical statement text and its parameters"""
+        for statement in self.statements():
+            decoded = statement.unbind(sql, params)
+            if decoded is not None:
+                name, _, variant = statement.name.partition(":")
+                handler = getattr(self, f"_{name}", None)
+                if handler is None:
+                    break
+                return handler(*decoded, variant=variant, sql=sql)
+        raise SyntheticError(f"Statement not supported by the synthetic warehouse: {sql.strip()[:120]}")
+
+    # Selections
+
+    def _span(self, filters):
+        """[lo, hi) reading indexes within the time filters"""
+        import numpy as np
+
+        lo, hi = 0, len(self.times)
+        bounds = {
+            "start_date": ("left", True),
+            "after": ("right", True),
+            "end_date": ("right", False),
+            "end_before": ("left", False),
+        }
+        for key, (side, lower) in bounds.items():
+            if filters.get(key) is None:
+                continue
+            index = int(np.searchsorted(self.times, _seconds(filters[key]), side=side))
+            lo, hi = (max(lo, index), hi) if lower else (lo, min(hi, index))
+        return lo, max(lo, hi)
+
+    def _building_indexes(self, building_ids=None):
+        """Indexes of buildings whose BuildingID is among building_ids (all when None)"""
+        if building_ids is None:
+            return list(range(len(self.buildings)))
+        wanted = {str(building_id) for building_id in building_ids}
+        return [i for i, b in enumerate(self.buildings) if str(b["BuildingID"]) in wanted]
+
+    def _pairs(self, filters):
+        """(meter, building, area name) rows of the reading joins, in meter order"""
+        import numpy as np
+
+        building_id = filters.get("building_id")
+        buildings = set(self._building_indexes(None if building_id is None else [building_id]))
+        pairs = []
+        for meter, building in enumerate(self.meter_building.tolist()):
+            if building not in buildings:
+                continue
+            for area in self.areas[building] or [None]:
+                name = area and area["areaName"]
+                if filters.get("area_id") is None or name == filters["area_id"]:
+                    pairs.append((meter, building, name))
+        meters = np.array([meter for meter, _, _ in pairs], dtype=np.int64)
+        return pairs, meters
+
+    def _reading_rows(self, pairs, meters, indexes, building_id_column=False):
+        """Reading rows for the given (meter, area) pairs at the given reading indexes"""
+        import numpy as np
+
+        if not pairs or not len(indexes):
+            return []
+        times = np.repeat(indexes, len(pairs))
+        tiled = np.tile(np.arange(len(pairs)), len(indexes))
+        values = self.values[meters[tiled], times]
+        present = ~np.isnan(values)
+        times, tiled, values = times[present], tiled[present], values[present].astype(np.float64).tolist()
+        stamps = _datetimes(self.times[times])
+        rows = []
+        for pair, stamp, value in zip(tiled.tolist(), stamps, values):
+            meter, building, area = pairs[pair]
+            b = self.buildings[building]
+            row = (b["BuildingName"], area, self.meter_codes[meter], stamp, value, "kWh")
+            rows.append((b["BuildingID"],) + row if building_id_column else row)
+        return rows
+
+    # Handlers, named after the statements
+
+    def _test_connection(self, params, in_values, filters, **_):
+        return [""], [(1,)]
+
+    def _get_buildings(self, params, in_values, filters, **_):
+        columns = ["BuildingID", "BuildingName", "Region", "PortfolioType"]
+        buildings = sorted(self.buildings, key=lambda b: b["BuildingName"])
+        return columns, [tuple(b[column] for column in columns) for b in buildings]
+
+    def _get_areas(self, params, in_values, filters, **_):
+        columns = ["areaName", "areaCode", "buildingCode"]
+        rows = [tuple(area[c] for c in columns) for i in self._building_indexes(params[:1]) for area in self.areas[i]]
+        return columns, sorted(rows)
+
+    def _get_all_areas(self, params, in_values, filters, sql="", **_):
+        columns = ["buildingCode", "areaName", "areaCode"]
+        since = filters.get("since")
+        if since is not None and _seconds(since) >= _seconds(self.latest):
+            rows = []
+        else:
+            rows = [(area["buildingCode"], area["areaName"], area["areaCode"]) for areas in self.areas for area in areas]
+        if "lastSeen" in sql:
+            columns.append("lastSeen")
+            rows = [row + (self.latest,) for row in rows]
+        return columns, rows
+
+    def _get_eaptag_data(self, params, in_values, filters, **_):
+        import numpy as np
+
+        limit = int(params[0])
+        pairs, meters = self._pairs(filters)
+        lo, hi = self._span(filters)
+        # Newest first, ceil(limit / rows per timestamp) timestamps at a time until the TOP is full
+        step = -(-limit // max(1, len(pairs)))
+        rows, top = [], hi
+        while len(rows) < limit and top > lo:
+            indexes = np.arange(top - 1, max(lo, top - step) - 1, -1, dtype=np.int64)
+            rows.extend(self._reading_rows(pairs, meters, indexes))
+            top -= step
+        return READING_COLUMNS, rows[:limit]
+
+    def _get_eaptag_data_since(self, params, in_values, filters, **_):
+        import numpy as np
+
+        limit, since = int(params[0]), params[1]
+        pairs, meters = self._pairs(filters)
+        lo, hi = self._span(dict(filters, after=since))
+        step = -(-limit // max(1, len(pairs)))
+        rows, bottom = [], lo
+        while len(rows) < limit and bottom < hi:
+            indexes = np.arange(bottom, min(hi, bottom + step), dtype=np.int64)
+            rows.extend(self._reading_rows(pairs, meters, indexes, True))
+            bottom += step
+        return ["BuildingID"] + READING_COLUMNS, rows[:limit]
+
+    def _get_latest_reading_time(self, params, in_values, filters, **_):
+        return [""], [(self.latest,)]
+
+    def _iter_eaptag_batches(self, params, in_values, filters, **_):
+        import numpy as np
+
+        # Keyset cursor (timestamp, timestamp, ptagId, ptagId, LocationName)
+        after = filters.pop("after", None)
+        pairs, meters = self._pairs(filters)
+        # Rows of one timestamp in the ORDER BY order: ptagId, then LocationName (NULL as '')
+        order = sorted(range(len(pairs)), key=lambda i: (self.meter_codes[pairs[i][0]], pairs[i][2] or ""))
+        pairs, meters = [pairs[i] for i in order], meters[order]
+        lo, hi = self._span(filters)
+        if after is not None:
+            lo = max(lo, min(hi, int(np.searchsorted(self.times, _seconds(after[0]), side="left"))))
+
+        def stream():
+            # Generated chunk by chunk, so a streamed export stays flat in memory here too
+            first = lo
+            if after is not None and lo < hi and self.times[lo] == _seconds(after[0]):
+                key = (after[2], after[4])
+                rows = self._reading_rows(pairs, meters, np.array([lo], dtype=np.int64))
+                yield from (row for row in rows if (row[2], row[1] or "") > key)
+                first += 1
+            for start in range(first, hi, STREAM_CHUNK_READINGS):
+                indexes = np.arange(start, min(hi, start + STREAM_CHUNK_READINGS), dtype=np.int64)
+                yield from self._reading_rows(pairs, meters, indexes)
+
+        return READING_COLUMNS, stream()
+
+    def _buckets(self, meters, lo, hi, bucket_seconds, offset_seconds=0):
+        """(bucket start seconds, sum, max, min, count) per non-empty bucket of the selected readings"""
+        import numpy as np
+
+        block = self.values[meters, lo:hi].astype(np.float64)
+        if not block.size:
+            empty = np.zeros(0)
+            return empty.astype(np.int64), empty, empty, empty, empty.astype(np.int64)
+        present = ~np.isnan(block)
+        buckets = (self.times[lo:hi] + offset_seconds) // bucket_seconds
+        starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0])
+        counts = np.add.reduceat(present.sum(axis=0), starts)
+        keep = counts > 0
+        return (
+            (buckets[starts] * bucket_seconds - offset_seconds)[keep],
+            np.add.reduceat(np.where(present, block, 0).sum(axis=0), starts)[keep],
+            np.maximum.reduceat(np.where(present, block, -np.inf).max(axis=0), starts)[keep],
+            np.minimum.reduceat(np.where(present, block, np.inf).min(axis=0), starts)[keep],
+            counts[keep],
+        )
+
+    def _get_building_comparison(self, params, in_values, filters, variant="day", **_):
+        columns = ["BuildingID", "BuildingName", "timestamp", "total", "peak", "readings", "areaCount"]
+        lo, hi = self._span(filters)
+        bucket_seconds = 3600 if variant == "hour" else 86400
+        rows = []
+        for i in sorted(self._building_indexes(in_values), key=lambda i: self.buildings[i]["BuildingName"]):
+            b = self.buildings[i]
+            meters = (self.meter_building == i).nonzero()[0]
+            starts, totals, peaks, _, counts = self._buckets(meters, lo, hi, bucket_seconds)
+            rows.extend(
+                (b["BuildingID"], b["BuildingName"], stamp, total, peak, count, len(self.areas[i]))
+                for stamp, total, peak, count in zip(
+                    _datetimes(starts), totals.tolist(), peaks.tolist(), counts.tolist()
+                )
+            )
+        return columns, rows
+
+    def _get_metrics_by_segment(self, params, in_values, filters, **_):
+        import numpy as np
+
+        columns = [
+            "segment", "totalEnergyConsumption", "valueCount", "peakConsumption",
+            "lowestConsumption", "recordCount", "startDate", "endDate",
+        ]
+        origin, hours, _, _, start, end = params
+        lo, hi = self._span({"start_date": start, "end_before": end})
+        meters = np.arange(len(self.meter_codes))
+        # Segments are counted from origin, like DATEDIFF(hour, origin, timestamp)
+        width = int(hours) * 3600
+        starts, totals, peaks, lows, counts = self._buckets(meters, lo, hi, width, -int(_seconds(origin)))
+        times = self.times[lo:hi]
+        firsts = np.searchsorted(times, starts, side="left")
+        lasts = np.searchsorted(times, starts + width, side="left") - 1
+        rows = [
+            (segment, total, count, peak, low, count, first, last)
+            for segment, total, count, peak, low, first, last in zip(
+                _datetimes(starts), totals.tolist(), counts.tolist(), peaks.tolist(), lows.tolist(),
+                _datetimes(times[firsts]) if len(times) else [], _datetimes(times[lasts]) if len(times) else [],
+            )
+        ]
+        return columns, rows
+
+    def _get_dashboard_metrics(self, params, in_values, filters, **_):
+        import numpy as np
+
+        columns = [
+            "totalEnergyConsumption", "averageConsumption", "peakConsumption",
+            "lowestConsumption", "recordCount", "startDate", "endDate",
+        ]
+        lo, hi = self._span(filters)
+        block = self.values[:, lo:hi].astype("float64")
+        block = block[~np.isnan(block)]
+        if not block.size:
+            return columns, [(None, None, None, None, 0, None, None)]
+        stamps = _datetimes(self.times[[lo, hi - 1]])
+        return columns, [
+            (float(block.sum()), float(block.mean()), float(block.max()), float(block.min()), int(block.size),
+             stamps[0], stamps[1])
+        ]
+
+    def _get_coverage_runs(self, params, in_values, filters, **_):
+        import numpy as np
+
+        columns = ["metercode", "firstHour", "lastHour"]
+        lo, hi = self._span({"start_date": params[0]})
+        hours = self.times[lo:hi] // 3600
+        rows = []
+        for meter, code in enumerate(self.meter_codes):
+            covered = np.unique(hours[~np.isnan(self.values[meter, lo:hi])])
+            if not len(covered):
+                continue
+            breaks = np.flatnonzero(np.diff(covered) != 1)
+            firsts = covered[np.r_[0, breaks + 1]] + SQL_EPOCH_HOURS
+            lasts = covered[np.r_[breaks, len(covered) - 1]] + SQL_EPOCH_HOURS
+            rows.extend((code, first, last) for first, last in zip(firsts.tolist(), lasts.tolist()))
+        return columns, rows
+
+    def _iaq_hours(self, building):
+        """Hour starts (epoch seconds) and hourly IAQ values per metric alias for a building's areas"""
+        import numpy as np
+        from database import IAQ_METRICS
+
+        if building not in self._iaq:
+            hours = np.unique(self.times // 3600) * 3600
+            hour = (hours // 3600) % 24
+            weekday = (hours // 86400 + 3) % 7
+            occupied = np.exp(-(((hour - 13) / 3.5) ** 2)) * np.where(weekday >= 5, 0.3, 1.0)
+            rng = np.random.default_rng([SYNTHETIC_SEED, building])
+            areas = max(1, len(self.areas[building]))
+            series = {}
+            for key, name in IAQ_METRICS.items():
+                level, rise, noise = IAQ_PROFILES.get(name, (50.0, 20.0, 10.0))
+                scale = rng.uniform(0.7, 1.3, size=(areas, 1))
+                values = level + rise * scale * occupied[None, :] + noise * rng.standard_normal((areas, len(hours)))
+                series[key] = np.round(values, 1)
+            self._iaq[building] = hours, series
+        return self._iaq[building]
+
+    def _get_iaq_series(self, params, in_values, filters, variant="hour", **_):
+        import numpy as np
+
+        indexes = self._building_indexes(params[:1])
+        if not indexes:
+            return ["areaCode", "areaName", "timestamp", "samples"], []
+        building = indexes[0]
+        hours, series = self._iaq_hours(building)
+        columns = ["areaCode", "areaName", "timestamp", "samples"] + list(series)
+        lo, hi = 0, len(hours)
+        if filters.get("start_date") is not None:
+            lo = int(np.searchsorted(hours, _seconds(filters["start_date"]), side="left"))
+        if filters.get("end_before") is not None:
+            hi = int(np.searchsorted(hours, _seconds(filters["end_before"]), side="left"))
+        hi = max(lo, hi)
+
+        width = 3600 if variant == "hour" else 86400
+        buckets = hours[lo:hi] // width
+        starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0]) if hi > lo else np.zeros(0, dtype=np.int64)
+        counts = np.diff(np.r_[starts, hi - lo])
+        stamps = _datetimes(buckets[starts] * width)
+        means = {key: np.add.reduceat(values[:, lo:hi], starts, axis=1) / counts if len(starts) else values[:, :0]
+                 for key, values in series.items()}
+        rows = []
+        for a, area in enumerate(self.areas[building]):
+            rows.extend(
+                (area["areaCode"], area["areaName"], stamp, count) + tuple(round(float(v), 2) for v in values)
+                for stamp, count, *values in zip(stamps, counts.tolist(), *(means[key][a] for key in series))
+            )
+        return columns, rows
@@ -44,9 +44,9 @@ print("Testing get_eaptag_data()...")
 print("=" * 80)
 
 eaptag_data = get_eaptag_data(limit=5)
-if eaptag_data:
+if eaptag_data is not None:
     print(f"✓ Retrieved {len(eaptag_data)} EA Ptag records")
-    print(f"  Sample: {eaptag_data[0]}")
+    print(f"  Sample: {eaptag_data.iloc[0].to_dict()}")
 else:
     print("✗ No EA Ptag data retrieved")
 